@@ -0,0 +1,105 @@
+"""Archiving the bookmarks of several accounts in a single run.
+
+Accounts are listed in a JSON file::
+
+    [
+        {
+            "token_cache": "alice/access_token.json",
+            "media_output": "alice/media",
+            "manifest_output": "alice/bookmark-manifest.jsonl",
+            "download_index": "alice/index.sqlite3"
+        },
+        {"token_cache": "bob/access_token.json", "media_output": "bob/media"}
+    ]
+
+Relative paths are relative to the directory of the file. Only token_cache and
+media_output are required, manifest_output defaults to bookmark-manifest.jsonl
+next to media_output.
+"""
+import json
+import logging
+from pathlib import Path
+from typing import List, Optional
+
+from .index import DownloadIndex
+
+logger = logging.getLogger("twitter-archive.accounts")
+
+_PATH_KEYS = ("token_cache", "media_output", "manifest_output", "download_index")
+
+
+class Account:
+    """Where to find the token of an account, and where to save its archive."""
+
+    def __init__(
+        self,
+        token_cache: Path,
+        media_output: Path,
+        manifest_output: Optional[Path] = None,
+        download_index: Optional[Path] = None,
+        name: Optional[str] = None,
+    ):
+        """Create a new account.
+
+        :param token_cache: Path to cache access token details.
+        :param media_output: Path to output downloaded media.
+        :param manifest_output: Path to output the bookmark manifest, defaults
+                                to bookmark-manifest.jsonl next to media_output.
+        :param download_index: SQLite index of downloaded media, if any.
+        :param name: Name to log the account as, defaults to media_output.
+        """
+        self.token_cache = Path(token_cache)
+        self.media_output = Path(media_output)
+        if manifest_output is None:
+            manifest_output = self.media_output.parent / "bookmark-manifest.jsonl"
+        self.manifest_output = Path(manifest_output)
+        self.download_index = None if download_index is None else Path(download_index)
+        self.name = name or str(self.media_output)
+        self.index = None
+
+    def open(self) -> None:
+        """Create the media directory, and open the download index if any.
+
+        A new download index is filled with the media already downloaded.
+        """
+        self.media_output.mkdir(exist_ok=True, parents=True)
+        if self.download_index is not None:
+            self.index = DownloadIndex(self.download_index, self.media_output)
+            logger.info("Using download index '%s'", self.index.path)
+            if self.index.created:
+                self.index.rebuild()
+
+    def close(self) -> None:
+        """Close the download index if any."""
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    def __repr__(self) -> str:
+        """Name the account."""
+        return f"Account({self.name!r})"
+
+
+def load_accounts(path: Path) -> List[Account]:
+    """Read a list of accounts.
+
+    :param path: Path to the JSON file of accounts.
+    :returns: Every account in the file.
+    :raises: ValueError: The file is not a list of accounts, or an account is
+                         missing token_cache or media_output.
+    """
+    path = Path(path)
+    with open(path, "r") as fp:
+        entries = json.load(fp)
+    if not isinstance(entries, list):
+        raise ValueError(f"'{path}' is not a list of accounts")
+
+    accounts = []
+    for i, entry in enumerate(entries):
+        missing = {"token_cache", "media_output"} - set(entry)
+        if missing:
+            raise ValueError(f"Account {i} in '{path}' is missing {sorted(missing)}")
+        paths = {k: path.parent / v for k, v in entry.items() if k in _PATH_KEYS}
+        accounts.append(Account(name=entry.get("name"), **paths))
+    logger.info("Loaded %d accounts from '%s'", len(accounts), path)
+    return accounts
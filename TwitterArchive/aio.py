@@ -0,0 +1,318 @@
+"""Asyncio download engine.
+
+An alternative to the download threads which keeps many media transfers in
+flight on a single event loop, for when more threads stop adding throughput.
+Requires the optional aiohttp dependency::
+
+    $ pip install twitter-archive[async]
+"""
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    DefaultDict,
+    Generator,
+    Iterable,
+    Optional,
+    Tuple,
+)
+
+from tqdm import tqdm
+
+from .core import (
+    accepts_ranges,
+    download_steps,
+    handle_fetch_error,
+    iter_downloads,
+    part_path,
+    range_headers,
+    record_transfer,
+    resume_offset,
+)
+from .concurrency import AdaptiveLimit
+from .fileio import DEFAULT_CHUNK_SIZE, open_part
+from .index import DownloadIndex
+from .metrics import Metrics
+from .net import DEFAULT_TIMEOUT, IncompleteDownloadError, RetryPolicy
+from .pipeline import DEFAULT_QUEUE_SIZE
+from .progress import Progress
+from .store import MediaStore
+from .throttle import TokenBucket
+from .variants import VariantPolicy
+
+try:
+    import aiohttp
+except ImportError as e:
+    raise ImportError(
+        "The async engine requires aiohttp, install twitter-archive[async]"
+    ) from e
+
+logger = logging.getLogger("twitter-archive.aio")
+
+_DONE = object()
+
+
+async def fetch_media_async(
+    url: str,
+    dest: Path,
+    session: aiohttp.ClientSession,
+    disable_progress_bar: bool = True,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[Progress] = None,
+    throttle: Optional[TokenBucket] = None,
+) -> bool:
+    """Download a single media file, see core.fetch_media().
+
+    Partial downloads are resumed the same way, from their '.part' file.
+
+    :param url: URL of the media.
+    :param dest: Path to save the media.
+    :param session: Session to make all requests with.
+    :param disable_progress_bar: Silence the progress bar of the file.
+    :param chunk_size: Size of the chunks to download content in.
+    :param progress: Aggregate progress to count the bytes downloaded in.
+    :param throttle: Bandwidth limit shared with every other transfer.
+    :returns: Whether the download completed.
+    """
+    if throttle is not None:
+        chunk_size = min(chunk_size, throttle.chunk_size)
+    part = part_path(dest)
+    offset = part.stat().st_size if part.is_file() else 0
+    resp = await session.get(url, headers=range_headers(offset))
+    start = resume_offset(offset, resp.status, resp.headers)
+    if start is None:
+        logger.info("Cannot resume '%s', starting over", part)
+        resp.release()
+        resp = await session.get(url)
+        start = 0
+    elif start:
+        logger.info("Resuming '%s' from byte %d", part, start)
+
+    length = resp.headers.get("content-length")
+    length = None if length is None else int(length)
+    async with resp:
+        # Never save an error page as media.
+        resp.raise_for_status()
+        # Only tweets with media to save get a directory.
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        resumable = accepts_ranges(resp.status, resp.headers)
+        with open_part(part, start, length, resumable) as f, tqdm(
+            ascii=True,
+            disable=disable_progress_bar,
+            total=length,
+            desc=dest.name,
+            leave=True,
+            unit="B",
+            unit_scale=True,
+            ncols=80,
+        ) as bar:
+            logger.info("Downloading to '%s'", dest)
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                f.write(chunk)
+                bar.update(len(chunk))
+                if progress is not None:
+                    progress.update(len(chunk))
+                if throttle is not None:
+                    await throttle.consume_async(len(chunk))
+
+    if length is not None and part.stat().st_size != start + length:
+        logger.warning("Incomplete download of '%s', will resume later", dest)
+        return False
+    os.replace(part, dest)
+    return True
+
+
+async def download_tweet_async(
+    tweet_obj: dict,
+    base_dir: Path,
+    session: aiohttp.ClientSession,
+    clobber: bool = True,
+    disable_progress_bar: bool = True,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    store: Optional[MediaStore] = None,
+    store_locks: Optional[DefaultDict[str, asyncio.Lock]] = None,
+    index: Optional[DownloadIndex] = None,
+    limit: Optional[AdaptiveLimit] = None,
+    retry: Optional[RetryPolicy] = None,
+    metrics: Optional[Metrics] = None,
+    policy: Optional[VariantPolicy] = None,
+    layout: str = "flat",
+    progress: Optional[Progress] = None,
+    throttle: Optional[TokenBucket] = None,
+) -> None:
+    """Download media from a single tweet, see core.download_tweet().
+
+    :param tweet_obj: Dict including all the attributes of the tweet.
+    :param base_dir: Base directory to save any media.
+    :param session: Session to make all requests with.
+    :param clobber: Overwrite existing files.
+    :param disable_progress_bar: Silence the progress bar of the file.
+    :param chunk_size: Size of the chunks to download content in.
+    :param store: Content-addressed store to deduplicate media with.
+    :param store_locks: Locks per media_key, shared by every coroutine using the
+                        store.
+    :param index: Index of downloaded media, see index.DownloadIndex.
+    :param limit: Adaptive limit on the number of transfers in flight.
+    :param retry: Policy to retry failed transfers with. Media that still fails
+                  is deferred with the policy, to be retried later.
+    :param metrics: Metrics to record transfers and bytes downloaded in.
+    :param policy: Policy to choose media variants with, see core.iter_media().
+    :param layout: Directory layout to save media in, see layout.LAYOUTS.
+    :param progress: Aggregate progress to count files and bytes in.
+    :param throttle: Bandwidth limit shared by every transfer, see
+                     throttle.TokenBucket.
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    progress = progress if progress is not None else Progress(disable=True)
+    fetch_one = functools.partial(
+        fetch_media_async,
+        session=session,
+        disable_progress_bar=disable_progress_bar,
+        chunk_size=chunk_size,
+        progress=progress,
+        throttle=throttle,
+    )
+
+    async def attempt(url: str, dest: Path) -> bool:
+        start = time.perf_counter()
+        complete = None
+        try:
+            if limit is None:
+                complete = await fetch_one(url, dest)
+            else:
+                async with limit.async_slot() as transfer:
+                    complete = await fetch_one(url, dest)
+                    transfer.error = not complete
+                    transfer.nbytes = dest.stat().st_size if complete else 0
+        finally:
+            record_transfer(metrics, dest, complete, time.perf_counter() - start)
+        if not complete and retry is not None:
+            raise IncompleteDownloadError(f"Incomplete download of '{dest}'")
+        return complete
+
+    async def fetch(url: str, dest: Path) -> bool:
+        try:
+            if retry is None:
+                return await attempt(url, dest)
+            return await retry.call_async(lambda: attempt(url, dest), url)
+        except Exception as e:
+            return handle_fetch_error(e, url, tweet_obj, retry)
+
+    if store_locks is None:
+        store_locks = defaultdict(asyncio.Lock)
+    downloads = iter_downloads(
+        tweet_obj, base_dir, clobber, store, index, metrics, policy, layout, progress
+    )
+    for url, dest, key in downloads:
+        steps = download_steps(url, dest, key, store, index, metrics)
+        if key is None:
+            await run_steps_async(steps, fetch)
+        else:
+            async with store_locks[key]:
+                await run_steps_async(steps, fetch)
+
+
+async def run_steps_async(
+    steps: Generator[Tuple[str, Path], bool, None],
+    fetch: Callable[[str, Path], Awaitable[bool]],
+) -> None:
+    """Make the transfers of core.download_steps() on an event loop.
+
+    :param steps: Steps of a download.
+    :param fetch: Called with each URL and path, returns whether it completed.
+    """
+    try:
+        transfer = next(steps)
+        while True:
+            transfer = steps.send(await fetch(*transfer))
+    except StopIteration:
+        pass
+
+
+async def _run(
+    tweets: Iterable[dict],
+    concurrency: int,
+    maxsize: int,
+    download_kwargs: dict,
+) -> None:
+    loop = asyncio.get_running_loop()
+    work = asyncio.Queue(maxsize=maxsize)
+    it = iter(tweets)
+    store_locks = defaultdict(asyncio.Lock)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    connect_timeout, read_timeout = DEFAULT_TIMEOUT
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=connect_timeout, sock_read=read_timeout
+    )
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        async def produce() -> None:
+            try:
+                while True:
+                    # Fetching bookmarks blocks on the network and rate limits,
+                    # so pull from the source off the event loop.
+                    tweet = await loop.run_in_executor(None, next, it, _DONE)
+                    if tweet is _DONE:
+                        break
+                    await work.put(tweet)
+            finally:
+                close = getattr(it, "close", None)
+                if close is not None:
+                    try:
+                        await loop.run_in_executor(None, close)
+                    except ValueError:
+                        # Cancelled while still running in the executor.
+                        pass
+            for _ in range(concurrency):
+                await work.put(_DONE)
+
+        async def consume() -> None:
+            while True:
+                tweet = await work.get()
+                if tweet is _DONE:
+                    return
+                await download_tweet_async(
+                    tweet,
+                    session=session,
+                    store_locks=store_locks,
+                    **download_kwargs,
+                )
+
+        tasks = [asyncio.create_task(produce())]
+        tasks += [asyncio.create_task(consume()) for _ in range(concurrency)]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+
+
+def run_async_pipeline(
+    tweets: Iterable[dict],
+    concurrency: int,
+    maxsize: int = DEFAULT_QUEUE_SIZE,
+    **download_kwargs: Any,
+) -> None:
+    """Download media from every tweet on an asyncio event loop.
+
+    Mirrors pipeline.run_pipeline(), but with concurrency coroutines instead of
+    threads, sharing one pool of at most concurrency connections.
+
+    :param tweets: Tweets to download, usually a generator.
+    :param concurrency: Maximum number of transfers in flight.
+    :param maxsize: Maximum number of tweets waiting to be downloaded.
+    :param download_kwargs: Passed on to download_tweet_async(), i.e. base_dir.
+    """
+    logger.info("Downloading with up to %d concurrent transfers", concurrency)
+    asyncio.run(_run(tweets, concurrency, maxsize, download_kwargs))
@@ -1,14 +1,20 @@
 """Main entrypoint to the program from CLI."""
 import argparse
-import itertools
-import json
 import logging
 import shutil
-from multiprocessing.pool import ThreadPool
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
 
 from . import __version__
-from .core import auth, download_tweet, get_bookmarks
+
+# Everything else is imported once the arguments are parsed, so --help and
+# --version are instant, and only when needed, so downloading from a manifest
+# never imports the Twitter API client.
+if TYPE_CHECKING:
+    from .accounts import Account
+    from .metrics import Metrics
+    from .store import MediaStore
+    from .variants import VariantPolicy
 
 
 class CapitalizedHelpFormatter(argparse.ArgumentDefaultsHelpFormatter):
@@ -39,6 +45,44 @@ def nat_int(s: str) -> int:
     return int_val
 
 
+def whole_int(s: str) -> int:
+    """Type validator for non-negative integers."""
+    int_val = int(s)
+    if int_val < 0:
+        raise argparse.ArgumentTypeError("Cannot be less than 0")
+    return int_val
+
+
+def pos_float(s: str) -> float:
+    """Type validator for positive numbers."""
+    float_val = float(s)
+    if float_val <= 0:
+        raise argparse.ArgumentTypeError("Must be greater than 0")
+    return float_val
+
+
+def size_int(s: str) -> int:
+    """Type validator for sizes in bytes, with an optional K, M or G suffix."""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    unit = units.get(s[-1:].upper(), 1)
+    size = float(s[:-1] if unit > 1 else s) * unit
+    if size < 1:
+        raise argparse.ArgumentTypeError("Cannot be less than 1 byte")
+    return int(size)
+
+
+def shard_spec(s: str) -> Tuple[int, int]:
+    """Type validator for shards, as I/N, returned as (I - 1, N)."""
+    number, sep, count = s.partition("/")
+    try:
+        number, count = int(number), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Must be I/N, i.e. 1/4")
+    if not sep or not 1 <= number <= count:
+        raise argparse.ArgumentTypeError("Must be I/N, from 1/N to N/N")
+    return number - 1, count
+
+
 def build_parser(exit_on_error: bool = True) -> argparse.ArgumentParser:
     """Build the CLI parser.
 
@@ -69,11 +113,33 @@ def build_parser(exit_on_error: bool = True) -> argparse.ArgumentParser:
         help="Specify the client ID.",
     )
 
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Adapt transfers in flight to throughput and errors, "
+        "up to --num-download-threads.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "async"],
+        default="threads",
+        help="Download engine, async requires the 'async' extra.",
+    )
     parser.add_argument(
         "--headless",
         action="store_true",
         help="Don't use interactive authentication.",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only fetch and download bookmarks newer than the manifest output.",
+    )
+    parser.add_argument(
+        "--no-referenced-media",
+        action="store_true",
+        help="Don't fetch media of quoted and retweeted tweets.",
+    )
     parser.add_argument(
         "--no-clobber",
         action="store_true",
@@ -84,13 +150,32 @@ def build_parser(exit_on_error: bool = True) -> argparse.ArgumentParser:
         metavar="N",
         type=nat_int,
         default=8,
-        help="Number of threads to use while downloading media.",
+        help="Number of threads (async: transfers) to use while downloading media.",
+    )
+    parser.add_argument(
+        "--max-bandwidth",
+        metavar="SIZE",
+        type=size_int,
+        help="Most bytes per second to download media at, across every "
+        "transfer, i.e. 5M.",
+    )
+    parser.add_argument(
+        "--retries",
+        metavar="N",
+        type=whole_int,
+        default=4,
+        help="Number of times to retry media that fails to download.",
     )
     parser.add_argument(
         "--quiet",
         action="store_true",
         help="Disable download progress bars",
     )
+    parser.add_argument(
+        "--progress-per-file",
+        action="store_true",
+        help="Also show a progress bar for every media file.",
+    )
     parser.add_argument(
         "-o",
         "--media-output",
@@ -101,6 +186,111 @@ def build_parser(exit_on_error: bool = True) -> argparse.ArgumentParser:
         help="Path to output downloaded media.",
     )
 
+    parser.add_argument(
+        "--layout",
+        choices=("flat", "hash", "date"),
+        default="flat",
+        help="Directory layout of --media-output: a directory per tweet (flat), "
+        "or fanned out by a hash of the tweet ID or by month.",
+    )
+    parser.add_argument(
+        "--migrate-layout",
+        action="store_true",
+        help="Move media already in --media-output into --layout and exit.",
+    )
+
+    parser.add_argument(
+        "--media-store",
+        metavar="DIR",
+        action="store",
+        type=Path,
+        help="Save media once in a deduplicated store, linked into --media-output.",
+    )
+
+    parser.add_argument(
+        "--download-index",
+        metavar="FILE",
+        action="store",
+        type=Path,
+        help="SQLite index of downloaded media, used instead of checking files.",
+    )
+    parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Rebuild --download-index from the files in --media-output and exit.",
+    )
+    parser.add_argument(
+        "--max-bitrate",
+        metavar="BPS",
+        type=nat_int,
+        help="Download the best video variant of at most BPS bits/s.",
+    )
+    parser.add_argument(
+        "--max-resolution",
+        metavar="PIXELS",
+        type=nat_int,
+        help="Download the best video variant with a shorter side of at most "
+        "PIXELS, i.e. 720.",
+    )
+    parser.add_argument(
+        "--byte-budget",
+        metavar="SIZE",
+        type=size_int,
+        help="Estimated bytes of video to download in the run, i.e. 10G. "
+        "Videos are downgraded to fit, and skipped once it is spent.",
+    )
+    parser.add_argument(
+        "--photo-size",
+        choices=("orig", "large", "medium", "small"),
+        help="Size of photos to download (default: Twitter's default size).",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Report the media that would be downloaded, and the bytes saved by "
+        "the options above, without downloading anything.",
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="I/N",
+        type=shard_spec,
+        help="Only download the I-th of N slices of --manifest-input, to split "
+        "the download across N hosts.",
+    )
+    parser.add_argument(
+        "--merge-shards",
+        metavar="DIR",
+        nargs="+",
+        type=Path,
+        help="Move the media downloaded by each shard in DIR into --media-output, "
+        "then --verify it.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Report media of --manifest-input missing from --media-output and "
+        "exit.",
+    )
+    parser.add_argument(
+        "--metrics-output",
+        metavar="FILE",
+        action="store",
+        type=Path,
+        help="Write counters and timings of the run to FILE.",
+    )
+    parser.add_argument(
+        "--metrics-format",
+        choices=("json", "prometheus"),
+        default="json",
+        help="Format of --metrics-output, prometheus for a node_exporter textfile.",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        metavar="SECONDS",
+        type=pos_float,
+        help="Also write --metrics-output every SECONDS during the run.",
+    )
+
     # Mutually exclusive options.
     manifest_group = parser.add_mutually_exclusive_group()
     manifest_group.add_argument(
@@ -111,14 +301,22 @@ def build_parser(exit_on_error: bool = True) -> argparse.ArgumentParser:
         type=Path,
         help="Use an existing manifest and download all media.",
     )
+    manifest_group.add_argument(
+        "--accounts",
+        action="store",
+        metavar="FILE",
+        type=Path,
+        help="Archive every account listed in FILE (JSON) at once, sharing one "
+        "download pool and a media store (default: media-store next to FILE).",
+    )
     manifest_group.add_argument(
         "-m",
         "--manifest-output",
         action="store",
         metavar="FILE",
         type=Path,
-        default=Path("./bookmark-manifest.json"),
-        help="Path to output bookmark manifest.",
+        default=Path("./bookmark-manifest.jsonl"),
+        help="Path to output bookmark manifest (JSON Lines).",
     )
 
     # Generic
@@ -161,6 +359,9 @@ def _setup_logging(lvl: int) -> logging.Logger:
     logger = logging.getLogger("twitter-archive")
     # My code uses this log level
     logger.setLevel(log_level)
+    if log_level == logging.DEBUG:
+        # Shows each new connection, to check they are being reused.
+        logging.getLogger("urllib3.connectionpool").setLevel(logging.DEBUG)
     logger.debug(
         "Initialized logger with log level %s (verbose=%s)",
         logging._levelToName[log_level],
@@ -179,38 +380,289 @@ def main() -> None:
     args = parser.parse_args()
     args = vars(args)
 
-    logger = _setup_logging(args["verbose"])
+    _setup_logging(args["verbose"])
+
+    from .accounts import Account, load_accounts
+    from .metrics import Metrics, MetricsExporter
+
+    if args["accounts"] is not None:
+        if args["download_index"] is not None or args["reindex"]:
+            parser.error("Give each account its own download_index with --accounts")
+        if args["engine"] == "async":
+            parser.error("--accounts is only supported by the threads engine")
+        accounts = load_accounts(args["accounts"])
+    else:
+        accounts = [
+            Account(
+                token_cache="access_token.json",
+                media_output=args["media_output"],
+                manifest_output=args["manifest_output"],
+                download_index=args["download_index"],
+            )
+        ]
+
+    if args["manifest_input"] is None:
+        for flag in ("shard", "merge_shards", "verify"):
+            if args[flag]:
+                parser.error(f"--{flag.replace('_', '-')} requires --manifest-input")
+    if args["merge_shards"] or args["verify"]:
+        (account,) = accounts
+        _verify(args, account)
+        return
+
+    if args["migrate_layout"]:
+        from .layout import migrate
+
+        for account in accounts:
+            migrate(account.media_output, args["layout"])
+            if account.download_index is not None:
+                # The index records where media was, not where it is now.
+                account.open()
+                account.index.rebuild()
+                account.close()
+        return
+
+    if args["reindex"]:
+        (account,) = accounts
+        if account.download_index is None:
+            parser.error("--reindex requires --download-index")
+        account.open()
+        account.index.rebuild()
+        account.close()
+        return
+
+    metrics = Metrics()
+    exporter = None
+    if args["metrics_output"] is not None:
+        exporter = MetricsExporter(
+            metrics,
+            args["metrics_output"],
+            args["metrics_format"],
+            args["metrics_interval"],
+        )
+
+    try:
+        for account in accounts:
+            account.open()
+        _run(args, accounts, metrics)
+    finally:
+        for account in accounts:
+            account.close()
+        if exporter is not None:
+            exporter.stop()
 
-    logger.debug("Authenticating")
-    client = auth(
-        headless=args["headless"],
-        client_id=args["client_id"],
-        client_secret=args["client_secret"],
-        use_dotenv=True,
-    )
+
+def _policy(args: dict, required: bool = False) -> Optional["VariantPolicy"]:
+    from .variants import VariantPolicy
+
+    options = {
+        "max_bitrate": args["max_bitrate"],
+        "max_resolution": args["max_resolution"],
+        "byte_budget": args["byte_budget"],
+        "photo_size": args["photo_size"],
+    }
+    if not required and all(i is None for i in options.values()):
+        return None
+    return VariantPolicy(**options)
+
+
+def _verify(args: dict, account: "Account") -> None:
+    from .layout import merge
+    from .manifest import read_manifest
+    from .shard import select_shard, verify
+
+    if args["merge_shards"]:
+        merge(args["merge_shards"], account.media_output, args["layout"])
+        if account.download_index is not None:
+            account.open()
+            account.index.rebuild()
+            account.close()
+
+    tweets = read_manifest(args["manifest_input"])
+    if args["shard"] is not None:
+        tweets = select_shard(tweets, *args["shard"])
+    missing = verify(tweets, account.media_output, args["layout"], _policy(args))
+    for dest in missing:
+        print(f"Missing '{dest}'")
+    if missing:
+        print(f"{len(missing)} media files missing from '{account.media_output}'")
+        raise SystemExit(1)
+    print(f"All media present in '{account.media_output}'")
+
+
+def _run(args: dict, accounts: List["Account"], metrics: "Metrics") -> None:
+    from .manifest import read_manifest
+    from .pipeline import merge_sources
+    from .store import MediaStore
+
+    logger = logging.getLogger("twitter-archive")
 
     if args["manifest_input"] is not None:
-        logger.info("Loaded existing manifest from '%s'", args["manifest_input"])
-        with open(args["manifest_input"], "r") as fp:
-            tweets = json.load(fp)
+        # Everything needed is in the manifest, never talk to Twitter.
+        logger.info("Streaming existing manifest from '%s'", args["manifest_input"])
+        (account,) = accounts
+        tweets = read_manifest(args["manifest_input"])
+        if args["shard"] is not None:
+            from .shard import select_shard
+
+            tweets = select_shard(tweets, *args["shard"])
+            logger.info(
+                "Downloading shard %d/%d", args["shard"][0] + 1, args["shard"][1]
+            )
+        items = ((account, i) for i in tweets)
     else:
+        from .core import auth, get_bookmarks
+
+        sources = []
+        for account in accounts:
+            logger.debug("Authenticating %s", account)
+            client = auth(
+                cache_path=account.token_cache,
+                headless=args["headless"],
+                client_id=args["client_id"],
+                client_secret=args["client_secret"],
+                use_dotenv=True,
+                metrics=metrics,
+            )
+
+            tweets = get_bookmarks(
+                client,
+                save_path=account.manifest_output,
+                incremental=args["incremental"],
+                metrics=metrics,
+                hydrate=not args["no_referenced_media"],
+            )
+            sources.append((account, tweets))
+
         logger.info("Fetching manifest from Twitter.")
-        tweets = get_bookmarks(client, save_path=args["manifest_output"])
+        if len(sources) == 1:
+            ((account, tweets),) = sources
+            items = ((account, i) for i in tweets)
+        else:
+            # Every account has its own rate limit, so fetch them all at once.
+            items = merge_sources(sources)
+
+    # A dry run reports on the default variants too.
+    policy = _policy(args, required=args["dry_run"])
+    if args["dry_run"]:
+        from .core import iter_media
+
+        for account, tweet in items:
+            for _ in iter_media(tweet, account.media_output, policy, args["layout"]):
+                pass
+        print(policy.report())
+        return
 
-    base_dir = Path(args["media_output"])
-    base_dir.mkdir(exist_ok=True, parents=True)
+    store_path = args["media_store"]
+    if store_path is None and args["accounts"] is not None:
+        # The same media is often bookmarked by several accounts.
+        store_path = args["accounts"].parent / "media-store"
+    store = None
+    if store_path is not None:
+        store = MediaStore(store_path)
+        logger.info("Deduplicating media in store '%s'", store.root)
+
+    _download_all(items, accounts, args, store, metrics, policy)
+    if policy is not None:
+        logger.info("Media variants chosen:\n%s", policy.report())
+
+
+def _download_all(
+    items: Iterable[Tuple["Account", dict]],
+    accounts: List["Account"],
+    args: dict,
+    store: Optional["MediaStore"],
+    metrics: "Metrics",
+    policy: Optional["VariantPolicy"],
+) -> None:
+    from .concurrency import AdaptiveLimit
+    from .core import download_tweet
+    from .net import CircuitBreaker, RetryPolicy, log_session_stats, new_session
+    from .pipeline import run_pipeline
+    from .progress import Progress
+    from .throttle import TokenBucket
+
+    logger = logging.getLogger("twitter-archive")
 
     num_download_threads = args["num_download_threads"]
-    logger.info("Downloading all media with %d threads", num_download_threads)
-    if num_download_threads == 1:
-        for tweet in tweets:
-            download_tweet(tweet, base_dir, not args["no_clobber"], args["quiet"])
-    else:
-        pool = ThreadPool(num_download_threads)
-        payloads = zip(
-            tweets,
-            itertools.repeat(base_dir),
-            itertools.repeat(not args["no_clobber"]),
-            itertools.repeat(args["quiet"]),
+    # Accounts share hosts, but failed tweets are retried for each account.
+    breaker = CircuitBreaker()
+    retries = {
+        account: RetryPolicy(attempts=args["retries"] + 1, breaker=breaker)
+        for account in accounts
+    }
+    limit = None
+    if args["adaptive"]:
+        limit = AdaptiveLimit(num_download_threads)
+    throttle = None
+    if args["max_bandwidth"] is not None:
+        throttle = TokenBucket(args["max_bandwidth"])
+        logger.info("Limiting downloads to %d bytes/s", throttle.rate)
+
+    # One bar for the whole run, per file bars are opt-in.
+    progress = Progress(disable=args["quiet"])
+    download_kwargs = dict(
+        progress=progress,
+        disable_progress_bar=args["quiet"] or not args["progress_per_file"],
+        store=store,
+        limit=limit,
+        throttle=throttle,
+        metrics=metrics,
+        policy=policy,
+        layout=args["layout"],
+    )
+
+    def run(items: Iterable[Tuple["Account", dict]], clobber: bool) -> None:
+        if args["engine"] == "async":
+            from .aio import run_async_pipeline
+
+            (account,) = accounts
+            run_async_pipeline(
+                (tweet for _, tweet in items),
+                num_download_threads,
+                base_dir=account.media_output,
+                clobber=clobber,
+                index=account.index,
+                retry=retries[account],
+                **download_kwargs,
+            )
+            return
+
+        logger.info("Downloading all media with %d threads", num_download_threads)
+        with new_session(num_download_threads) as session:
+
+            def download(item: Tuple["Account", dict]) -> None:
+                account, tweet = item
+                download_tweet(
+                    tweet,
+                    account.media_output,
+                    clobber=clobber,
+                    session=session,
+                    index=account.index,
+                    retry=retries[account],
+                    **download_kwargs,
+                )
+
+            # Fetching (or reading the manifest) happens on this thread,
+            # downloads start as soon as the first tweet arrives.
+            run_pipeline(items, download, num_download_threads)
+            log_session_stats(session)
+
+    with progress:
+        run(items, not args["no_clobber"])
+
+        deferred = [(a, tweet) for a in accounts for tweet in retries[a].drain()]
+        if deferred:
+            # Give every host a fresh chance, media that made it is not refetched.
+            logger.warning("Retrying %d tweets with failed media", len(deferred))
+            breaker.reset()
+            run(deferred, False)
+
+    failed = [(a, tweet) for a in accounts for tweet in retries[a].drain()]
+    if failed:
+        logger.error(
+            "Failed to download media from %d tweets: %s",
+            len(failed),
+            ", ".join(str(tweet["id"]) for _, tweet in failed),
         )
-        pool.starmap(download_tweet, payloads)
+        raise SystemExit(1)
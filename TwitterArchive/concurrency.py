@@ -0,0 +1,172 @@
+"""Adaptive limit on the number of media transfers in flight.
+
+Too few concurrent transfers waste bandwidth, too many get throttled or reset
+by the CDN. The limit is adjusted at runtime, AIMD style: it grows by one while
+transfers succeed without latency degrading, and is halved as soon as
+throttling, timeouts or dropped connections are seen. The configured number of
+download threads is the upper bound.
+"""
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from typing import AsyncIterator, Iterator
+
+from .net import is_congestion
+
+logger = logging.getLogger("twitter-archive.concurrency")
+
+# Seconds of latency increase ignored as jitter, for very small transfers.
+_LATENCY_SLACK = 0.05
+
+
+class Transfer:
+    """Outcome of a single transfer, filled in by the caller."""
+
+    def __init__(self):
+        """Start timing a new transfer."""
+        self.start = time.monotonic()
+        self.nbytes = 0
+        self.error = False
+
+
+class AdaptiveLimit:
+    """AIMD controller for the number of transfers in flight."""
+
+    def __init__(
+        self,
+        maximum: int,
+        minimum: int = 1,
+        initial: int = 4,
+        window: float = 2.0,
+        latency_tolerance: float = 2.0,
+    ):
+        """Create a new limit.
+
+        :param maximum: Upper bound on the limit.
+        :param minimum: Lower bound on the limit.
+        :param initial: Limit to start at.
+        :param window: Seconds of transfers to observe between adjustments.
+        :param latency_tolerance: Stop growing once mean latency exceeds the
+                                  best mean latency seen by this factor.
+        """
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.limit = max(self.minimum, min(initial, maximum))
+        self.window = window
+        self.latency_tolerance = latency_tolerance
+
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._async_cond = None
+        self._async_loop = None
+
+        self._window_start = time.monotonic()
+        self._done = 0
+        self._errors = 0
+        self._bytes = 0
+        self._latency = 0.0
+        self._best_latency = None
+        self._last_decrease = float("-inf")
+
+    def _finish(self, transfer: Transfer, error: bool) -> None:
+        """Account for a finished transfer, adjusting the limit if due."""
+        now = time.monotonic()
+        self._in_flight -= 1
+        self._done += 1
+        self._errors += int(error or transfer.error)
+        self._bytes += transfer.nbytes
+        self._latency += now - transfer.start
+
+        if self._errors:
+            # Back off straight away, but at most once per window so a burst
+            # of failures from the same outage only halves the limit once.
+            if now - self._last_decrease >= self.window:
+                self._last_decrease = now
+                self._adjust(max(self.minimum, self.limit // 2), now)
+        elif now - self._window_start >= self.window and self._done >= self.limit:
+            mean = self._latency / self._done
+            if self._best_latency is None or mean < self._best_latency:
+                self._best_latency = mean
+            if mean <= self._best_latency * self.latency_tolerance + _LATENCY_SLACK:
+                self._adjust(min(self.maximum, self.limit + 1), now)
+            else:
+                self._adjust(max(self.minimum, self.limit - 1), now)
+
+    def _adjust(self, limit: int, now: float) -> None:
+        elapsed = max(now - self._window_start, 1e-9)
+        if limit != self.limit:
+            logger.info(
+                "Adjusting transfers in flight %d -> %d (%.1f KB/s, %d errors)",
+                self.limit,
+                limit,
+                self._bytes / elapsed / 1024,
+                self._errors,
+            )
+        self.limit = limit
+        self._window_start = now
+        self._done = 0
+        self._errors = 0
+        self._bytes = 0
+        self._latency = 0.0
+
+    @contextlib.contextmanager
+    def slot(self) -> Iterator[Transfer]:
+        """Wait for, and hold, a transfer slot.
+
+        Exceptions raised while holding the slot count as errors if they are
+        a sign of congestion, see net.is_congestion().
+
+        :returns: The transfer, to record its size and errors in.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+        transfer = Transfer()
+        error = False
+        try:
+            yield transfer
+        except BaseException as e:
+            # Anything else, i.e. a 404, still completed the transfer.
+            error = is_congestion(e)
+            if error:
+                logger.info("Backing off after: %s", e)
+            raise
+        finally:
+            with self._cond:
+                self._finish(transfer, error)
+                self._cond.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def async_slot(self) -> AsyncIterator[Transfer]:
+        """Wait for, and hold, a transfer slot on an event loop, see slot().
+
+        :returns: The transfer, to record its size and errors in.
+        """
+        # A condition is bound to the loop it is first used on, and every run
+        # of the async engine, i.e. the retry pass, has a loop of its own.
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_cond = asyncio.Condition()
+            self._async_loop = loop
+
+        async with self._async_cond:
+            await self._async_cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+        transfer = Transfer()
+        error = False
+        try:
+            yield transfer
+        except BaseException as e:
+            # Anything else, i.e. a 404, still completed the transfer.
+            error = is_congestion(e)
+            if error:
+                logger.info("Backing off after: %s", e)
+            raise
+        finally:
+            async with self._async_cond:
+                self._finish(transfer, error)
+                self._async_cond.notify_all()
@@ -4,24 +4,67 @@ Contains the major interactions with external APIs.
 Handles authentication with Twitter, and fetching all necessary Tweets.
 """
 import datetime
+import functools
 import http.server
 import json
 import logging
 import os
+import re
 import socketserver
 import time
 from json import JSONEncoder
 from pathlib import Path
 from socket import socket
-from typing import Any, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Generator,
+    Iterator,
+    Mapping,
+    Optional,
+    Tuple,
+)
 from urllib.parse import urlparse, urlunparse
 
 import requests
-import tweepy
 from tqdm import tqdm
 
+from .concurrency import AdaptiveLimit
+from .fileio import DEFAULT_CHUNK_SIZE, copy_stream, open_part
+from .index import DownloadIndex
+from .layout import tweet_dir
+from .manifest import (
+    ManifestWriter,
+    clear_checkpoint,
+    read_checkpoint,
+    read_manifest_ids,
+    write_checkpoint,
+)
+from .metrics import Metrics
+from .net import (
+    DEFAULT_TIMEOUT,
+    CircuitOpenError,
+    IncompleteDownloadError,
+    RetryPolicy,
+    http_status,
+    requests_errors,
+)
+from .progress import Progress
+from .store import MediaStore, link
+from .throttle import TokenBucket
+from .tokens import TokenRefresher, expires_soon, new_client, save_token
+from .variants import VariantPolicy, bitrate_variants, variant_key
+
+# tweepy is slow to import, and downloading from a manifest never needs it, so
+# it is only imported by the functions talking to the API.
+if TYPE_CHECKING:
+    import tweepy
+
 logger = logging.getLogger("twitter-archive.core")
 
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
 
 class OneShotTCPServer(socketserver.TCPServer):
     """TCP server to handle a single HTTP request."""
@@ -127,6 +170,8 @@ class TweetEncoder(JSONEncoder):
         :param obj: Object to be serialized
         :returns: Ready to be written as JSON, dict equivalent of obj.
         """
+        import tweepy
+
         if isinstance(obj, datetime.datetime):
             return str(obj.isoformat())
         elif isinstance(obj, tweepy.ReferencedTweet):
@@ -161,16 +206,11 @@ def _oauth(
     :raises: ValueError - Missing client secret: client secret not specified and
                           'TWITTER_ARCHIVE_CLIENT_ID' is unset.
     """
+    import tweepy
+
     REDIRECT_PORT = 8080
     REDIRECT_URI = f"http://localhost:{REDIRECT_PORT}"
-    if use_dotenv:
-        from dotenv import load_dotenv
-
-        load_dotenv()
-        logger.debug("Loaded dotenv")
-
-    client_id = client_id or os.environ.get("TWITTER_ARCHIVE_CLIENT_ID")
-    client_secret = client_secret or os.environ.get("TWITTER_ARCHIVE_CLIENT_SECRET")
+    client_id, client_secret = _credentials(client_id, client_secret, use_dotenv)
 
     if client_id is None:
         raise ValueError("Missing client ID")
@@ -180,7 +220,9 @@ def _oauth(
     oauth2_user_handler = tweepy.OAuth2UserHandler(
         client_id=client_id,
         redirect_uri=REDIRECT_URI,
-        scope=["tweet.read", "users.read", "bookmark.read"],
+        # offline.access grants a refresh token, to renew the access token
+        # without going through this again.
+        scope=["tweet.read", "users.read", "bookmark.read", "offline.access"],
         client_secret=client_secret,
     )
 
@@ -200,13 +242,26 @@ def _oauth(
         logger.info("Received token headless: '%s'", response_url)
 
     access_token = oauth2_user_handler.fetch_token(response_url)
-    with open(save_path, "w") as fp:
-        json.dump(access_token, fp)
-        logger.info("Wrote access token details to '%s'", save_path)
+    save_token(access_token, save_path)
 
     return access_token
 
 
+def _credentials(
+    client_id: Optional[str], client_secret: Optional[str], use_dotenv: bool
+) -> Tuple[Optional[str], Optional[str]]:
+    """Fill in the client ID and secret from the environment if not given."""
+    if use_dotenv:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        logger.debug("Loaded dotenv")
+
+    client_id = client_id or os.environ.get("TWITTER_ARCHIVE_CLIENT_ID")
+    client_secret = client_secret or os.environ.get("TWITTER_ARCHIVE_CLIENT_SECRET")
+    return client_id, client_secret
+
+
 def auth(
     cache_path: str = "access_token.json",
     use_cache: bool = True,
@@ -214,11 +269,14 @@ def auth(
     client_secret: Optional[str] = None,
     use_dotenv: bool = False,
     headless: bool = False,
-) -> tweepy.Client:
+    metrics: Optional[Metrics] = None,
+) -> "tweepy.Client":
     """Login to the Twitter API.
 
     A wrapper of the _oauth() method, but uses a cache to avoid reauthenticating
-    if possible.
+    if possible. An expired cached token is renewed with its refresh token,
+    without any interaction, and the client renews it again shortly before it
+    expires during long runs.
 
     The client ID and secret parameters, if not specified, are loaded from the
     'TWITTER_ARCHIVE_CLIENT_ID' and 'TWITTER_ARCHIVE_CLIENT_SECRET' environment
@@ -230,6 +288,7 @@ def auth(
     :param client_secret: Client secret from the Twitter dev app portal.
     :param use_dotenv: Load a .env file automatically.
     :param headless: Disable interactive authentication.
+    :param metrics: Metrics to record how long authentication takes in.
 
     :returns: Instance of the tweepy client.
 
@@ -238,56 +297,222 @@ def auth(
     :raises: ValueError: Missing client secret, client secret not specified and
                          'TWITTER_ARCHIVE_CLIENT_ID' is unset.
     """
+    metrics = metrics if metrics is not None else Metrics()
+    with metrics.time("auth_seconds"):
+        return _auth(
+            cache_path, use_cache, client_id, client_secret, use_dotenv, headless
+        )
+
+
+def _auth(
+    cache_path: Optional[str],
+    use_cache: bool,
+    client_id: Optional[str],
+    client_secret: Optional[str],
+    use_dotenv: bool,
+    headless: bool,
+) -> "tweepy.Client":
     cache_path = None if cache_path is None else Path(cache_path)
-    if not use_cache or not cache_path.is_file():
+    client_id, client_secret = _credentials(client_id, client_secret, use_dotenv)
+
+    access_token = None
+    if use_cache and cache_path is not None and cache_path.is_file():
+        # Try to use the cache if possible.
+        with open(cache_path, "r") as json_file:
+            access_token = json.load(json_file)
+        logger.info("Loaded cached access token from '%s'", cache_path)
+
+        refresher = TokenRefresher(access_token, cache_path, client_id, client_secret)
+        try:
+            refresher.access_token()
+        except requests.RequestException as e:
+            logger.warning("Failed to refresh cached token: %s", e)
+
+        # Check if expired, and could not be refreshed, if so re-auth.
+        access_token = refresher.token
+        if expires_soon(access_token):
+            logger.info("Cached token is expired. Reauthenticating.")
+            access_token = None
+    else:
         logger.info("No cached token available. Reauthenticating.")
+
+    if access_token is None:
         access_token = _oauth(
             cache_path,
             client_id=client_id,
             client_secret=client_secret,
-            use_dotenv=use_dotenv,
             headless=headless,
         )
-    else:
-        # Try to use the cache if possible.
-        with open(cache_path, "r") as json_file:
-            access_token = json.load(json_file)
-        logger.info("Loaded cached access token from '%s'", cache_path)
 
-        # Check if expired, if so re-auth.
-        if float(access_token["expires_at"]) < time.time():
-            logger.info("Cached token is expired. Reauthenticating.")
-            access_token = _oauth(
-                cache_path,
-                client_id=client_id,
-                client_secret=client_secret,
-                use_dotenv=use_dotenv,
-                headless=headless,
-            )
-
-    client = tweepy.Client(
-        access_token["access_token"],
-        wait_on_rate_limit=True,
+    return new_client(
+        TokenRefresher(access_token, cache_path, client_id, client_secret)
     )
 
-    return client
-
 
-def get_bookmarks(client: tweepy.Client, save_path: Optional[Path] = None) -> dict:
+def get_bookmarks(
+    client: "tweepy.Client",
+    save_path: Optional[Path] = None,
+    known_ids: Optional[set] = None,
+    metrics: Optional[Metrics] = None,
+    resume: bool = True,
+    hydrate: bool = True,
+    incremental: bool = False,
+) -> Iterator[dict]:
     """Fetch all bookmarked tweets.
 
+    Tweets are yielded page by page as they arrive, and each page is appended
+    and flushed to the manifest before the next page is requested.
+
+    Bookmarks are returned most recently bookmarked first. When the IDs of a
+    previous manifest are given, paging stops at the first page containing one
+    of those tweets, and only the unseen tweets are appended to the manifest.
+
+    Media of quoted and retweeted tweets is attached to the tweets quoting or
+    retweeting them. Those tweets are looked up 100 at a time, once per page.
+
+    After every page, the token of the next page is checkpointed next to the
+    manifest. A fetch that was interrupted resumes from its checkpoint, and
+    only yields the tweets of the remaining pages.
+
     :param client: Authenticated Twitter user whos bookmarks to fetch.
     :param save_path: Path to save manifest of all the tweets.
-
-    :returns: Serialized dict of all the tweets.
+    :param known_ids: IDs of tweets already in the manifest at save_path, for
+                      incremental syncs.
+    :param metrics: Metrics to record pages, tweets and rate-limit waits in.
+    :param resume: Resume from the checkpoint of an interrupted fetch, if any.
+    :param hydrate: Also fetch the media of quoted and retweeted tweets.
+    :param incremental: Also treat every tweet already in the manifest at
+                        save_path as known.
+
+    :returns: Iterator of serialized dicts of each new tweet.
     """
-    media = {}
-    tweets = []
+    known_ids = set(known_ids or ())
+    writer = None
+    checkpoint = None
+    if save_path is not None:
+        checkpoint = read_checkpoint(save_path) if resume else None
+        if checkpoint is not None and Path(save_path).is_file():
+            # Drop anything written after the checkpoint, those pages are
+            # fetched again.
+            os.truncate(save_path, checkpoint["size"])
+            logger.warning(
+                "Resuming interrupted fetch after %d tweets, download media of "
+                "earlier tweets with --manifest-input '%s' --no-clobber",
+                checkpoint["tweets"],
+                save_path,
+            )
+        else:
+            checkpoint = None
+        # Only read once truncated, tweets dropped above are not known.
+        if incremental and Path(save_path).is_file():
+            known_ids |= read_manifest_ids(save_path)
+            logger.info("Loaded previous manifest from '%s'", save_path)
+        append = bool(known_ids) or checkpoint is not None
+    if known_ids:
+        logger.info("Incremental sync against %d known tweets", len(known_ids))
+    if save_path is not None:
+        writer = ManifestWriter(save_path, append=append, cls=TweetEncoder)
+        logger.info("Writing manifest to '%s'", save_path)
 
+    try:
+        metrics = metrics if metrics is not None else Metrics()
+        yield from _get_bookmark_pages(
+            client, known_ids, writer, metrics, checkpoint, hydrate
+        )
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# Most tweets the API returns per request, for both bookmarks and lookups.
+_MAX_RESULTS = 100
+
+_MEDIA_FIELDS = [
+    "media_key",
+    "type",
+    "url",
+    "duration_ms",
+    "height",
+    "width",
+    "alt_text",
+    "variants",
+]
+
+
+def _tweet_media(tweet: "tweepy.Tweet", media: Mapping[str, "tweepy.Media"]) -> list:
+    """Media attached to a tweet, from the media included in the response."""
+    found = []
+    for media_key in tweet.data.get("attachments", {}).get("media_keys") or []:
+        if media_key in media:
+            found.append(media[media_key].data)
+            logger.info("Found media for tweet, '%s'", media_key)
+    return found
+
+
+def _referenced_ids(tweet: dict) -> list:
+    """IDs of the tweets a tweet quotes or retweets."""
+    return [
+        str(i["id"])
+        for i in tweet.get("referenced_tweets") or []
+        if i.get("type") in ("quoted", "retweeted")
+    ]
+
+
+def _attach_media(tweet: dict, media: list) -> None:
+    """Add media to a tweet, unless it already has it, i.e. a retweet."""
+    attached = {i.get("media_key") for i in tweet.get("media", [])}
+    for i in media:
+        if i.get("media_key") not in attached:
+            tweet.setdefault("media", []).append(i)
+
+
+def _hydrate(
+    client: "tweepy.Client", ids: list, metrics: Metrics
+) -> Iterator[Tuple[str, list]]:
+    """Fetch the media of tweets, in as few requests as possible.
+
+    :param client: Authenticated Twitter client.
+    :param ids: IDs of the tweets.
+    :param metrics: Metrics to record requests and rate-limit waits in.
+    :returns: Iterator of (ID, media) of every tweet requested. Tweets which
+              are deleted or hidden from the user have no media.
+    """
+    for start in range(0, len(ids), _MAX_RESULTS):
+        batch = ids[start : start + _MAX_RESULTS]
+        logger.info("Hydrating %d referenced tweets", len(batch))
+        resp = _request_page(
+            client.get_tweets,
+            metrics,
+            ids=batch,
+            expansions=["attachments.media_keys"],
+            media_fields=_MEDIA_FIELDS,
+            tweet_fields=["id", "attachments"],
+        )
+        media = {i.media_key: i for i in resp.includes.get("media", [])}
+        found = {str(i.id): _tweet_media(i, media) for i in resp.data or []}
+        metrics.inc("api_hydrated_tweets_total", len(batch))
+        for id_ in batch:
+            yield id_, found.get(id_, [])
+
+
+def _get_bookmark_pages(
+    client: "tweepy.Client",
+    known_ids: set,
+    writer: Optional[ManifestWriter],
+    metrics: Metrics,
+    checkpoint: Optional[dict] = None,
+    hydrate: bool = True,
+) -> Iterator[dict]:
+    count = 0
     page_token = None
+    if checkpoint is not None:
+        count = checkpoint["tweets"]
+        page_token = checkpoint["pagination_token"]
     while True:
         logging.info("Querying twitter api for page (%s) of bookmarks.", page_token)
-        resp = client.get_bookmarks(
+        resp = _request_page(
+            client.get_bookmarks,
+            metrics,
             expansions=[
                 "attachments.poll_ids",
                 "attachments.media_keys",
@@ -295,18 +520,9 @@ def get_bookmarks(client: tweepy.Client, save_path: Optional[Path] = None) -> di
                 "geo.place_id",
                 "referenced_tweets.id",
             ],
-            max_results=100,
+            max_results=_MAX_RESULTS,
             pagination_token=page_token,
-            media_fields=[
-                "media_key",
-                "type",
-                "url",
-                "duration_ms",
-                "height",
-                "width",
-                "alt_text",
-                "variants",
-            ],
+            media_fields=_MEDIA_FIELDS,
             place_fields=[
                 "full_name",
                 "id",
@@ -335,112 +551,536 @@ def get_bookmarks(client: tweepy.Client, save_path: Optional[Path] = None) -> di
             user_fields=["id"],
         )
 
-        try:
-            for i in resp.includes["media"]:
-                media[i.media_key] = i
-        except KeyError:
-            pass
-
-        for i in resp.data:
-            if i.data.get("attachments", {}).get("media_keys") is None:
-                tweets.append(dict(i))
+        process_start = time.perf_counter()
+        media = {i.media_key: i for i in resp.includes.get("media", [])}
+
+        reached_known = False
+        tweets = []
+        for i in resp.data or []:
+            if i.id in known_ids:
+                reached_known = True
                 continue
 
             tweet = dict(i)
-            tweet["media"] = []
-            for media_key in i["attachments"]["media_keys"]:
-                tweet["media"].append(media[media_key].data)
-                logger.info("Found media for tweet, '%s'", media_key)
-
+            if i.data.get("attachments", {}).get("media_keys") is not None:
+                tweet["media"] = _tweet_media(i, media)
             tweets.append(tweet)
 
         # We retrieve tweets in pages of 100.
         # Go until no more exist.
-        try:
-            page_token = resp.meta["next_token"]
-        except KeyError:
-            break
+        page_token = None if reached_known else resp.meta.get("next_token")
+
+        if hydrate:
+            # Looked up once per page, so every page is saved and handed out
+            # as soon as it is fetched. Only kept until attached.
+            wanted = {id_ for tweet in tweets for id_ in _referenced_ids(tweet)}
+            referenced_media = dict(_hydrate(client, sorted(wanted), metrics))
+            for tweet in tweets:
+                for id_ in _referenced_ids(tweet):
+                    _attach_media(tweet, referenced_media[id_])
+
+        page = []
+        for tweet in tweets:
+            if writer is not None:
+                page.append(writer.write(tweet))
+            else:
+                page.append(json.dumps(tweet, cls=TweetEncoder))
+
+        count += len(page)
+        # Persist the tweets, and where to continue from, before handing any of
+        # them out.
+        if writer is not None:
+            size = writer.sync()
+            if page_token is not None:
+                write_checkpoint(
+                    writer.path,
+                    {"pagination_token": page_token, "size": size, "tweets": count},
+                )
+            else:
+                # Every page is saved, even if the last ones are never handed
+                # out, resuming would drop them.
+                clear_checkpoint(writer.path)
+        metrics.observe("page_process_seconds", time.perf_counter() - process_start)
 
-    data = json.dumps(tweets, indent=2, cls=TweetEncoder)
-    logger.info("Serialized all bookmarked tweets")
+        metrics.inc("api_tweets_total", len(page))
+        for line in page:
+            yield json.loads(line)
 
-    if save_path is not None:
-        with open(save_path, "w") as fp:
-            logger.info("Wrote manifest to '%s'", save_path)
-            fp.write(data)
+        if reached_known:
+            logger.info("Reached previously archived tweets, stopping.")
+            break
+        if page_token is None:
+            break
 
-    return json.loads(data)
+    logger.info("Found %d new bookmarked tweets", count)
 
 
-def download_tweet(
+def _request_page(
+    get_page: Callable[..., "tweepy.Response"], metrics: Metrics, **kwargs: Any
+) -> "tweepy.Response":
+    """Request a page from the API, sleeping through any rate limit."""
+    import tweepy
+
+    while True:
+        try:
+            with metrics.time("api_page_seconds"):
+                resp = get_page(**kwargs)
+        except tweepy.TooManyRequests as e:
+            reset = e.response.headers.get("x-rate-limit-reset")
+            sleep = 60.0 if reset is None else max(0.0, int(reset) - time.time()) + 1
+            logger.warning("Rate limit exceeded. Sleeping for %.0f seconds.", sleep)
+            metrics.inc("api_rate_limited_total")
+            metrics.inc("api_rate_limit_sleep_seconds_total", sleep)
+            time.sleep(sleep)
+            continue
+        metrics.inc("api_pages_total")
+        return resp
+
+
+def iter_media(
     tweet_obj: dict,
     base_dir: Path,
-    clobber: bool = True,
-    disable_progress_bar: bool = True,
-    chunk_size: int = 1024,
-) -> None:
-    """Download media from a single tweet.
+    policy: Optional[VariantPolicy] = None,
+    layout: str = "flat",
+) -> Iterator[Tuple[dict, str, Path]]:
+    """Find the URL and destination of every media item in a tweet.
+
+    Shared by every download engine, so they all agree on what to download and
+    where to save it.
 
     :param tweet_obj: Dict including all the attributes of the tweet.
     :param base_dir: Base directory to save any media.
-    :param clobber: Overwrite existing files.
-    :param disable_progress_bar: Silence the progress bar.
-    :param chunk_size: Chunk size to use while downloading content.
+    :param policy: Policy to choose variants with, defaults to the highest
+                   bitrate of videos and the default size of photos.
+    :param layout: Directory layout to save media in, see layout.LAYOUTS.
+    :returns: Iterator of (media, URL, destination path) tuples.
+
+    :raises: AttributeError: The tweet has no ID.
     """
     if "id" not in tweet_obj:
         raise AttributeError("Missing attribute ID, is this a valid tweet object?")
 
-    my_dir = base_dir / str(tweet_obj["id"])
-    my_dir.mkdir(exist_ok=True)
+    # Directories are only created once there is media to save in them.
+    my_dir = tweet_dir(base_dir, tweet_obj["id"], layout)
 
     try:
         for media in tweet_obj["media"]:
             type_ = media["type"]
             if type_ == "video":
                 # Only save videos with a bitrate
-                variants = [x for x in media["variants"] if "bit_rate" in x]
-                max_variant = max(variants, key=lambda x: x["bit_rate"])
-                url = max_variant["url"]
+                if policy is None:
+                    variant = bitrate_variants(media)[0]
+                else:
+                    variant = policy.select_video(media)
+                    if variant is None:
+                        continue
+                url = variant["url"]
                 logging.debug("Found video\n  URL: '%s'\n  Bitrate: '%s")
             elif type_ == "photo":
-                url = media["url"]
+                url = media["url"] if policy is None else policy.photo_url(media)
                 logging.debug("Found photo URL: '%s'")
             else:
                 raise NotImplementedError(
                     f"Type '{type_}' not yet supported for downloading"
                 )
 
-            dest = my_dir / Path(urlparse(url).path).name
-            if dest.exists() and not clobber:
-                logger.info("'%s' already exists. Skipping.", dest)
-                continue
-
-            resp = requests.get(url, stream=True)
-            length = resp.headers.get("content-length")
-            with open(dest, "wb") as f:
-                logging.info("Downloading to '%s'", dest)
-                # No content length header
-                if length is None:
-                    f.write(resp.content)
-                else:
-                    # Progress bar
-                    length = int(length)
-                    num_bars = int(length / chunk_size)
-
-                    for chunk in tqdm(
-                        resp.iter_content(chunk_size=chunk_size),
-                        ascii=True,
-                        disable=disable_progress_bar,
-                        total=num_bars,
-                        desc=dest.name,
-                        leave=True,
-                        unit="KB",
-                        miniters=1,
-                        ncols=80,
-                    ):
-                        f.write(chunk)
+            yield media, url, my_dir / Path(urlparse(url).path).name
     except KeyError:
         return
     except NotImplementedError as e:
         logger.warning(e)
         return
+
+
+def part_path(dest: Path) -> Path:
+    """Path media is downloaded to, before being renamed to dest once complete.
+
+    :param dest: Final destination of the media.
+    :returns: Path of the partial download.
+    """
+    return dest.with_name(dest.name + ".part")
+
+
+def range_headers(offset: int) -> dict:
+    """Request headers to resume a partial download.
+
+    :param offset: Number of bytes already downloaded.
+    :returns: Headers to send with the request.
+    """
+    return {"Range": f"bytes={offset}-"} if offset else {}
+
+
+def resume_offset(
+    offset: int, status: int, headers: Mapping[str, str]
+) -> Optional[int]:
+    """Check where a response continues a partial download from.
+
+    :param offset: Number of bytes already downloaded, requested via Range.
+    :param status: HTTP status code of the response.
+    :param headers: Headers of the response.
+    :returns: Offset the response body starts at, 0 if it is the whole file, or
+              None if the response does not continue the partial download.
+    """
+    if status != 206:
+        return 0 if offset == 0 or status == 200 else None
+
+    match = _CONTENT_RANGE.match(headers.get("content-range", ""))
+    if match is None or int(match.group(1)) != offset:
+        return None
+    return offset
+
+
+def accepts_ranges(status: int, headers: Mapping[str, str]) -> bool:
+    """Check if a partial download of a response could be resumed later.
+
+    :param status: HTTP status code of the response.
+    :param headers: Headers of the response.
+    :returns: Whether the server accepts Range requests for it.
+    """
+    return status == 206 or headers.get("accept-ranges", "").lower() == "bytes"
+
+
+def fetch_media(
+    url: str,
+    dest: Path,
+    session: Optional[requests.Session] = None,
+    disable_progress_bar: bool = True,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[Progress] = None,
+    throttle: Optional[TokenBucket] = None,
+) -> bool:
+    """Download a single media file.
+
+    The file is written to a '.part' file, which is renamed to dest once
+    complete. An existing '.part' file is resumed with an HTTP Range request.
+
+    :param url: URL of the media.
+    :param dest: Path to save the media.
+    :param session: Session to reuse connections from, see net.new_session().
+    :param disable_progress_bar: Silence the progress bar of the file.
+    :param chunk_size: Size of the buffer to download content through.
+    :param progress: Aggregate progress to count the bytes downloaded in.
+    :param throttle: Bandwidth limit shared with every other transfer.
+    :returns: Whether the download completed.
+    """
+    if throttle is not None:
+        chunk_size = min(chunk_size, throttle.chunk_size)
+    get = functools.partial((session or requests).get, timeout=DEFAULT_TIMEOUT)
+    part = part_path(dest)
+    offset = part.stat().st_size if part.is_file() else 0
+    resp = get(url, stream=True, headers=range_headers(offset))
+    start = resume_offset(offset, resp.status_code, resp.headers)
+    if start is None:
+        logger.info("Cannot resume '%s', starting over", part)
+        resp.close()
+        resp = get(url, stream=True)
+        start = 0
+    elif start:
+        logger.info("Resuming '%s' from byte %d", part, start)
+
+    length = resp.headers.get("content-length")
+    length = None if length is None else int(length)
+    # Closing the response returns the connection to the pool.
+    with resp:
+        # Never save an error page as media.
+        resp.raise_for_status()
+        # Only tweets with media to save get a directory.
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # Read the raw stream, but still undo any Content-Encoding.
+        resp.raw.decode_content = True
+        resumable = accepts_ranges(resp.status_code, resp.headers)
+        with open_part(part, start, length, resumable) as f, tqdm(
+            ascii=True,
+            disable=disable_progress_bar,
+            total=length,
+            desc=dest.name,
+            leave=True,
+            unit="B",
+            unit_scale=True,
+            ncols=80,
+        ) as bar:
+            logger.info("Downloading to '%s'", dest)
+
+            def update(n: int) -> None:
+                bar.update(n)
+                if progress is not None:
+                    progress.update(n)
+                if throttle is not None:
+                    throttle.consume(n)
+
+            with requests_errors():
+                copy_stream(resp.raw, f, chunk_size, update)
+
+    if length is not None and part.stat().st_size != start + length:
+        logger.warning("Incomplete download of '%s', will resume later", dest)
+        return False
+    os.replace(part, dest)
+    return True
+
+
+def is_downloaded(dest: Path, index: Optional[DownloadIndex] = None) -> bool:
+    """Check if media has already been downloaded.
+
+    :param dest: Destination of the media.
+    :param index: Index to check instead of the filesystem.
+    :returns: Whether the media is already downloaded.
+    """
+    if index is not None:
+        return index.is_complete(dest)
+    return dest.exists()
+
+
+def record_download(
+    index: Optional[DownloadIndex], dest: Path, url: str, complete: bool
+) -> None:
+    """Record a download in the index, if there is one.
+
+    :param index: Index to record the download in.
+    :param dest: Destination of the media.
+    :param url: URL of the media.
+    :param complete: Whether the download completed.
+    """
+    if index is None:
+        return
+    path = dest if complete else part_path(dest)
+    size = path.stat().st_size if path.exists() else None
+    index.record(dest, url, size, complete)
+
+
+def handle_fetch_error(
+    e: Exception, url: str, tweet_obj: dict, retry: Optional[RetryPolicy]
+) -> bool:
+    """Decide what to do with media that failed to download.
+
+    Transient failures are deferred with the retry policy, and HTTP errors such
+    as deleted media are skipped. Anything else is re-raised.
+
+    :param e: Exception raised while downloading.
+    :param url: URL of the media.
+    :param tweet_obj: Tweet the media belongs to.
+    :param retry: Policy the download was retried with.
+    :returns: False, the media was not downloaded.
+    """
+    if retry is not None and (isinstance(e, CircuitOpenError) or retry.is_retryable(e)):
+        logger.warning("Deferring '%s' to the end of the run: %s", url, e)
+        retry.defer(tweet_obj)
+        return False
+    if http_status(e) is not None:
+        logger.warning("Failed to download '%s': %s", url, e)
+        return False
+    raise e
+
+
+def record_transfer(
+    metrics: Metrics, dest: Path, complete: Optional[bool], seconds: float
+) -> None:
+    """Record a media transfer in the metrics.
+
+    :param metrics: Metrics to record the transfer in.
+    :param dest: Path the media was downloaded to.
+    :param complete: Whether the download completed, or None if it failed.
+    :param seconds: How long the transfer took.
+    """
+    result = {True: "complete", False: "incomplete", None: "error"}[complete]
+    metrics.inc("media_transfers_total", result=result)
+    metrics.observe("media_transfer_seconds", seconds)
+    if complete:
+        metrics.inc("media_bytes_total", dest.stat().st_size)
+
+
+def iter_downloads(
+    tweet_obj: dict,
+    base_dir: Path,
+    clobber: bool = True,
+    store: Optional[MediaStore] = None,
+    index: Optional[DownloadIndex] = None,
+    metrics: Optional[Metrics] = None,
+    policy: Optional[VariantPolicy] = None,
+    layout: str = "flat",
+    progress: Optional[Progress] = None,
+) -> Iterator[Tuple[str, Path, Optional[str]]]:
+    """Find the media of a tweet left to download, for any download engine.
+
+    Media already downloaded is skipped. Each media item is counted as done in
+    progress once the next one is asked for, so download it in between, see
+    download_steps().
+
+    :param tweet_obj: Dict including all the attributes of the tweet.
+    :param base_dir: Base directory to save any media.
+    :param clobber: Overwrite existing files.
+    :param store: Content-addressed store to deduplicate media with.
+    :param index: Index of downloaded media, see index.DownloadIndex.
+    :param metrics: Metrics to record skipped media in.
+    :param policy: Policy to choose media variants with, see iter_media().
+    :param layout: Directory layout to save media in, see layout.LAYOUTS.
+    :param progress: Aggregate progress to count files in.
+    :returns: Iterator of (URL, destination, store key) tuples. The key is None
+              without a store, otherwise hold the store's lock for it while
+              downloading.
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    progress = progress if progress is not None else Progress(disable=True)
+    for media, url, dest in iter_media(tweet_obj, base_dir, policy, layout):
+        progress.found()
+        try:
+            if not clobber and is_downloaded(dest, index):
+                logger.info("'%s' already exists. Skipping.", dest)
+                metrics.inc("media_skipped_total")
+                continue
+
+            key = None
+            if store is not None and media.get("media_key") is not None:
+                # Keyed by variant, so a smaller one never stands in for another.
+                key = variant_key(media, url)
+            yield url, dest, key
+        finally:
+            progress.done()
+
+
+def download_steps(
+    url: str,
+    dest: Path,
+    key: Optional[str],
+    store: Optional[MediaStore],
+    index: Optional[DownloadIndex],
+    metrics: Metrics,
+) -> Generator[Tuple[str, Path], bool, None]:
+    """Download a single media item, leaving the transfer to the caller.
+
+    Yields at most one transfer to make, and expects whether it completed to be
+    sent back, see run_steps(). Then records the download in the index, and
+    links it from the store if there is one.
+
+    :param url: URL of the media.
+    :param dest: Path to save the media.
+    :param key: Key of the media in the store, see iter_downloads().
+    :param store: Content-addressed store to deduplicate media with.
+    :param index: Index of downloaded media, see index.DownloadIndex.
+    :param metrics: Metrics to record deduplicated media in.
+    :returns: Generator of (URL, path to download to) tuples.
+    """
+    if key is None:
+        complete = yield url, dest
+        record_download(index, dest, url, complete)
+        return
+
+    stored = store.lookup(key, dest.name)
+    if stored is None:
+        staged = store.staging_path(key, dest.name)
+        if not (yield url, staged):
+            record_download(index, dest, url, False)
+            return
+        stored = store.add(staged, key)
+    else:
+        logger.info("'%s' already stored. Linking.", key)
+        metrics.inc("media_deduplicated_total")
+    link(stored, dest)
+    record_download(index, dest, url, True)
+
+
+def run_steps(
+    steps: Generator[Tuple[str, Path], bool, None],
+    fetch: Callable[[str, Path], bool],
+) -> None:
+    """Make the transfers of download_steps().
+
+    :param steps: Steps of a download.
+    :param fetch: Called with each URL and path, returns whether it completed.
+    """
+    try:
+        transfer = next(steps)
+        while True:
+            transfer = steps.send(fetch(*transfer))
+    except StopIteration:
+        pass
+
+
+def download_tweet(
+    tweet_obj: dict,
+    base_dir: Path,
+    clobber: bool = True,
+    disable_progress_bar: bool = True,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    session: Optional[requests.Session] = None,
+    store: Optional[MediaStore] = None,
+    index: Optional[DownloadIndex] = None,
+    limit: Optional[AdaptiveLimit] = None,
+    retry: Optional[RetryPolicy] = None,
+    metrics: Optional[Metrics] = None,
+    policy: Optional[VariantPolicy] = None,
+    layout: str = "flat",
+    progress: Optional[Progress] = None,
+    throttle: Optional[TokenBucket] = None,
+) -> None:
+    """Download media from a single tweet.
+
+    With a store, media is fetched at most once per media_key and linked into
+    the tweet's directory from the store.
+
+    With an index, existing media is found by looking it up in the index rather
+    than checking the filesystem, and every download is recorded in it.
+
+    :param tweet_obj: Dict including all the attributes of the tweet.
+    :param base_dir: Base directory to save any media.
+    :param clobber: Overwrite existing files.
+    :param disable_progress_bar: Silence the progress bar of the file.
+    :param chunk_size: Size of the buffer to download content through.
+    :param session: Session to reuse connections from, see net.new_session().
+    :param store: Content-addressed store to deduplicate media with.
+    :param index: Index of downloaded media, see index.DownloadIndex.
+    :param limit: Adaptive limit on the number of transfers in flight.
+    :param retry: Policy to retry failed transfers with. Media that still fails
+                  is deferred with the policy, to be retried later.
+    :param metrics: Metrics to record transfers and bytes downloaded in.
+    :param policy: Policy to choose media variants with, see iter_media().
+    :param layout: Directory layout to save media in, see layout.LAYOUTS.
+    :param progress: Aggregate progress to count files and bytes in.
+    :param throttle: Bandwidth limit shared by every transfer, see
+                     throttle.TokenBucket.
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    progress = progress if progress is not None else Progress(disable=True)
+    fetch_one = functools.partial(
+        fetch_media,
+        session=session,
+        disable_progress_bar=disable_progress_bar,
+        chunk_size=chunk_size,
+        progress=progress,
+        throttle=throttle,
+    )
+
+    def attempt(url: str, dest: Path) -> bool:
+        start = time.perf_counter()
+        complete = None
+        try:
+            if limit is None:
+                complete = fetch_one(url, dest)
+            else:
+                with limit.slot() as transfer:
+                    complete = fetch_one(url, dest)
+                    transfer.error = not complete
+                    transfer.nbytes = dest.stat().st_size if complete else 0
+        finally:
+            record_transfer(metrics, dest, complete, time.perf_counter() - start)
+        if not complete and retry is not None:
+            raise IncompleteDownloadError(f"Incomplete download of '{dest}'")
+        return complete
+
+    def fetch(url: str, dest: Path) -> bool:
+        try:
+            if retry is None:
+                return attempt(url, dest)
+            return retry.call(lambda: attempt(url, dest), url)
+        except Exception as e:
+            return handle_fetch_error(e, url, tweet_obj, retry)
+
+    downloads = iter_downloads(
+        tweet_obj, base_dir, clobber, store, index, metrics, policy, layout, progress
+    )
+    for url, dest, key in downloads:
+        steps = download_steps(url, dest, key, store, index, metrics)
+        if key is None:
+            run_steps(steps, fetch)
+        else:
+            with store.lock(key):
+                run_steps(steps, fetch)
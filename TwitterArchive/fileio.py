@@ -0,0 +1,103 @@
+"""Bounded-memory writes of downloaded media to disk.
+
+Media is copied from the response into a large buffer reused by each thread,
+rather than creating a new bytes object for every small chunk, and files that
+cannot be resumed are preallocated from the Content-Length so they are laid out
+contiguously. No more than one buffer of a file is ever held in memory, even
+without a Content-Length.
+"""
+import contextlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterator, Optional
+
+logger = logging.getLogger("twitter-archive.fileio")
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_local = threading.local()
+
+
+def buffer(size: int = DEFAULT_CHUNK_SIZE) -> memoryview:
+    """Get a buffer reused by every download on the current thread.
+
+    :param size: Size of the buffer in bytes.
+    :returns: View of exactly size bytes.
+    """
+    buf = getattr(_local, "buffer", None)
+    if buf is None or len(buf) < size:
+        buf = _local.buffer = bytearray(size)
+    return memoryview(buf)[:size]
+
+
+def preallocate(f: BinaryIO, length: int) -> None:
+    """Reserve disk space for length bytes from the current position of f.
+
+    Does nothing where the platform or filesystem does not support it.
+
+    :param f: File open for writing.
+    :param length: Number of bytes about to be written.
+    """
+    if length <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(f.fileno(), f.tell(), length)
+    except OSError as e:
+        logger.debug("Cannot preallocate '%s': %s", f.name, e)
+
+
+@contextlib.contextmanager
+def open_part(
+    part: Path, start: int, length: Optional[int], resumable: bool = True
+) -> Iterator[BinaryIO]:
+    """Open a partial download to write from start.
+
+    The size of the file is the offset to resume from, so a file that can be
+    resumed is never preallocated: after a crash it would be left at its full
+    length, which no Range request can continue. Otherwise it is preallocated
+    for length more bytes. Either way it is truncated to what was actually
+    written when closed.
+
+    :param part: Path of the partial download.
+    :param start: Offset to write from, the size of an existing partial
+                  download or 0 to start over.
+    :param length: Number of bytes expected, if known.
+    :param resumable: Whether the server accepts Range requests for the file.
+    :returns: The file, positioned at start.
+    """
+    with open(part, "r+b" if start else "wb") as f:
+        f.seek(start)
+        if length is not None and not resumable:
+            preallocate(f, length)
+        try:
+            yield f
+        finally:
+            f.truncate()
+
+
+def copy_stream(
+    src: BinaryIO,
+    dest: BinaryIO,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[Callable[[int], Any]] = None,
+) -> int:
+    """Copy a stream to a file through the thread's reusable buffer.
+
+    :param src: Stream supporting readinto(), i.e. a urllib3 response.
+    :param dest: File to write to.
+    :param chunk_size: Size of the buffer in bytes.
+    :param progress: Called with the number of bytes after every write.
+    :returns: Number of bytes copied.
+    """
+    view = buffer(chunk_size)
+    total = 0
+    while True:
+        n = src.readinto(view)
+        if not n:
+            return total
+        dest.write(view[:n])
+        total += n
+        if progress is not None:
+            progress(n)
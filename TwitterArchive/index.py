@@ -0,0 +1,115 @@
+"""SQLite index of downloaded media.
+
+Deciding whether to skip media with a stat() of each destination is slow on
+network filesystems with millions of files. The index records every media item
+instead, so each skip decision is a single indexed lookup.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger("twitter-archive.index")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    dest TEXT PRIMARY KEY,
+    url TEXT,
+    size INTEGER,
+    complete INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class DownloadIndex:
+    """Record of every media item downloaded under a media directory."""
+
+    def __init__(self, path: Path, root: Path):
+        """Open, or create, an index.
+
+        :param path: Path to the SQLite database.
+        :param root: Media directory, destinations are stored relative to it.
+        """
+        self.path = Path(path)
+        self.root = Path(root)
+        # A new index knows nothing of media downloaded before it, see rebuild().
+        self.created = not self.path.exists()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def _key(self, dest: Path) -> str:
+        return Path(dest).relative_to(self.root).as_posix()
+
+    def is_complete(self, dest: Path) -> bool:
+        """Check if media has been completely downloaded.
+
+        :param dest: Destination of the media.
+        :returns: Whether the index has the media as complete.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT complete FROM media WHERE dest = ?", (self._key(dest),)
+            ).fetchone()
+        return row is not None and bool(row[0])
+
+    def record(
+        self,
+        dest: Path,
+        url: Optional[str],
+        size: Optional[int],
+        complete: bool = True,
+    ) -> None:
+        """Record the state of a media item.
+
+        :param dest: Destination of the media.
+        :param url: URL the media was downloaded from.
+        :param size: Size of the media in bytes.
+        :param complete: Whether the download completed.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?)",
+                (self._key(dest), url, size, int(complete), time.time()),
+            )
+
+    def _is_own_file(self, path: Path) -> bool:
+        # The database, and its journal files, may live in the media directory.
+        if not path.name.startswith(self.path.name):
+            return False
+        return path.parent.resolve() == self.path.parent.resolve()
+
+    def rebuild(self) -> int:
+        """Replace the index with every media file found under the root.
+
+        Partial downloads are left out, since they are not complete.
+
+        :returns: Number of media files indexed.
+        """
+        count = 0
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM media")
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    dest = Path(dirpath) / name
+                    if name.endswith((".part", ".link")) or self._is_own_file(dest):
+                        continue
+                    self._conn.execute(
+                        "INSERT INTO media VALUES (?, NULL, ?, 1, ?)",
+                        (self._key(dest), dest.stat().st_size, time.time()),
+                    )
+                    count += 1
+        logger.info("Indexed %d media files under '%s'", count, self.root)
+        return count
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._conn.close()
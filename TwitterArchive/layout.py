@@ -0,0 +1,167 @@
+"""Directory layouts of downloaded media.
+
+Media is saved in a directory per tweet. In the flat layout these are all
+directly in the media directory, which slows directory lookups and backup tools
+to a crawl with hundreds of thousands of tweets. The other layouts fan them out
+over nested directories:
+
+- flat: <id>/
+- hash: 3f/a2/<id>/, spread evenly over 65536 directories by a hash of the ID.
+- date: 2022/11/<id>/, by the month the tweet was posted.
+"""
+import hashlib
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, List, Union
+
+logger = logging.getLogger("twitter-archive.layout")
+
+LAYOUTS = ("flat", "hash", "date")
+
+# Tweet IDs are snowflakes, whose top bits are milliseconds since this epoch.
+_SNOWFLAKE_EPOCH_MS = 1288834974657
+
+
+def tweet_time(tweet_id: Union[int, str]) -> datetime:
+    """Time a tweet was posted, from its ID.
+
+    Tweets from before November 2010 predate snowflake IDs, and are dated to
+    the start of the epoch.
+
+    :param tweet_id: ID of the tweet.
+    :returns: The time in UTC.
+    """
+    ms = (int(tweet_id) >> 22) + _SNOWFLAKE_EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def tweet_dir(base_dir: Path, tweet_id: Union[int, str], layout: str = "flat") -> Path:
+    """Directory to save the media of a tweet in.
+
+    :param base_dir: Base directory to save any media.
+    :param tweet_id: ID of the tweet.
+    :param layout: One of LAYOUTS.
+    :returns: The directory, which may not exist yet.
+    :raises: ValueError: Unknown layout.
+    """
+    name = str(tweet_id)
+    if layout == "flat":
+        return base_dir / name
+    if layout == "hash":
+        digest = hashlib.md5(name.encode()).hexdigest()
+        return base_dir / digest[:2] / digest[2:4] / name
+    if layout == "date":
+        posted = tweet_time(tweet_id)
+        return base_dir / f"{posted.year:04d}" / f"{posted.month:02d}" / name
+    raise ValueError(f"Unknown layout '{layout}'")
+
+
+def find_tweet_dirs(base_dir: Path) -> Iterator[Path]:
+    """Find the directory of every tweet, in any layout.
+
+    A tweet directory is named after the tweet ID and holds its media, while
+    the directories fanning them out only hold other directories.
+
+    :param base_dir: Base directory media was saved in.
+    :returns: Iterator of tweet directories.
+    """
+    for dirpath, dirnames, filenames in os.walk(base_dir):
+        path = Path(dirpath)
+        if path != base_dir and path.name.isdigit() and filenames:
+            # Tweets never have directories of their own.
+            dirnames.clear()
+            yield path
+
+
+def _remove_empty_parents(path: Path, base_dir: Path) -> None:
+    while path != base_dir:
+        try:
+            path.rmdir()
+        except OSError:
+            return
+        path = path.parent
+
+
+def _remove_empty_tweet_dirs(base_dir: Path) -> int:
+    # Left by downloads that saved nothing, these are never found as tweets.
+    empty = [
+        Path(dirpath)
+        for dirpath, dirnames, filenames in os.walk(base_dir)
+        if not dirnames and not filenames and Path(dirpath).name.isdigit()
+    ]
+    empty = [path for path in empty if path != base_dir]
+    for path in empty:
+        _remove_empty_parents(path, base_dir)
+    return len(empty)
+
+
+def _move_tweet_dir(src: Path, dest: Path, root: Path) -> None:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.exists():
+        # Media saved in both places, keep what is already in place.
+        for path in src.iterdir():
+            if not (dest / path.name).exists():
+                os.replace(path, dest / path.name)
+        logger.warning("Merged '%s' into existing '%s'", src, dest)
+        for path in src.iterdir():
+            logger.warning("Left duplicate '%s' in place", path)
+        _remove_empty_parents(src, root)
+    else:
+        os.replace(src, dest)
+        _remove_empty_parents(src.parent, root)
+
+
+def migrate(base_dir: Path, layout: str) -> int:
+    """Move every tweet directory into a layout.
+
+    Directories are renamed, so media is neither copied nor relinked, and links
+    into a media store stay valid. Empty tweet directories, and fan-out
+    directories left empty, are removed. Safe to run again after an
+    interruption.
+
+    :param base_dir: Base directory media was saved in, in any layout.
+    :param layout: Layout to move to, one of LAYOUTS.
+    :returns: Number of tweet directories moved.
+    :raises: ValueError: Unknown layout.
+    """
+    base_dir = Path(base_dir)
+    removed = _remove_empty_tweet_dirs(base_dir)
+    if removed:
+        logger.info("Removed %d empty tweet directories", removed)
+    # Collected first, since moving directories while walking would revisit them.
+    sources = list(find_tweet_dirs(base_dir))
+    moved = 0
+    for src in sources:
+        dest = tweet_dir(base_dir, src.name, layout)
+        if src != dest:
+            _move_tweet_dir(src, dest, base_dir)
+            moved += 1
+    logger.info("Moved %d tweet directories into the %s layout", moved, layout)
+    return moved
+
+
+def merge(sources: List[Path], base_dir: Path, layout: str) -> int:
+    """Move every tweet directory of other media directories into one.
+
+    Combines the media directories of shards downloaded separately, see
+    shard.py, the same way as migrate().
+
+    :param sources: Media directories to empty, in any layout.
+    :param base_dir: Media directory to move everything into.
+    :param layout: Layout of base_dir, one of LAYOUTS.
+    :returns: Number of tweet directories moved.
+    :raises: ValueError: Unknown layout.
+    """
+    base_dir = Path(base_dir)
+    moved = 0
+    for source in sources:
+        source = Path(source)
+        for src in list(find_tweet_dirs(source)):
+            dest = tweet_dir(base_dir, src.name, layout)
+            if src != dest:
+                _move_tweet_dir(src, dest, source)
+                moved += 1
+    logger.info("Merged %d tweet directories into '%s'", moved, base_dir)
+    return moved
@@ -0,0 +1,256 @@
+"""Reading and writing bookmark manifests.
+
+Manifests are stored as JSON Lines, one tweet per line, so they can be appended
+to page by page and read back without holding every tweet in memory. Manifests
+written by older versions, a single JSON array, are still readable.
+"""
+import json
+import logging
+import os
+from json import JSONEncoder
+from pathlib import Path
+from typing import IO, Any, Iterator, Optional, Type
+
+logger = logging.getLogger("twitter-archive.manifest")
+
+# Characters that may follow a complete element of a JSON array.
+_DELIMITERS = frozenset(", \t\r\n]")
+
+
+def is_legacy_manifest(path: Path) -> bool:
+    """Check if a manifest is a single JSON array rather than JSON Lines.
+
+    :param path: Path to the manifest.
+    :returns: Whether the manifest is in the legacy format.
+    """
+    with open(path, "r") as fp:
+        while True:
+            c = fp.read(1)
+            if not c or not c.isspace():
+                return c == "["
+
+
+def _iter_json_array(fp: IO[str], chunk_size: int = 64 * 1024) -> Iterator[Any]:
+    """Incrementally decode each element of a top level JSON array.
+
+    Only the element being decoded, and at most one chunk of the file, is held
+    in memory at a time.
+
+    :param fp: File containing a JSON array.
+    :param chunk_size: Number of characters to read from the file at a time.
+    :returns: Iterator over each element of the array.
+
+    :raises: json.JSONDecodeError: The file is not a valid JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    expect_value = True
+    started = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_whitespace() -> bool:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return True
+            if not fill():
+                return False
+
+    if not skip_whitespace() or buf[pos] != "[":
+        raise json.JSONDecodeError("Expecting '['", buf, pos)
+    pos += 1
+
+    while True:
+        if not skip_whitespace():
+            raise json.JSONDecodeError("Unterminated array", buf, pos)
+
+        c = buf[pos]
+        if c == "]" and (not started or not expect_value):
+            return
+        if not expect_value:
+            if c != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+            pos += 1
+            expect_value = True
+            continue
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Most likely the element straddles the end of the buffer.
+                if eof or not fill():
+                    raise
+                continue
+            # Scalars, i.e. numbers split at '.' or 'e', may continue in the
+            # next chunk until a delimiter follows them.
+            complete = end < len(buf) and buf[end] in _DELIMITERS
+            if isinstance(value, (dict, list)) or complete or eof or not fill():
+                break
+
+        pos = end
+        started = True
+        expect_value = False
+        yield value
+
+
+def read_manifest(path: Path) -> Iterator[dict]:
+    """Read all the tweets from a manifest, one at a time.
+
+    Both JSON Lines and legacy JSON array manifests are streamed, so memory use
+    does not depend on the size of the manifest.
+
+    :param path: Path to the manifest.
+    :returns: Iterator over each tweet in the manifest.
+    """
+    if is_legacy_manifest(path):
+        with open(path, "r") as fp:
+            yield from _iter_json_array(fp)
+        return
+
+    with open(path, "r") as fp:
+        for line in fp:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_manifest_ids(path: Path) -> set:
+    """Read the ID of every tweet in a manifest.
+
+    :param path: Path to the manifest.
+    :returns: Set of all the tweet IDs.
+    """
+    return {i["id"] for i in read_manifest(path)}
+
+
+def checkpoint_path(path: Path) -> Path:
+    """Path of the checkpoint of a manifest being fetched.
+
+    :param path: Path to the manifest.
+    :returns: Path of its checkpoint.
+    """
+    path = Path(path)
+    return path.with_name(path.name + ".checkpoint")
+
+
+def read_checkpoint(path: Path) -> Optional[dict]:
+    """Read the checkpoint of an interrupted fetch of a manifest.
+
+    :param path: Path to the manifest.
+    :returns: The checkpoint, or None if there is none, or it is unreadable.
+    """
+    try:
+        with open(checkpoint_path(path), "r") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable checkpoint of '%s': %s", path, e)
+        return None
+
+
+def write_checkpoint(path: Path, checkpoint: dict) -> None:
+    """Atomically replace the checkpoint of a manifest.
+
+    :param path: Path to the manifest.
+    :param checkpoint: Details to resume the fetch from.
+    """
+    cp_path = checkpoint_path(path)
+    tmp_path = cp_path.with_name(cp_path.name + ".tmp")
+    with open(tmp_path, "w") as fp:
+        json.dump(checkpoint, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, cp_path)
+
+
+def clear_checkpoint(path: Path) -> None:
+    """Remove the checkpoint of a manifest, once it is fully fetched.
+
+    :param path: Path to the manifest.
+    """
+    try:
+        os.unlink(checkpoint_path(path))
+    except FileNotFoundError:
+        pass
+
+
+class ManifestWriter:
+    """Write tweets to a JSON Lines manifest."""
+
+    def __init__(
+        self,
+        path: Path,
+        append: bool = False,
+        cls: Optional[Type[JSONEncoder]] = None,
+    ):
+        """Open a manifest for writing.
+
+        A legacy manifest opened for appending is converted to JSON Lines first.
+
+        :param path: Path to the manifest.
+        :param append: Add to the existing manifest instead of truncating it.
+        :param cls: JSON encoder used to serialize each tweet.
+        """
+        self.path = Path(path)
+        self._cls = cls
+
+        if append and self.path.is_file() and is_legacy_manifest(self.path):
+            self._upgrade()
+
+        self._fp = open(self.path, "a" if append else "w")
+
+    def _upgrade(self) -> None:
+        logger.info("Converting legacy manifest '%s' to JSON Lines", self.path)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as fp:
+            for tweet in read_manifest(self.path):
+                fp.write(json.dumps(tweet) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def write(self, tweet: dict) -> str:
+        """Append a single tweet to the manifest.
+
+        :param tweet: Tweet to serialize.
+        :returns: The serialized tweet, as written.
+        """
+        line = json.dumps(tweet, cls=self._cls)
+        self._fp.write(line + "\n")
+        return line
+
+    def flush(self) -> None:
+        """Flush all written tweets to disk."""
+        self._fp.flush()
+
+    def sync(self) -> int:
+        """Flush all written tweets to disk, and wait for them to be stored.
+
+        :returns: Size of the manifest in bytes.
+        """
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        return self._fp.tell()
+
+    def close(self) -> None:
+        """Flush and close the manifest."""
+        self._fp.close()
+
+    def __enter__(self) -> "ManifestWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,246 @@
+"""Counters and latency histograms for every stage of a run.
+
+Records how long authentication, each page of bookmarks, rate-limit sleeps and
+each media transfer take, and how many bytes were moved. They are exported as
+JSON, or as a Prometheus textfile for node_exporter's textfile collector, at the
+end of a run and optionally on an interval.
+"""
+import bisect
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger("twitter-archive.metrics")
+
+PREFIX = "twitter_archive_"
+
+# Upper bounds, in seconds, of the histogram buckets.
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, str]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], **extra: str) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """Registry of counters, gauges and histograms, safe to share between threads."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """Create an empty registry.
+
+        :param buckets: Upper bounds of the histogram buckets, in seconds.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increase a counter.
+
+        :param name: Name of the counter.
+        :param value: Amount to increase it by.
+        :param labels: Labels of the counter.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge.
+
+        :param name: Name of the gauge.
+        :param value: Value of the gauge.
+        :param labels: Labels of the gauge.
+        """
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Record a value, usually a duration in seconds, in a histogram.
+
+        :param name: Name of the histogram.
+        :param value: Value to record.
+        :param labels: Labels of the histogram.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:
+        """Record how long a block takes in a histogram, even if it raises.
+
+        :param name: Name of the histogram.
+        :param labels: Labels of the histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        """Copy every metric into plain dicts and lists.
+
+        :returns: Dict of counters, gauges and histograms, each a list of dicts
+                  with the name and labels of the metric.
+        """
+        with self._lock:
+            counters = [
+                {"name": n, "labels": dict(lb), "value": v}
+                for (n, lb), v in sorted(self._counters.items())
+            ]
+            gauges = [
+                {"name": n, "labels": dict(lb), "value": v}
+                for (n, lb), v in sorted(self._gauges.items())
+            ]
+            histograms = [
+                {
+                    "name": n,
+                    "labels": dict(lb),
+                    "buckets": dict(zip(h.buckets, h.counts)),
+                    "count": h.count,
+                    "sum": h.sum,
+                }
+                for (n, lb), h in sorted(self._histograms.items())
+            ]
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def to_json(self) -> str:
+        """Export every metric as JSON, see snapshot()."""
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Export every metric in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                typed = set()
+                for (name, labels), value in sorted(metrics.items()):
+                    if name not in typed:
+                        typed.add(name)
+                        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+
+            typed = set()
+            for (name, labels), h in sorted(self._histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {PREFIX}{name} histogram")
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    le = _labels(labels, le=repr(float(bound)))
+                    lines.append(f"{PREFIX}{name}_bucket{le} {cumulative}")
+                le = _labels(labels, le="+Inf")
+                lines.append(f"{PREFIX}{name}_bucket{le} {h.count}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {h.sum}")
+                lines.append(f"{PREFIX}{name}_count{_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path, fmt: str = "json") -> None:
+        """Atomically write every metric to a file.
+
+        Scrapers never see a half written file.
+
+        :param path: Path of the file.
+        :param fmt: 'json' or 'prometheus'.
+        :raises: ValueError: Unknown format.
+        """
+        if fmt == "json":
+            text = self.to_json()
+        elif fmt == "prometheus":
+            text = self.to_prometheus()
+        else:
+            raise ValueError(f"Unknown metrics format '{fmt}'")
+
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w") as fp:
+            fp.write(text)
+        os.replace(tmp, path)
+
+
+class MetricsExporter:
+    """Write metrics to a file on an interval, and once more when stopped."""
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        path: Path,
+        fmt: str = "json",
+        interval: Optional[float] = None,
+    ):
+        """Start exporting.
+
+        :param metrics: Metrics to export.
+        :param path: Path of the file to write.
+        :param fmt: 'json' or 'prometheus'.
+        :param interval: Seconds between writes, or None to only write once
+                         stopped.
+        """
+        self.metrics = metrics
+        self.path = Path(path)
+        self.fmt = fmt
+        self.interval = interval
+        self._start = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        if interval:
+            self._thread = threading.Thread(
+                target=self._run, name="metrics", daemon=True
+            )
+            self._thread.start()
+
+    def _write(self) -> None:
+        self.metrics.set("run_seconds", time.monotonic() - self._start)
+        try:
+            self.metrics.write(self.path, self.fmt)
+        except OSError as e:
+            logger.warning("Failed to write metrics to '%s': %s", self.path, e)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._write()
+
+    def stop(self) -> None:
+        """Stop exporting on an interval, and write the final metrics."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._write()
+        logger.info("Wrote metrics to '%s'", self.path)
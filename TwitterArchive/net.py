@@ -0,0 +1,361 @@
+"""HTTP plumbing shared by all the media downloads."""
+import asyncio
+import contextlib
+import itertools
+import logging
+import random
+import sys
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("twitter-archive.net")
+
+# Connect and read timeouts, in seconds, for every media request.
+DEFAULT_TIMEOUT = (10.0, 60.0)
+
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+# Statuses of a server shedding load, rather than rejecting the request.
+CONGESTION_STATUSES = frozenset({429, 503})
+
+
+def new_session(pool_size: int = 10) -> requests.Session:
+    """Create a keep-alive HTTP session, safe to share between threads.
+
+    Connections to each host are pooled and reused across requests, avoiding
+    a new TCP and TLS handshake for every media file.
+
+    :param pool_size: Maximum number of connections kept open per host. Should
+                      be at least the number of threads using the session.
+    :returns: The new session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    logger.debug("Created HTTP session with a pool of %d connections", pool_size)
+    return session
+
+
+def log_session_stats(session: requests.Session) -> None:
+    """Log how many connections were opened for how many requests, per host.
+
+    :param session: Session created by new_session().
+    """
+    adapters = {id(a): a for a in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            logger.debug(
+                "%s://%s:%s served %d requests over %d connections",
+                pool.scheme,
+                pool.host,
+                pool.port,
+                pool.num_requests,
+                pool.num_connections,
+            )
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request to a host that keeps failing."""
+
+    def __init__(self, host: str):
+        """Create a new error.
+
+        :param host: Host the circuit is open for.
+        """
+        super().__init__(f"Circuit open for '{host}'")
+        self.host = host
+
+
+class IncompleteDownloadError(IOError):
+    """Raised when a transfer ended before the whole file was received."""
+
+
+_TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    IncompleteDownloadError,
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    asyncio.TimeoutError,
+)
+
+
+@contextlib.contextmanager
+def requests_errors() -> Iterator[None]:
+    """Raise errors reading a raw urllib3 response body as requests does.
+
+    Reading resp.raw directly skips the conversion done by iter_content(), so
+    a connection dropped or timing out part way through a body would not be
+    seen as transient.
+    """
+    try:
+        yield
+    except urllib3.exceptions.ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e) from e
+    except urllib3.exceptions.DecodeError as e:
+        raise requests.exceptions.ContentDecodingError(e) from e
+    except urllib3.exceptions.ReadTimeoutError as e:
+        raise requests.ConnectionError(e) from e
+    except urllib3.exceptions.SSLError as e:
+        raise requests.exceptions.SSLError(e) from e
+
+
+def http_status(e: BaseException) -> Optional[int]:
+    """Find the HTTP status code of a failed request, from requests or aiohttp.
+
+    :param e: Exception raised by the request.
+    :returns: The status code, or None if the request got no response.
+    """
+    response = getattr(e, "response", None)
+    if response is not None and getattr(response, "status_code", None):
+        return response.status_code
+    return getattr(e, "status", None)
+
+
+def _is_transient(e: BaseException) -> bool:
+    # aiohttp is slow to import, and cannot have raised e unless the async
+    # engine already imported it.
+    aiohttp = sys.modules.get("aiohttp")
+    return isinstance(e, _TRANSIENT_ERRORS) or (
+        aiohttp is not None and isinstance(e, aiohttp.ClientError)
+    )
+
+
+def is_congestion(e: BaseException) -> bool:
+    """Check if a failure is a sign of too many requests in flight.
+
+    Throttling, timeouts, dropped connections and transfers cut short are,
+    while any other error response is not, i.e. a 404.
+
+    :param e: Exception raised by the request.
+    :returns: Whether to back off.
+    """
+    status = http_status(e)
+    if status is not None:
+        return status in CONGESTION_STATUSES
+    return _is_transient(e)
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or getattr(e, "headers", None)
+    value = (headers or {}).get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Stop requests to hosts which keep failing, for a while.
+
+    After threshold consecutive failures the circuit for a host opens, and
+    requests fail fast with CircuitOpenError. Once the cooldown has passed, a
+    single trial request is let through: success closes the circuit, failure
+    opens it for another cooldown.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        """Create a new breaker.
+
+        :param threshold: Consecutive failures before opening the circuit.
+        :param cooldown: Seconds to keep the circuit open.
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._open_until = {}
+        self._lock = threading.Lock()
+
+    def check(self, host: str) -> None:
+        """Check a request to a host may be made.
+
+        :param host: Host the request is for.
+        :raises: CircuitOpenError: The circuit for the host is open.
+        """
+        with self._lock:
+            until = self._open_until.get(host)
+            if until is None:
+                return
+            now = time.monotonic()
+            if now < until:
+                raise CircuitOpenError(host)
+            # Half open, let this one request through and block the rest.
+            self._open_until[host] = now + self.cooldown
+
+    def success(self, host: str) -> None:
+        """Record a successful request, closing the circuit.
+
+        :param host: Host the request was for.
+        """
+        with self._lock:
+            self._failures.pop(host, None)
+            if self._open_until.pop(host, None) is not None:
+                logger.info("Circuit closed for '%s'", host)
+
+    def reset(self) -> None:
+        """Close every circuit."""
+        with self._lock:
+            self._failures.clear()
+            self._open_until.clear()
+
+    def failure(self, host: str) -> None:
+        """Record a failed request, opening the circuit if over the threshold.
+
+        :param host: Host the request was for.
+        """
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if failures >= self.threshold:
+                if host not in self._open_until:
+                    logger.warning(
+                        "Circuit opened for '%s' after %d failures", host, failures
+                    )
+                self._open_until[host] = time.monotonic() + self.cooldown
+
+
+class RetryPolicy:
+    """Retry transient failures with jittered exponential backoff.
+
+    Media which still fails, or whose host has an open circuit, is deferred so
+    it can be retried once at the end of the run.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        """Create a new policy.
+
+        :param attempts: Maximum number of attempts per request.
+        :param backoff: Base delay in seconds, doubled after every attempt.
+        :param max_backoff: Maximum delay in seconds between attempts.
+        :param breaker: Circuit breaker shared by every request.
+        """
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker
+        self._deferred = {}
+        self._lock = threading.Lock()
+
+    def is_retryable(self, e: BaseException) -> bool:
+        """Check if a failure is likely to be transient.
+
+        :param e: Exception raised by the request.
+        :returns: Whether the request should be retried.
+        """
+        status = http_status(e)
+        if status is not None:
+            return status in RETRY_STATUSES
+        return _is_transient(e)
+
+    def delay(self, attempt: int, e: BaseException) -> float:
+        """Seconds to wait before the next attempt.
+
+        Uses the server's Retry-After header when there is one, otherwise
+        "full jitter" exponential backoff.
+
+        :param attempt: Number of attempts made so far, starting at 1.
+        :param e: Exception raised by the last attempt.
+        :returns: Delay in seconds.
+        """
+        retry_after = _retry_after(e)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def _failed(self, host: str, attempt: int, e: BaseException) -> float:
+        """Record a failed attempt, returning how long to wait or raising e."""
+        if not self.is_retryable(e):
+            raise e
+        if self.breaker is not None:
+            self.breaker.failure(host)
+        if attempt >= self.attempts:
+            raise e
+        delay = self.delay(attempt, e)
+        logger.info("Attempt %d for '%s' failed (%s), retrying", attempt, host, e)
+        return delay
+
+    def call(self, func: Callable[[], Any], url: str) -> Any:
+        """Call func, retrying transient failures.
+
+        :param func: Callable making the request.
+        :param url: URL of the request, for the circuit breaker.
+        :returns: Whatever func returns.
+        :raises: CircuitOpenError: The circuit for the host is open.
+        """
+        host = urlparse(url).netloc
+        for attempt in itertools.count(1):
+            if self.breaker is not None:
+                self.breaker.check(host)
+            try:
+                result = func()
+            except Exception as e:
+                time.sleep(self._failed(host, attempt, e))
+                continue
+            if self.breaker is not None:
+                self.breaker.success(host)
+            return result
+
+    async def call_async(self, func: Callable[[], Awaitable], url: str) -> Any:
+        """Await func, retrying transient failures, see call().
+
+        :param func: Coroutine function making the request.
+        :param url: URL of the request, for the circuit breaker.
+        :returns: Whatever func returns.
+        :raises: CircuitOpenError: The circuit for the host is open.
+        """
+        host = urlparse(url).netloc
+        for attempt in itertools.count(1):
+            if self.breaker is not None:
+                self.breaker.check(host)
+            try:
+                result = await func()
+            except Exception as e:
+                await asyncio.sleep(self._failed(host, attempt, e))
+                continue
+            if self.breaker is not None:
+                self.breaker.success(host)
+            return result
+
+    def defer(self, tweet_obj: dict) -> None:
+        """Queue a tweet to be retried at the end of the run.
+
+        :param tweet_obj: Tweet with media that failed to download.
+        """
+        with self._lock:
+            self._deferred[tweet_obj["id"]] = tweet_obj
+
+    def drain(self) -> list:
+        """Take every deferred tweet.
+
+        :returns: Tweets queued by defer(), in the order they were queued.
+        """
+        with self._lock:
+            deferred = list(self._deferred.values())
+            self._deferred.clear()
+        return deferred
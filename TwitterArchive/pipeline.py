@@ -0,0 +1,158 @@
+"""Overlap fetching tweets with downloading their media.
+
+Tweets are pushed into a bounded queue as they arrive, and a fixed set of
+download threads consume them right away. When the download threads fall
+behind, the queue fills up and fetching pauses until there is room again.
+"""
+import logging
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+logger = logging.getLogger("twitter-archive.pipeline")
+
+# Enough for two pages of bookmarks, so the next page can be fetched while the
+# current one is downloading.
+DEFAULT_QUEUE_SIZE = 200
+
+_DONE = object()
+_ERROR = object()
+_POLL_INTERVAL = 0.1
+
+
+def run_pipeline(
+    items: Iterable[Any],
+    func: Callable[[Any], None],
+    num_workers: int,
+    maxsize: int = DEFAULT_QUEUE_SIZE,
+) -> None:
+    """Call func on every item, consuming items as they are produced.
+
+    The calling thread is the producer, iterating over items, while num_workers
+    threads consume them. The first exception raised by either side stops the
+    whole pipeline and is re-raised once every thread has finished.
+
+    :param items: Items to process, usually a generator.
+    :param func: Callable to run for each item.
+    :param num_workers: Number of consumer threads.
+    :param maxsize: Maximum number of items waiting to be consumed.
+    """
+    work = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    errors = []
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                work.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def consume() -> None:
+        while not stop.is_set():
+            try:
+                item = work.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            try:
+                func(item)
+            except BaseException as e:
+                logger.error("Stopping pipeline after error: %s", e)
+                errors.append(e)
+                stop.set()
+
+    workers = [
+        threading.Thread(target=consume, name=f"download-{i}", daemon=True)
+        for i in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    produced = 0
+    try:
+        for item in items:
+            if not put(item):
+                break
+            produced += 1
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        close = getattr(items, "close", None)
+        if close is not None:
+            close()
+        for _ in workers:
+            put(_DONE)
+
+    logger.info("Produced %d items, waiting for downloads to finish", produced)
+    for worker in workers:
+        worker.join()
+
+    if errors:
+        raise errors[0]
+
+
+def merge_sources(
+    sources: Iterable[Tuple[Any, Iterable[Any]]],
+    maxsize: int = DEFAULT_QUEUE_SIZE,
+) -> Iterator[Tuple[Any, Any]]:
+    """Iterate over several sources at once, each on its own thread.
+
+    Items are yielded as soon as any source produces them, so a source waiting
+    on the network, or a rate limit, does not hold up the others. The first
+    exception raised by a source is re-raised.
+
+    :param sources: Pairs of a key and the items of that source, usually a
+                    generator.
+    :param maxsize: Maximum number of items waiting to be yielded.
+    :returns: Iterator of (key, item) pairs.
+    """
+    merged = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(entry: Any) -> bool:
+        while not stop.is_set():
+            try:
+                merged.put(entry, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(key: Any, items: Iterable[Any]) -> None:
+        try:
+            for item in items:
+                if not put((key, item)):
+                    break
+        except BaseException as e:
+            put((_ERROR, e))
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+            put(_DONE)
+
+    producers = [
+        threading.Thread(target=produce, args=source, name=f"fetch-{i}", daemon=True)
+        for i, source in enumerate(sources)
+    ]
+    for producer in producers:
+        producer.start()
+
+    remaining = len(producers)
+    try:
+        while remaining:
+            entry = merged.get()
+            if entry is _DONE:
+                remaining -= 1
+            elif entry[0] is _ERROR:
+                raise entry[1]
+            else:
+                yield entry
+    finally:
+        # Producers blocked on the network notice once they next produce.
+        stop.set()
@@ -0,0 +1,117 @@
+"""Aggregate progress of every download in a run.
+
+A progress bar per media file makes the terminal unreadable with several
+download threads, and redrawing them all costs a noticeable share of CPU.
+Workers only add to a few counters instead, and a single bar for the whole run
+is redrawn from them at a fixed, low frequency.
+"""
+import logging
+import threading
+import time
+
+from tqdm import tqdm
+
+logger = logging.getLogger("twitter-archive.progress")
+
+# Seconds between redraws of the bar.
+DEFAULT_INTERVAL = 1.0
+
+
+class Progress:
+    """Count files and bytes downloaded, and report them on a single bar."""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, disable: bool = False):
+        """Create a new reporter, see start().
+
+        :param interval: Seconds between redraws of the bar.
+        :param disable: Only count, never draw the bar.
+        """
+        self.interval = interval
+        self.disable = disable
+        self.files_found = 0
+        self.files_done = 0
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._bar = None
+        self._started = None
+
+    def found(self) -> None:
+        """Count a media file found to download, or skip."""
+        with self._lock:
+            self.files_found += 1
+
+    def done(self) -> None:
+        """Count a media file as handled, whether downloaded, skipped or failed."""
+        with self._lock:
+            self.files_done += 1
+
+    def update(self, nbytes: int) -> None:
+        """Count bytes downloaded.
+
+        :param nbytes: Number of bytes.
+        """
+        with self._lock:
+            self.nbytes += nbytes
+
+    def _draw(self) -> None:
+        with self._lock:
+            found, done, nbytes = self.files_found, self.files_done, self.nbytes
+        elapsed = time.monotonic() - self._started
+        rate = nbytes / elapsed if elapsed > 0 else 0.0
+        self._bar.total = found
+        self._bar.n = done
+        self._bar.set_postfix_str(
+            f"{tqdm.format_sizeof(nbytes)}B, {tqdm.format_sizeof(rate)}B/s",
+            refresh=False,
+        )
+        self._bar.refresh()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._draw()
+
+    def start(self) -> "Progress":
+        """Start redrawing the bar every interval.
+
+        :returns: The reporter itself.
+        """
+        self._started = time.monotonic()
+        if self.disable:
+            return self
+        self._bar = tqdm(
+            ascii=True,
+            desc="Media",
+            unit="file",
+            dynamic_ncols=True,
+            # Only ever redrawn by _draw().
+            mininterval=0,
+            miniters=0,
+        )
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop redrawing the bar, after drawing the final counts."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._draw()
+            self._bar.close()
+        logger.info(
+            "Downloaded %s bytes for %d of %d media files",
+            self.nbytes,
+            self.files_done,
+            self.files_found,
+        )
+
+    def __enter__(self) -> "Progress":
+        """Start redrawing the bar."""
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        """Stop redrawing the bar."""
+        self.stop()
@@ -0,0 +1,72 @@
+"""Splitting the download stage of a manifest across machines.
+
+Every tweet belongs to exactly one of N shards, by a hash of its ID, so N hosts
+given the same manifest each download a disjoint slice, into a shared media
+directory or one of their own. Once they are all done, the media directories
+are merged (see layout.merge()) and checked against the manifest with verify().
+"""
+import hashlib
+import logging
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+
+from .core import iter_media
+from .variants import VariantPolicy
+
+logger = logging.getLogger("twitter-archive.shard")
+
+
+def shard_of(tweet_id: Union[int, str], count: int) -> int:
+    """Shard a tweet belongs to.
+
+    The low bits of tweet IDs are a sequence number, often 0, so the ID is
+    hashed to spread tweets evenly.
+
+    :param tweet_id: ID of the tweet.
+    :param count: Number of shards.
+    :returns: Index of the shard, from 0.
+    """
+    digest = hashlib.md5(str(tweet_id).encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def select_shard(tweets: Iterable[dict], index: int, count: int) -> Iterator[dict]:
+    """Only the tweets of a single shard.
+
+    :param tweets: Every tweet, i.e. from a manifest.
+    :param index: Index of the shard, from 0.
+    :param count: Number of shards.
+    :returns: Iterator of the tweets in the shard.
+    """
+    for tweet in tweets:
+        if shard_of(tweet["id"], count) == index:
+            yield tweet
+
+
+def verify(
+    tweets: Iterable[dict],
+    base_dir: Path,
+    layout: str = "flat",
+    policy: Optional[VariantPolicy] = None,
+) -> List[Path]:
+    """Find media of a manifest missing from a media directory.
+
+    Media is only found where the download would have saved it, so the layout
+    and policy must be the ones it was downloaded with.
+
+    :param tweets: Every tweet, i.e. from a manifest.
+    :param base_dir: Media directory to check.
+    :param layout: Layout of base_dir, see layout.LAYOUTS.
+    :param policy: Policy the media variants were chosen with.
+    :returns: Destination of every missing media item.
+    """
+    found = 0
+    missing = []
+    for tweet in tweets:
+        for _, _, dest in iter_media(tweet, base_dir, policy, layout):
+            if dest.is_file():
+                found += 1
+            else:
+                missing.append(dest)
+    logger.info("Found %d media files, %d missing", found, len(missing))
+    return missing
@@ -0,0 +1,128 @@
+"""Content-addressed media store.
+
+The same photo or video is often bookmarked several times, through retweets,
+quotes and reposts. Rather than downloading and saving it once per tweet, media
+is saved once in the store and linked into each tweet's directory.
+
+The store is laid out as::
+
+    <root>/objects/ab/abcdef...123.jpg   Media, named by the SHA-256 of its content.
+    <root>/keys/3_1234567890.jpg         Link to the object for a media_key.
+    <root>/keys/3_1234567890-small.jpg   Link for another variant of it.
+    <root>/tmp/                          Downloads in progress.
+"""
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger("twitter-archive.store")
+
+
+def _sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def link(src: Path, dest: Path) -> None:
+    """Atomically point dest at src, with a hardlink if possible.
+
+    Falls back to an absolute symlink, i.e. when src and dest are on different
+    filesystems.
+
+    :param src: Existing file to link to.
+    :param dest: Path of the new link, replaced if it already exists.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".link")
+    if tmp.is_symlink() or tmp.exists():
+        tmp.unlink()
+    try:
+        os.link(src, tmp)
+    except OSError:
+        os.symlink(src.resolve(), tmp)
+    os.replace(tmp, dest)
+
+
+class MediaStore:
+    """Media deduplicated by media_key and content hash."""
+
+    def __init__(self, root: Path):
+        """Open, or create, a store.
+
+        :param root: Directory of the store.
+        """
+        self.root = Path(root)
+        self._objects = self.root / "objects"
+        self._keys = self.root / "keys"
+        self._tmp = self.root / "tmp"
+        for path in (self._objects, self._keys, self._tmp):
+            path.mkdir(parents=True, exist_ok=True)
+
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _key_path(self, media_key: str, name: str) -> Path:
+        return self._keys / (media_key + Path(name).suffix)
+
+    def lock(self, media_key: str) -> threading.Lock:
+        """Lock to hold while fetching and adding a media_key.
+
+        Stops two threads downloading the same media at once.
+
+        :param media_key: Key of the media.
+        :returns: Lock unique to the media_key.
+        """
+        with self._locks_lock:
+            return self._locks.setdefault(media_key, threading.Lock())
+
+    def lookup(self, media_key: str, name: str) -> Optional[Path]:
+        """Find stored media.
+
+        :param media_key: Key of the media.
+        :param name: File name of the media, for its extension.
+        :returns: Path to the stored media, or None if not yet stored.
+        """
+        path = self._key_path(media_key, name)
+        return path if path.exists() else None
+
+    def staging_path(self, media_key: str, name: str) -> Path:
+        """Path to download media to before adding it.
+
+        Stable for each media_key, so interrupted downloads can be resumed.
+
+        :param media_key: Key of the media.
+        :param name: File name of the media, for its extension.
+        :returns: Path in the store's temporary directory.
+        """
+        return self._tmp / (media_key + Path(name).suffix)
+
+    def add(self, path: Path, media_key: str) -> Path:
+        """Move a downloaded file into the store.
+
+        If identical content is already stored, the file is discarded in favor
+        of the existing object.
+
+        :param path: Downloaded file, usually from staging_path().
+        :param media_key: Key of the media.
+        :returns: Path to the stored media.
+        """
+        digest = _sha256(path)
+        obj = self._objects / digest[:2] / (digest + path.suffix)
+        obj.parent.mkdir(exist_ok=True)
+        if obj.exists():
+            logger.info("Content of '%s' already stored as '%s'", media_key, obj)
+            path.unlink()
+        else:
+            os.replace(path, obj)
+
+        key_path = self._key_path(media_key, path.name)
+        link(obj, key_path)
+        return key_path
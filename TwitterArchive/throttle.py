@@ -0,0 +1,73 @@
+"""Limit on the bandwidth of every media transfer combined.
+
+A token bucket shared by every download worker. Tokens are bytes, added at the
+configured rate up to a burst of one second's worth. Workers take tokens for
+every chunk they read, and sleep off any they take in advance, so the combined
+rate holds regardless of the number of workers.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger("twitter-archive.throttle")
+
+# Seconds of transfer per chunk read while throttled, so low rates stay smooth.
+_CHUNK_SECONDS = 0.1
+_MIN_CHUNK_SIZE = 16 * 1024
+
+
+class TokenBucket:
+    """Token bucket of bytes, shared by threads and coroutines."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """Create a new, full, bucket.
+
+        :param rate: Bytes per second.
+        :param burst: Most bytes transferred at once after idling, defaults to
+                      one second's worth.
+        :raises: ValueError: The rate is not positive.
+        """
+        if rate <= 0:
+            raise ValueError("Rate must be greater than 0")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def chunk_size(self) -> int:
+        """Largest chunk to read at a time, to not transfer in bursts."""
+        return max(_MIN_CHUNK_SIZE, int(self.rate * _CHUNK_SECONDS))
+
+    def _reserve(self, nbytes: int) -> float:
+        # Taking more tokens than there are is allowed, the debt is slept off
+        # by this caller, and delays every later caller.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= nbytes
+            return max(0.0, -self._tokens / self.rate)
+
+    def consume(self, nbytes: int) -> None:
+        """Take tokens for bytes transferred, sleeping until they are paid for.
+
+        :param nbytes: Number of bytes.
+        """
+        delay = self._reserve(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def consume_async(self, nbytes: int) -> None:
+        """Take tokens for bytes transferred, see consume().
+
+        :param nbytes: Number of bytes.
+        """
+        delay = self._reserve(nbytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
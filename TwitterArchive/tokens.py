@@ -0,0 +1,168 @@
+"""Renewal of OAuth 2.0 access tokens with their refresh token.
+
+Access tokens expire after two hours. Tokens granted with the 'offline.access'
+scope come with a refresh token, which is exchanged for a new access token in a
+single request, without a browser or anyone at the keyboard. Refresh tokens are
+single use, every refresh returns the next one, which is cached with the new
+access token.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import requests
+
+if TYPE_CHECKING:
+    import tweepy
+
+logger = logging.getLogger("twitter-archive.tokens")
+
+TOKEN_URL = "https://api.twitter.com/2/oauth2/token"
+
+# Seconds before expiry to renew the access token.
+DEFAULT_MARGIN = 300.0
+
+
+def save_token(token: dict, path: Optional[Path]) -> None:
+    """Atomically write token details to the cache, readable only by the user.
+
+    :param token: Token details.
+    :param path: Path of the cache, or None to not cache the token.
+    """
+    if path is None:
+        return
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as fp:
+        json.dump(token, fp)
+    os.replace(tmp, path)
+    logger.info("Wrote access token details to '%s'", path)
+
+
+def expires_soon(token: dict, margin: float = 0.0) -> bool:
+    """Check if an access token has, or is about to, expire.
+
+    :param token: Token details.
+    :param margin: Seconds before the actual expiry to consider it expired.
+    :returns: Whether the token expires within margin seconds.
+    """
+    return float(token["expires_at"]) - margin < time.time()
+
+
+def refresh_token(
+    token: dict,
+    client_id: str,
+    client_secret: Optional[str] = None,
+    token_url: Optional[str] = None,
+) -> dict:
+    """Exchange a refresh token for a new access token.
+
+    :param token: Token details, with a refresh token.
+    :param client_id: Client ID from the Twitter dev app portal.
+    :param client_secret: Client secret, for confidential clients.
+    :param token_url: URL of the token endpoint, defaults to Twitter's.
+    :returns: New token details, including the next refresh token.
+    :raises: KeyError: The token has no refresh token.
+    :raises: requests.HTTPError: The refresh token was rejected.
+    """
+    auth = None if client_secret is None else (client_id, client_secret)
+    resp = requests.post(
+        token_url or TOKEN_URL,
+        data={
+            "grant_type": "refresh_token",
+            "refresh_token": token["refresh_token"],
+            "client_id": client_id,
+        },
+        auth=auth,
+        timeout=30,
+    )
+    resp.raise_for_status()
+
+    new_token = resp.json()
+    new_token["expires_at"] = time.time() + float(new_token["expires_in"])
+    if isinstance(new_token.get("scope"), str):
+        new_token["scope"] = new_token["scope"].split()
+    logger.info("Refreshed access token")
+    return new_token
+
+
+class TokenRefresher:
+    """Hand out an access token, refreshing it ahead of expiry."""
+
+    def __init__(
+        self,
+        token: dict,
+        cache_path: Optional[Path],
+        client_id: Optional[str],
+        client_secret: Optional[str] = None,
+        margin: float = DEFAULT_MARGIN,
+        token_url: Optional[str] = None,
+    ):
+        """Create a new refresher.
+
+        :param token: Current token details.
+        :param cache_path: Path to cache refreshed token details.
+        :param client_id: Client ID from the Twitter dev app portal, without it
+                          the token is never refreshed.
+        :param client_secret: Client secret, for confidential clients.
+        :param margin: Seconds before expiry to refresh the token.
+        :param token_url: URL of the token endpoint, defaults to Twitter's.
+        """
+        self.token = token
+        self.cache_path = cache_path
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.margin = margin
+        self.token_url = token_url
+        self._lock = threading.Lock()
+
+    @property
+    def can_refresh(self) -> bool:
+        """Whether the token can be refreshed."""
+        return self.client_id is not None and "refresh_token" in self.token
+
+    def access_token(self) -> str:
+        """Get a current access token, refreshing it if it expires soon.
+
+        A failed refresh is only an error once the token has actually expired,
+        until then the current token is used and the refresh tried again.
+
+        :returns: The access token.
+        :raises: requests.RequestException: The expired token could not be
+                                            refreshed.
+        """
+        with self._lock:
+            if self.can_refresh and expires_soon(self.token, self.margin):
+                try:
+                    self.token = refresh_token(
+                        self.token, self.client_id, self.client_secret, self.token_url
+                    )
+                except requests.RequestException as e:
+                    if expires_soon(self.token):
+                        raise
+                    logger.warning("Failed to refresh access token: %s", e)
+                else:
+                    save_token(self.token, self.cache_path)
+            return self.token["access_token"]
+
+
+def new_client(refresher: TokenRefresher) -> "tweepy.Client":
+    """Create a client which renews its access token before every request.
+
+    :param refresher: Refresher of the access token.
+    :returns: The client.
+    """
+    import tweepy
+
+    class RefreshingClient(tweepy.Client):
+        def request(self, *args, **kwargs):
+            self.bearer_token = refresher.access_token()
+            return super().request(*args, **kwargs)
+
+    # Rate limits are waited out by get_bookmarks(), so the waits are measured.
+    return RefreshingClient(refresher.access_token(), wait_on_rate_limit=False)
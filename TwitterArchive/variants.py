@@ -0,0 +1,248 @@
+"""Choosing which variant of each media item to download.
+
+By default the highest bitrate variant of every video and the default size of
+every photo are downloaded. For bulk archives, a policy trades quality for far
+fewer bytes: a maximum bitrate or resolution for videos, a byte budget for the
+whole run, and a smaller size for photos. Choices are made from the variants,
+width and height already in the manifest, without any extra requests.
+"""
+import logging
+import re
+import threading
+from typing import Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+logger = logging.getLogger("twitter-archive.variants")
+
+# Longest side of each photo size, None for the original.
+PHOTO_SIZES = {"orig": None, "large": 2048, "medium": 1200, "small": 680}
+
+_RESOLUTION = re.compile(r"/(\d+)x(\d+)/")
+
+
+def bitrate_variants(media: dict) -> list:
+    """Video variants with a bitrate, highest bitrate first.
+
+    :param media: Video media item.
+    :returns: Variants, without streaming playlists.
+    """
+    variants = [x for x in media["variants"] if "bit_rate" in x]
+    return sorted(variants, key=lambda x: x["bit_rate"], reverse=True)
+
+
+def variant_resolution(variant: dict) -> Optional[Tuple[int, int]]:
+    """Width and height of a video variant, from its URL.
+
+    :param variant: Video variant.
+    :returns: Width and height, or None if not in the URL.
+    """
+    match = _RESOLUTION.search(urlparse(variant["url"]).path)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def estimate_bytes(media: dict, variant: dict) -> Optional[int]:
+    """Estimate the size of a video variant from its bitrate and duration.
+
+    :param media: Video media item.
+    :param variant: Variant of the video.
+    :returns: Estimated size in bytes, or None without a duration.
+    """
+    duration_ms = media.get("duration_ms")
+    if duration_ms is None:
+        return None
+    return int(variant["bit_rate"] * duration_ms / 8000)
+
+
+def photo_size_url(url: str, size: str) -> str:
+    """URL of a photo at a given size.
+
+    The path, and so the saved file name, is unchanged.
+
+    :param url: URL of the photo.
+    :param size: One of PHOTO_SIZES.
+    :returns: URL asking for the size.
+    """
+    parts = urlparse(url)
+    query = dict(parse_qsl(parts.query))
+    query["name"] = size
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+def variant_key(media: dict, url: str) -> str:
+    """Key to store a variant of media under, see store.MediaStore.
+
+    The default variant, the highest bitrate of a video or the default size of
+    a photo, is keyed by the media_key alone, and any other by its bitrate or
+    size as well, so one never stands in for another.
+
+    :param media: Media item, with a media_key.
+    :param url: URL of the variant to download.
+    :returns: The key.
+    """
+    key = media["media_key"]
+    if media["type"] == "video":
+        variants = bitrate_variants(media)
+        bit_rate = next((x["bit_rate"] for x in variants if x["url"] == url), None)
+        if bit_rate is not None and bit_rate != variants[0]["bit_rate"]:
+            return f"{key}-{bit_rate}"
+        return key
+    size = dict(parse_qsl(urlparse(url).query)).get("name")
+    return key if size is None else f"{key}-{size}"
+
+
+def _photo_scale(media: dict, size: str) -> Optional[float]:
+    """Fraction of the original pixels in a photo size, if known."""
+    longest = PHOTO_SIZES[size]
+    width, height = media.get("width"), media.get("height")
+    if longest is None or not width or not height:
+        return None if longest is not None else 1.0
+    return min(1.0, longest / max(width, height)) ** 2
+
+
+class VariantPolicy:
+    """Choose media variants within limits on bitrate, resolution and bytes.
+
+    Every choice is tallied, to report how many bytes the limits saved. Media
+    retried later is tallied again, unless a byte budget is set.
+    """
+
+    def __init__(
+        self,
+        max_bitrate: Optional[int] = None,
+        max_resolution: Optional[int] = None,
+        byte_budget: Optional[int] = None,
+        photo_size: Optional[str] = None,
+    ):
+        """Create a new policy.
+
+        :param max_bitrate: Highest video bitrate to download, in bits/s.
+        :param max_resolution: Highest video resolution to download, as the
+                               shorter side in pixels, i.e. 720.
+        :param byte_budget: Estimated bytes of video to download in the whole
+                            run. Videos are downgraded to fit the remaining
+                            budget, and skipped once even the lowest bitrate
+                            does not fit.
+        :param photo_size: Size of photos to download, one of PHOTO_SIZES.
+        :raises: ValueError: Unknown photo size.
+        """
+        if photo_size is not None and photo_size not in PHOTO_SIZES:
+            raise ValueError(f"Unknown photo size '{photo_size}'")
+        self.max_bitrate = max_bitrate
+        self.max_resolution = max_resolution
+        self.byte_budget = byte_budget
+        self.photo_size = photo_size
+
+        self._lock = threading.Lock()
+        self._remaining = byte_budget
+        # Only a budget makes choices depend on earlier ones.
+        self._chosen = {} if byte_budget is not None else None
+        self.videos = 0
+        self.videos_downgraded = 0
+        self.videos_skipped = 0
+        self.videos_unknown = 0
+        self.best_bytes = 0
+        self.chosen_bytes = 0
+        self.photos = 0
+        self.photos_resized = 0
+        self.photo_pixels = 0.0
+
+    def _allowed(self, variant: dict) -> bool:
+        if self.max_bitrate is not None and variant["bit_rate"] > self.max_bitrate:
+            return False
+        resolution = variant_resolution(variant)
+        if self.max_resolution is not None and resolution is not None:
+            return min(resolution) <= self.max_resolution
+        return True
+
+    def select_video(self, media: dict) -> Optional[dict]:
+        """Choose the variant of a video to download.
+
+        :param media: Video media item.
+        :returns: The variant, or None to skip the video.
+        """
+        variants = bitrate_variants(media)
+        best = variants[0]
+        # Fall back to the lowest bitrate when nothing is within the limits.
+        candidates = [x for x in variants if self._allowed(x)] or variants[-1:]
+
+        with self._lock:
+            # Media retried later keeps its variant, and its budget is only
+            # spent once.
+            key = media.get("media_key", best["url"])
+            if self._chosen is not None and key in self._chosen:
+                return self._chosen[key]
+
+            chosen = candidates[0]
+            if self._remaining is not None:
+                fits = [
+                    x
+                    for x in candidates
+                    if (estimate_bytes(media, x) or 0) <= self._remaining
+                ]
+                chosen = fits[0] if fits else None
+                if chosen is not None:
+                    self._remaining -= estimate_bytes(media, chosen) or 0
+
+            self.videos += 1
+            best_bytes = estimate_bytes(media, best)
+            if best_bytes is None:
+                self.videos_unknown += 1
+            else:
+                self.best_bytes += best_bytes
+            if self._chosen is not None:
+                self._chosen[key] = chosen
+            if chosen is None:
+                self.videos_skipped += 1
+                logger.warning("Byte budget spent, skipping '%s'", best["url"])
+                return None
+            if chosen is not best:
+                self.videos_downgraded += 1
+            self.chosen_bytes += estimate_bytes(media, chosen) or 0
+        return chosen
+
+    def photo_url(self, media: dict) -> str:
+        """Choose the URL of a photo to download.
+
+        :param media: Photo media item.
+        :returns: URL of the photo, at photo_size if set.
+        """
+        url = media["url"]
+        scale = 1.0
+        if self.photo_size is not None:
+            scale = _photo_scale(media, self.photo_size)
+        with self._lock:
+            self.photos += 1
+            if scale is not None and scale < 1.0:
+                self.photos_resized += 1
+            self.photo_pixels += 1.0 if scale is None else scale
+        if self.photo_size is None:
+            return url
+        return photo_size_url(url, self.photo_size)
+
+    def report(self) -> str:
+        """Summarise the choices made so far.
+
+        :returns: Human readable report of the estimated bytes saved.
+        """
+        mb = 1024**2
+        saved = self.best_bytes - self.chosen_bytes
+        pct = 100 * saved / self.best_bytes if self.best_bytes else 0.0
+        lines = [
+            f"Videos: {self.videos} ({self.videos_downgraded} downgraded, "
+            f"{self.videos_skipped} skipped, {self.videos_unknown} without a "
+            "duration to estimate)",
+            f"  Estimated {self.best_bytes / mb:.1f} MB at the highest bitrate, "
+            f"{self.chosen_bytes / mb:.1f} MB selected, "
+            f"{saved / mb:.1f} MB ({pct:.0f}%) saved",
+        ]
+        if self.photos:
+            pixels = 100 * self.photo_pixels / self.photos
+            lines += [
+                f"Photos: {self.photos} ({self.photos_resized} resized to "
+                f"{self.photo_size or 'default'})",
+                f"  About {pixels:.0f}% of the original pixels, photo sizes are "
+                "not known until downloaded",
+            ]
+        return "\n".join(lines)
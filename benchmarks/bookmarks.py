@@ -0,0 +1,151 @@
+"""Benchmark fetching bookmarks against a local stand-in for the Twitter API.
+
+Runs get_bookmarks() end to end, including pagination, merging media from the
+expansions and writing the manifest, against a twitter_api.BookmarksAPIServer
+in another process, so only the client's CPU time is measured::
+
+    $ python -m benchmarks.bookmarks --count 100000 --media-density 0.8
+    $ python -m benchmarks.bookmarks --count 1000000 --tracemalloc
+
+Reports total time, CPU time per page, and memory growth: peak RSS, and with
+--tracemalloc the memory traced after the first and last pages.
+"""
+import argparse
+import json
+import multiprocessing
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import List, Optional
+
+import tweepy
+
+from benchmarks.download import _peak_rss_mb, _percentile
+from benchmarks.twitter_api import BookmarksAPIServer, redirect_client
+
+
+def _serve(kwargs: dict, urls, stop) -> None:
+    """Serve the API until stop is set, in a child process."""
+    with BookmarksAPIServer(**kwargs) as api:
+        urls.put(api.url)
+        stop.wait()
+
+
+def run(client: tweepy.Client, save_path: Path, trace: bool = False) -> dict:
+    """Fetch every bookmark, measuring each page.
+
+    :param client: Client redirected to the local API, see redirect_client().
+    :param save_path: Path to write the manifest to.
+    :param trace: Measure memory with tracemalloc, which is slower.
+    :returns: Results, see main().
+    """
+    from TwitterArchive.core import get_bookmarks
+
+    cpu = []
+    traced = []
+    get_page = client.get_bookmarks
+    last = [time.process_time()]
+
+    def timed_get_page(*args, **kwargs):
+        # CPU time since the last request is spent on the previous page.
+        now = time.process_time()
+        cpu.append(now - last[0])
+        if trace:
+            traced.append(tracemalloc.get_traced_memory()[0])
+        resp = get_page(*args, **kwargs)
+        last[0] = time.process_time()
+        return resp
+
+    client.get_bookmarks = timed_get_page
+    if trace:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    tweets = sum(1 for _ in get_bookmarks(client, save_path=save_path))
+    elapsed = time.perf_counter() - start
+    cpu.append(time.process_time() - last[0])
+    if trace:
+        traced.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+
+    # The first entry is before any page was fetched.
+    cpu = cpu[1:]
+    traced = traced[1:]
+    return dict(
+        tweets=tweets,
+        pages=len(cpu),
+        seconds=elapsed,
+        tweets_per_s=tweets / elapsed,
+        cpu_ms_per_page=sum(cpu) / len(cpu) * 1000,
+        p50_cpu_ms=_percentile(cpu, 50) * 1000,
+        p99_cpu_ms=_percentile(cpu, 99) * 1000,
+        manifest_mb=save_path.stat().st_size / 1024**2,
+        peak_rss_mb=_peak_rss_mb(),
+        traced_first_mb=traced[0] / 1024**2 if traced else None,
+        traced_last_mb=traced[-1] / 1024**2 if traced else None,
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the benchmark's CLI parser."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=10000, help="Bookmarks.")
+    parser.add_argument("--media-density", type=float, default=0.5)
+    parser.add_argument("--media-per-tweet", type=int, default=2)
+    parser.add_argument("--video-fraction", type=float, default=0.2)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds.")
+    parser.add_argument(
+        "--rate-limit", type=int, default=0, help="Requests per --rate-window."
+    )
+    parser.add_argument("--rate-window", type=float, default=900.0, help="Seconds.")
+    parser.add_argument("--tracemalloc", action="store_true")
+    parser.add_argument("--json", type=Path, help="Also write results to FILE.")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    """Run the benchmark and print its results.
+
+    :param argv: Arguments, defaults to sys.argv.
+    :returns: Results, with tweets, pages, seconds, tweets_per_s,
+              cpu_ms_per_page, p50_cpu_ms, p99_cpu_ms, manifest_mb,
+              peak_rss_mb, traced_first_mb and traced_last_mb.
+    """
+    args = build_parser().parse_args(argv)
+    api_kwargs = dict(
+        count=args.count,
+        media_density=args.media_density,
+        media_per_tweet=args.media_per_tweet,
+        video_fraction=args.video_fraction,
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+    )
+
+    ctx = multiprocessing.get_context("spawn")
+    urls = ctx.Queue()
+    stop = ctx.Event()
+    server = ctx.Process(target=_serve, args=(api_kwargs, urls, stop), daemon=True)
+    server.start()
+    try:
+        # Rate limits are waited out by core._request_page(), as in the CLI.
+        client = tweepy.Client("benchmark", wait_on_rate_limit=False)
+        redirect_client(client, urls.get())
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run(client, Path(tmp) / "manifest.jsonl", args.tracemalloc)
+    finally:
+        stop.set()
+        server.join()
+
+    for key, value in results.items():
+        if isinstance(value, float):
+            value = f"{value:.2f}"
+        print(f"{key:>16}: {value}")
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Local stand-in for Twitter's media CDN.
+
+Serves synthetic photos and videos of a configurable size, with configurable
+latency and failure rate, so downloads can be benchmarked fully offline.
+Media is generated on the fly, never held in memory whole.
+
+Photos are served from ``/photo/<name>.jpg`` and videos from
+``/video/<name>.mp4``; any name works. Range requests are supported.
+"""
+import http.server
+import random
+import re
+import threading
+import time
+from typing import Iterator, Optional
+
+_BLOCK = bytes(range(256)) * 256
+
+
+class _MediaHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "CDNServer"
+
+    def do_GET(self):
+        cdn = self.server
+        size = cdn.size_of(self.path)
+        if size is None:
+            self.send_error(404)
+            return
+
+        time.sleep(cdn.latency)
+        if cdn.should_fail():
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match is not None and int(match.group(1)) < size:
+            start = int(match.group(1))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+
+        pos = start
+        while pos < size:
+            offset = pos % len(_BLOCK)
+            chunk = _BLOCK[offset : offset + size - pos]
+            self.wfile.write(chunk)
+            pos += len(chunk)
+        cdn.record(size - start)
+
+    def log_message(self, *args):
+        pass
+
+
+class CDNServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server of synthetic media."""
+
+    daemon_threads = True
+    # Lots of workers connect at once, do not refuse any of them.
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        photo_size: int = 200 * 1024,
+        video_size: int = 5 * 1024 * 1024,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+        address: str = "127.0.0.1",
+    ):
+        """Create a new server, listening on a free port.
+
+        :param photo_size: Size in bytes of every photo.
+        :param video_size: Size in bytes of every video.
+        :param latency: Seconds to wait before responding to every request.
+        :param failure_rate: Fraction of requests to fail with a 503.
+        :param seed: Seed for choosing which requests fail.
+        :param address: Address to listen on.
+        """
+        super().__init__((address, 0), _MediaHandler)
+        self.photo_size = photo_size
+        self.video_size = video_size
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def size_of(self, path: str) -> Optional[int]:
+        """Size of the media at a path, or None if there is none."""
+        if path.startswith("/photo/"):
+            return self.photo_size
+        if path.startswith("/video/"):
+            return self.video_size
+        return None
+
+    def should_fail(self) -> bool:
+        """Decide if the current request fails."""
+        with self._lock:
+            self.requests += 1
+            return self._random.random() < self.failure_rate
+
+    def record(self, nbytes: int) -> None:
+        """Count bytes sent in a response."""
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def tweets(self, count: int, photos: int = 2, videos: int = 0) -> Iterator[dict]:
+        """Generate tweets with media on this server.
+
+        Videos have several variants, like the real API, and only the highest
+        bitrate one is served.
+
+        :param count: Number of tweets.
+        :param photos: Number of photos in each tweet.
+        :param videos: Number of videos in each tweet.
+        :returns: Iterator of tweet dicts, as stored in a manifest.
+        """
+        for i in range(count):
+            media = [
+                {
+                    "media_key": f"3_{i}_{j}",
+                    "type": "photo",
+                    "url": f"{self.url}/photo/{i}_{j}.jpg",
+                }
+                for j in range(photos)
+            ]
+            for j in range(videos):
+                variants = [
+                    {"content_type": "application/x-mpegURL", "url": "unused.m3u8"},
+                    {"bit_rate": 256000, "url": f"{self.url}/low/{i}_{j}.mp4"},
+                    {"bit_rate": 2176000, "url": f"{self.url}/video/{i}_{j}.mp4"},
+                ]
+                media.append(
+                    {"media_key": f"7_{i}_{j}", "type": "video", "variants": variants}
+                )
+            yield {"id": i, "text": f"Tweet {i}", "media": media}
+
+    def __enter__(self) -> "CDNServer":
+        """Start serving on a background thread."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, args=(0.05,), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,199 @@
+"""Benchmark media download throughput against a local CDN stand-in.
+
+Runs fully offline. Every case runs in a fresh process, so peak RSS is measured
+per case, against a cdn.CDNServer in this process::
+
+    $ python -m benchmarks.download --threads 1 4 16 --chunk-sizes 1024 1048576
+    $ python -m benchmarks.download --stage cli --videos 1 --latency 0.05
+
+Two stages can be benchmarked:
+
+- ``download``: download_tweet() on the download threads, as cli.main() runs
+  it, for every combination of thread count and chunk size.
+- ``cli``: the whole cli.main() download stage from a manifest, for every
+  thread count (with the default chunk size).
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+from unittest import mock
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from benchmarks.cdn import CDNServer
+
+
+def _percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB everywhere else.
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+def _run_case(case: dict, tweets: List[dict], results) -> None:
+    """Run a single case, in a child process."""
+    from TwitterArchive import cli, core
+    from TwitterArchive.net import RetryPolicy, new_session
+    from TwitterArchive.pipeline import run_pipeline
+
+    latencies = []
+    lock = threading.Lock()
+    fetch_media = core.fetch_media
+
+    @functools.wraps(fetch_media)
+    def timed_fetch_media(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fetch_media(*args, **kwargs)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    core.fetch_media = timed_fetch_media
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir = Path(tmp) / "media"
+        base_dir.mkdir()
+        threads = case["threads"]
+
+        start = time.perf_counter()
+        if case["stage"] == "cli":
+            manifest = Path(tmp) / "manifest.jsonl"
+            with open(manifest, "w") as fp:
+                for tweet in tweets:
+                    fp.write(json.dumps(tweet) + "\n")
+            argv = ["twitter-archive", "--quiet", "-i", str(manifest)]
+            argv += ["-o", str(base_dir), "--num-download-threads", str(threads)]
+            start = time.perf_counter()
+            with mock.patch.object(sys, "argv", argv):
+                cli.main()
+        else:
+            retry = RetryPolicy(backoff=0.01)
+            with new_session(threads) as session:
+                download = functools.partial(
+                    core.download_tweet,
+                    base_dir=base_dir,
+                    chunk_size=case["chunk_size"],
+                    session=session,
+                    retry=retry,
+                )
+                run_pipeline(tweets, download, threads)
+        elapsed = time.perf_counter() - start
+
+        files = [p for p in base_dir.rglob("*") if p.is_file()]
+        nbytes = sum(p.stat().st_size for p in files)
+
+    results.put(
+        dict(
+            case,
+            files=len(files),
+            seconds=elapsed,
+            files_per_s=len(files) / elapsed,
+            mb_per_s=nbytes / elapsed / 1024**2,
+            p50_ms=_percentile(latencies, 50) * 1000 if latencies else None,
+            p99_ms=_percentile(latencies, 99) * 1000 if latencies else None,
+            peak_rss_mb=_peak_rss_mb(),
+        )
+    )
+
+
+def run_case(case: dict, tweets: List[dict]) -> dict:
+    """Run a case in a fresh process.
+
+    :param case: Stage, threads and chunk_size of the case.
+    :param tweets: Tweets to download.
+    :returns: case, with files, seconds, files_per_s, mb_per_s, p50_ms, p99_ms
+              and peak_rss_mb added.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_run_case, args=(case, tweets, results))
+    proc.start()
+    result = results.get()
+    proc.join()
+    return result
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the benchmark's CLI parser."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stage", choices=("download", "cli"), default="download")
+    parser.add_argument("--tweets", type=int, default=200)
+    parser.add_argument("--photos", type=int, default=2, help="Photos per tweet.")
+    parser.add_argument("--videos", type=int, default=0, help="Videos per tweet.")
+    parser.add_argument("--photo-size", type=int, default=200 * 1024)
+    parser.add_argument("--video-size", type=int, default=5 * 1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds.")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument(
+        "--chunk-sizes", type=int, nargs="+", default=[1024, 64 * 1024, 1024 * 1024]
+    )
+    parser.add_argument("--json", type=Path, help="Also write results to FILE.")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> List[dict]:
+    """Run every case and print a table of results.
+
+    :param argv: Arguments, defaults to sys.argv.
+    :returns: Results of every case, see run_case().
+    """
+    args = build_parser().parse_args(argv)
+    chunk_sizes = args.chunk_sizes if args.stage == "download" else [None]
+    results = []
+
+    with CDNServer(
+        photo_size=args.photo_size,
+        video_size=args.video_size,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+    ) as cdn:
+        tweets = list(cdn.tweets(args.tweets, args.photos, args.videos))
+        print(
+            f"{'stage':>8} {'threads':>7} {'chunk':>8} {'files/s':>8} {'MB/s':>8} "
+            f"{'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8}"
+        )
+        for threads in args.threads:
+            for chunk_size in chunk_sizes:
+                case = dict(stage=args.stage, threads=threads, chunk_size=chunk_size)
+                result = run_case(case, tweets)
+                results.append(result)
+                print(
+                    f"{args.stage:>8} {threads:>7} {chunk_size or '-':>8} "
+                    f"{result['files_per_s']:>8.1f} {result['mb_per_s']:>8.1f} "
+                    f"{_fmt(result['p50_ms']):>8} {_fmt(result['p99_ms']):>8} "
+                    f"{_fmt(result['peak_rss_mb']):>8}",
+                    flush=True,
+                )
+        print(f"Served {cdn.requests} requests, {cdn.bytes_sent / 1024**2:.1f} MB")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Local stand-in for the Twitter v2 bookmarks endpoint.
+
+Serves as many bookmarks as asked for, generated on the fly page by page, with
+``data``, ``includes`` and ``meta.next_token`` like the real API, and
+rate-limit headers. Tweets are newest first, so ids count down.
+
+Point a tweepy.Client at it with redirect_client().
+"""
+import http.server
+import json
+import math
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import tweepy
+from requests.adapters import HTTPAdapter
+
+_API = "https://api.twitter.com"
+_USER_ID = "1"
+_BOOKMARKS = re.compile(r"/2/users/(\d+)/bookmarks")
+
+
+class _APIHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "BookmarksAPIServer"
+
+    def _send_json(self, status: int, obj: dict, headers: dict) -> None:
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        api = self.server
+        url = urlparse(self.path)
+        if url.path == "/2/users/me":
+            user = {"id": _USER_ID, "name": "Benchmark", "username": "benchmark"}
+            self._send_json(200, {"data": user}, {})
+            return
+        if _BOOKMARKS.fullmatch(url.path) is None:
+            self._send_json(404, {"title": "Not Found Error"}, {})
+            return
+
+        headers = api.take_request()
+        if headers["x-rate-limit-remaining"] < 0:
+            headers["x-rate-limit-remaining"] = 0
+            self._send_json(429, {"title": "Too Many Requests"}, headers)
+            return
+
+        time.sleep(api.latency)
+        params = parse_qs(url.query)
+        max_results = int(params.get("max_results", ["100"])[0])
+        offset = int(params.get("pagination_token", ["0"])[0])
+        self._send_json(200, api.page(offset, max_results), headers)
+
+    def log_message(self, *args):
+        pass
+
+
+class BookmarksAPIServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server of synthetic bookmarks."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        count: int = 10000,
+        media_density: float = 0.5,
+        media_per_tweet: int = 2,
+        video_fraction: float = 0.2,
+        latency: float = 0.0,
+        rate_limit: int = 0,
+        rate_window: float = 900.0,
+        seed: int = 0,
+        address: str = "127.0.0.1",
+    ):
+        """Create a new server, listening on a free port.
+
+        :param count: Total number of bookmarks.
+        :param media_density: Fraction of tweets with media.
+        :param media_per_tweet: Number of media items in tweets with media.
+        :param video_fraction: Fraction of media items which are videos.
+        :param latency: Seconds to wait before responding with every page.
+        :param rate_limit: Requests allowed per rate_window, 0 for no limit.
+        :param rate_window: Seconds until the rate limit resets.
+        :param seed: Seed for choosing which tweets have media.
+        :param address: Address to listen on.
+        """
+        super().__init__((address, 0), _APIHandler)
+        self.count = count
+        self.media_density = media_density
+        self.media_per_tweet = media_per_tweet
+        self.video_fraction = video_fraction
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.seed = seed
+        self.pages = 0
+        self._window_start = time.time()
+        self._window_requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def take_request(self) -> dict:
+        """Count a request against the rate limit.
+
+        :returns: Rate-limit headers for the response. Remaining is negative if
+                  the limit has been exceeded.
+        """
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.rate_window:
+                self._window_start = now
+                self._window_requests = 0
+            self._window_requests += 1
+            self.pages += 1
+            limit = self.rate_limit or 1000000
+            return {
+                "x-rate-limit-limit": limit,
+                "x-rate-limit-remaining": limit - self._window_requests,
+                "x-rate-limit-reset": math.ceil(self._window_start + self.rate_window),
+            }
+
+    def page(self, offset: int, max_results: int) -> dict:
+        """Build a page of the bookmarks response.
+
+        :param offset: Index of the first bookmark, the pagination token.
+        :param max_results: Maximum number of bookmarks in the page.
+        :returns: The JSON response.
+        """
+        end = min(self.count, offset + max_results)
+        data = []
+        media = []
+        users = {}
+        for i in range(offset, end):
+            tweet_id = str(10**18 - i)
+            author_id = str(1000 + i % 97)
+            tweet = {
+                "id": tweet_id,
+                "text": f"Bookmarked tweet {i} " + "lorem ipsum " * 10,
+                "author_id": author_id,
+                "conversation_id": tweet_id,
+                "created_at": "2022-10-01T12:00:00.000Z",
+                "lang": "en",
+                "possibly_sensitive": False,
+                "source": "Twitter Web App",
+                "edit_history_tweet_ids": [tweet_id],
+            }
+            users[author_id] = {"id": author_id, "name": "User", "username": "u"}
+
+            rng = random.Random(self.seed * 1000003 + i)
+            if rng.random() < self.media_density:
+                keys = []
+                for j in range(self.media_per_tweet):
+                    if rng.random() < self.video_fraction:
+                        item = _video(f"7_{i}_{j}")
+                    else:
+                        item = _photo(f"3_{i}_{j}")
+                    media.append(item)
+                    keys.append(item["media_key"])
+                tweet["attachments"] = {"media_keys": keys}
+            data.append(tweet)
+
+        resp = {"meta": {"result_count": len(data)}}
+        if data:
+            resp["data"] = data
+            resp["includes"] = {"users": list(users.values())}
+            if media:
+                resp["includes"]["media"] = media
+        if end < self.count:
+            resp["meta"]["next_token"] = str(end)
+        return resp
+
+    def __enter__(self) -> "BookmarksAPIServer":
+        """Start serving on a background thread."""
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+
+
+def _photo(media_key: str) -> dict:
+    return {
+        "media_key": media_key,
+        "type": "photo",
+        "url": f"https://pbs.twimg.com/media/{media_key}.jpg",
+        "width": 1200,
+        "height": 900,
+    }
+
+
+def _video(media_key: str) -> dict:
+    url = f"https://video.twimg.com/ext_tw_video/{media_key}"
+    return {
+        "media_key": media_key,
+        "type": "video",
+        "duration_ms": 30000,
+        "width": 1280,
+        "height": 720,
+        "variants": [
+            {"content_type": "application/x-mpegURL", "url": f"{url}/pl.m3u8"},
+            {"bit_rate": 256000, "content_type": "video/mp4", "url": f"{url}/1.mp4"},
+            {"bit_rate": 832000, "content_type": "video/mp4", "url": f"{url}/2.mp4"},
+            {"bit_rate": 2176000, "content_type": "video/mp4", "url": f"{url}/3.mp4"},
+        ],
+    }
+
+
+class _Redirect(HTTPAdapter):
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        request.url = self.base_url + request.url[len(_API) :]
+        return super().send(request, **kwargs)
+
+
+def redirect_client(client: tweepy.Client, base_url: str) -> tweepy.Client:
+    """Send every API request of a client to a local server instead.
+
+    :param client: Client to redirect.
+    :param base_url: Base URL of the server, i.e. BookmarksAPIServer.url.
+    :returns: The client.
+    """
+    client.session.mount(_API, _Redirect(base_url))
+    return client
@@ -0,0 +1,79 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from TwitterArchive.accounts import Account, load_accounts
+
+
+class LoadAccountsTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.path = self.tmp / "accounts.json"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_load(self):
+        entries = [
+            {
+                "name": "alice",
+                "token_cache": "alice/token.json",
+                "media_output": "alice/media",
+                "manifest_output": "alice/manifest.jsonl",
+                "download_index": "/abs/index.sqlite3",
+            },
+            {"token_cache": "bob/token.json", "media_output": "bob/media"},
+        ]
+        self.path.write_text(json.dumps(entries))
+        alice, bob = load_accounts(self.path)
+
+        self.assertEqual(alice.name, "alice")
+        self.assertEqual(alice.token_cache, self.tmp / "alice" / "token.json")
+        self.assertEqual(alice.media_output, self.tmp / "alice" / "media")
+        self.assertEqual(alice.manifest_output, self.tmp / "alice" / "manifest.jsonl")
+        self.assertEqual(alice.download_index, Path("/abs/index.sqlite3"))
+
+        self.assertEqual(
+            bob.manifest_output, self.tmp / "bob" / "bookmark-manifest.jsonl"
+        )
+        self.assertIsNone(bob.download_index)
+
+    def test_missing_keys_raises(self):
+        self.path.write_text(json.dumps([{"token_cache": "token.json"}]))
+        self.assertRaises(ValueError, load_accounts, self.path)
+
+    def test_not_list_raises(self):
+        self.path.write_text(json.dumps({"token_cache": "token.json"}))
+        self.assertRaises(ValueError, load_accounts, self.path)
+
+
+class AccountTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_new_index_filled(self):
+        dest = self.tmp / "media" / "1" / "a.jpg"
+        dest.parent.mkdir(parents=True)
+        dest.write_bytes(b"foo")
+        index_path = self.tmp / "index.sqlite3"
+        account = Account(self.tmp / "token.json", self.tmp / "media", None, index_path)
+
+        account.open()
+        try:
+            self.assertTrue(account.index.is_complete(dest))
+        finally:
+            account.close()
+
+        # An existing index is left as it is.
+        (self.tmp / "media" / "1" / "b.jpg").write_bytes(b"bar")
+        account.open()
+        try:
+            self.assertFalse(account.index.is_complete(dest.with_name("b.jpg")))
+        finally:
+            account.close()
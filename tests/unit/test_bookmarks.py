@@ -0,0 +1,323 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+import tweepy
+
+from TwitterArchive.core import get_bookmarks
+from TwitterArchive.manifest import checkpoint_path, read_checkpoint, read_manifest
+from TwitterArchive.metrics import Metrics
+
+
+class MockClient:
+    """Serve pre-built pages of bookmarks, recording each request."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = 0
+
+    def get_bookmarks(self, pagination_token=None, **kwargs):
+        index = 0 if pagination_token is None else int(pagination_token)
+        self.calls += 1
+
+        data = [
+            tweepy.Tweet({"id": str(i), "text": f"tweet {i}"})
+            for i in self.pages[index]
+        ]
+        meta = {"result_count": len(data)}
+        if index + 1 < len(self.pages):
+            meta["next_token"] = str(index + 1)
+
+        return tweepy.Response(data, {}, [], meta)
+
+
+class RateLimitedClient(MockClient):
+    """Reject the first request with a 429."""
+
+    def get_bookmarks(self, pagination_token=None, **kwargs):
+        if self.calls == 0:
+            self.calls += 1
+            response = requests.Response()
+            response.status_code = 429
+            response.headers["x-rate-limit-reset"] = str(int(time.time()) + 5)
+            response._content = b"{}"
+            raise tweepy.TooManyRequests(response)
+        return super().get_bookmarks(pagination_token, **kwargs)
+
+
+class FailingClient(MockClient):
+    """Fail with a network error when requesting a page."""
+
+    def __init__(self, pages, fail_at):
+        super().__init__(pages)
+        self.fail_at = fail_at
+
+    def get_bookmarks(self, pagination_token=None, **kwargs):
+        if pagination_token == str(self.fail_at):
+            raise requests.ConnectionError("Connection reset")
+        return super().get_bookmarks(pagination_token, **kwargs)
+
+
+class QuotingClient(MockClient):
+    """Every bookmarked tweet quotes tweet 1000 + its ID, which has a photo.
+
+    Quoted tweets from 2000 on are deleted.
+    """
+
+    def __init__(self, pages):
+        super().__init__(pages)
+        self.lookups = []
+
+    def get_bookmarks(self, pagination_token=None, **kwargs):
+        resp = super().get_bookmarks(pagination_token, **kwargs)
+        data = [
+            tweepy.Tweet(
+                dict(
+                    i.data,
+                    referenced_tweets=[{"type": "quoted", "id": str(1000 + i.id)}],
+                )
+            )
+            for i in resp.data
+        ]
+        return tweepy.Response(data, {}, [], resp.meta)
+
+    def get_tweets(self, ids, **kwargs):
+        self.lookups.append(ids)
+        ids = [int(i) for i in ids if int(i) < 2000]
+        data = [
+            tweepy.Tweet(
+                {"id": str(i), "text": "", "attachments": {"media_keys": [f"3_{i}"]}}
+            )
+            for i in ids
+        ]
+        media = [tweepy.Media({"media_key": f"3_{i}", "type": "photo"}) for i in ids]
+        return tweepy.Response(data, {"media": media}, [], {})
+
+
+class GetBookmarksTestCase(unittest.TestCase):
+    def test_all_pages(self):
+        client = MockClient([[5, 4], [3, 2], [1]])
+        tweets = list(get_bookmarks(client))
+
+        self.assertEqual(client.calls, 3)
+        self.assertEqual([i["id"] for i in tweets], [5, 4, 3, 2, 1])
+
+    def test_lazy_paging(self):
+        client = MockClient([[5, 4], [3, 2], [1]])
+        tweets = get_bookmarks(client)
+
+        self.assertEqual(next(tweets)["id"], 5)
+        self.assertEqual(client.calls, 1)
+
+    def test_incremental_stops_at_known(self):
+        client = MockClient([[7, 6], [5, 4], [3, 2], [1]])
+        tweets = list(get_bookmarks(client, known_ids={5, 4, 3, 2, 1}))
+
+        self.assertEqual(client.calls, 2)
+        self.assertEqual([i["id"] for i in tweets], [7, 6])
+
+    def test_manifest_flushed_per_page(self):
+        client = MockClient([[5, 4], [3, 2], [1]])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "manifest.jsonl"
+            tweets = get_bookmarks(client, save_path=path)
+            next(tweets)
+            saved = [i["id"] for i in read_manifest(path)]
+            tweets.close()
+
+        self.assertEqual(saved, [5, 4])
+
+    def test_incremental_appends_to_manifest(self):
+        client = MockClient([[3, 2]])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "manifest.jsonl"
+            path.write_text(
+                '{"id": 2, "text": "tweet 2"}\n{"id": 1, "text": "tweet 1"}\n'
+            )
+            list(get_bookmarks(client, save_path=path, incremental=True))
+            saved = [i["id"] for i in read_manifest(path)]
+
+        self.assertEqual(saved, [2, 1, 3])
+
+    def test_metrics(self):
+        client = MockClient([[5, 4], [3, 2], [1]])
+        metrics = Metrics()
+        list(get_bookmarks(client, metrics=metrics))
+
+        counters = {i["name"]: i["value"] for i in metrics.snapshot()["counters"]}
+        self.assertEqual(counters, {"api_pages_total": 3, "api_tweets_total": 5})
+
+    @mock.patch("time.sleep")
+    def test_rate_limit_waited_out(self, sleep):
+        client = RateLimitedClient([[5, 4], [3]])
+        metrics = Metrics()
+        tweets = list(get_bookmarks(client, metrics=metrics))
+
+        self.assertEqual([i["id"] for i in tweets], [5, 4, 3])
+        sleep.assert_called_once()
+        self.assertGreater(sleep.call_args[0][0], 0)
+        counters = {i["name"]: i["value"] for i in metrics.snapshot()["counters"]}
+        self.assertEqual(counters["api_rate_limited_total"], 1)
+
+
+class CheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self._tmp.name) / "manifest.jsonl"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _interrupt(self, pages, fail_at):
+        tweets = []
+        with self.assertRaises(requests.ConnectionError):
+            for tweet in get_bookmarks(FailingClient(pages, fail_at), self.path):
+                tweets.append(tweet["id"])
+        return tweets
+
+    def test_resume(self):
+        pages = [[7, 6], [5, 4], [3, 2], [1]]
+        self.assertEqual(self._interrupt(pages, 2), [7, 6, 5, 4])
+        checkpoint = read_checkpoint(self.path)
+        self.assertEqual(checkpoint["pagination_token"], "2")
+        self.assertEqual(checkpoint["tweets"], 4)
+
+        client = MockClient(pages)
+        tweets = list(get_bookmarks(client, self.path))
+
+        self.assertEqual(client.calls, 2)
+        self.assertEqual([i["id"] for i in tweets], [3, 2, 1])
+        saved = [i["id"] for i in read_manifest(self.path)]
+        self.assertEqual(saved, [7, 6, 5, 4, 3, 2, 1])
+        self.assertFalse(checkpoint_path(self.path).exists())
+
+    def test_resume_drops_unchecked_writes(self):
+        pages = [[7, 6], [5, 4], [3, 2], [1]]
+        self._interrupt(pages, 2)
+        # A crash part way through writing the next page.
+        with open(self.path, "a") as fp:
+            fp.write('{"id": 3, "text": "tweet 3"}\n{"id": 2, "te')
+
+        list(get_bookmarks(MockClient(pages), self.path))
+
+        saved = [i["id"] for i in read_manifest(self.path)]
+        self.assertEqual(saved, [7, 6, 5, 4, 3, 2, 1])
+
+    def test_no_resume(self):
+        pages = [[7, 6], [5, 4], [3, 2], [1]]
+        self._interrupt(pages, 2)
+
+        tweets = list(get_bookmarks(MockClient(pages), self.path, resume=False))
+
+        self.assertEqual(len(tweets), 7)
+        self.assertEqual(len(list(read_manifest(self.path))), 7)
+        self.assertFalse(checkpoint_path(self.path).exists())
+
+    def test_no_checkpoint_when_complete(self):
+        list(get_bookmarks(MockClient([[2], [1]]), self.path))
+
+        self.assertFalse(checkpoint_path(self.path).exists())
+
+    def test_closed_after_last_page(self):
+        pages = [[9, 8], [7, 6], [5, 4]]
+        tweets = get_bookmarks(MockClient(pages), self.path)
+        self.assertEqual([next(tweets)["id"] for _ in range(6)], [9, 8, 7, 6, 5, 4])
+        # Stopped by the caller before the generator is exhausted.
+        tweets.close()
+        self.assertFalse(checkpoint_path(self.path).exists())
+
+        client = MockClient(pages)
+        tweets = list(get_bookmarks(client, self.path, incremental=True))
+
+        self.assertEqual(tweets, [])
+        self.assertEqual(client.calls, 1)
+        saved = [i["id"] for i in read_manifest(self.path)]
+        self.assertEqual(saved, [9, 8, 7, 6, 5, 4])
+
+    def test_incremental_after_resume(self):
+        pages = [[7, 6], [5, 4], [3, 2], [1]]
+        self._interrupt(pages, 2)
+        # Written after the checkpoint, so neither saved nor known.
+        with open(self.path, "a") as fp:
+            fp.write('{"id": 3, "text": "tweet 3"}\n{"id": 2, "text": "tweet 2"}\n')
+
+        tweets = list(get_bookmarks(MockClient(pages), self.path, incremental=True))
+
+        self.assertEqual([i["id"] for i in tweets], [3, 2, 1])
+        saved = [i["id"] for i in read_manifest(self.path)]
+        self.assertEqual(saved, [7, 6, 5, 4, 3, 2, 1])
+
+
+class HydrateTestCase(unittest.TestCase):
+    def test_referenced_media_attached(self):
+        client = QuotingClient([[5, 4], [3]])
+        tweets = list(get_bookmarks(client))
+
+        self.assertEqual(client.lookups, [["1004", "1005"], ["1003"]])
+        for tweet in tweets:
+            keys = [i["media_key"] for i in tweet["media"]]
+            self.assertEqual(keys, [f"3_{1000 + tweet['id']}"])
+
+    def test_hydrated_per_page(self):
+        pages = [list(range(60 * i, 60 * i + 60)) for i in range(3)]
+        client = QuotingClient(pages)
+        tweets = get_bookmarks(client)
+
+        next(tweets)
+        self.assertEqual(client.calls, 1)
+        self.assertEqual([len(i) for i in client.lookups], [60])
+
+        self.assertEqual(len(list(tweets)), 179)
+        self.assertEqual([len(i) for i in client.lookups], [60, 60, 60])
+
+    def test_sparse_quotes_not_held_back(self):
+        client = QuotingClient([[i] for i in range(50, 0, -1)])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "manifest.jsonl"
+            tweets = get_bookmarks(client, save_path=path)
+
+            self.assertEqual(next(tweets)["id"], 50)
+            self.assertEqual(client.calls, 1)
+            self.assertEqual(read_checkpoint(path)["tweets"], 1)
+            tweets.close()
+
+    def test_deduplicated(self):
+        client = QuotingClient([[5, 4]])
+        client.pages = [[5, 5, 4]]
+        list(get_bookmarks(client))
+
+        self.assertEqual(client.lookups, [["1004", "1005"]])
+
+    def test_deleted(self):
+        client = QuotingClient([[1005, 5]])
+        tweets = list(get_bookmarks(client))
+
+        self.assertNotIn("media", tweets[0])
+        self.assertEqual(len(tweets[1]["media"]), 1)
+
+    def test_disabled(self):
+        client = QuotingClient([[5, 4]])
+        tweets = list(get_bookmarks(client, hydrate=False))
+
+        self.assertEqual(client.lookups, [])
+        self.assertNotIn("media", tweets[0])
+
+    def test_failed_lookup_not_checkpointed(self):
+        client = QuotingClient([[5, 4], [3], [2]])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "manifest.jsonl"
+            tweets = get_bookmarks(client, save_path=path)
+            with mock.patch.object(
+                client, "get_tweets", side_effect=requests.ConnectionError
+            ):
+                self.assertRaises(requests.ConnectionError, next, tweets)
+
+            self.assertIsNone(read_checkpoint(path))
+            self.assertEqual(list(read_manifest(path)), [])
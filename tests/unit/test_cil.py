@@ -1,6 +1,8 @@
 import argparse
 import contextlib
 import io
+import subprocess
+import sys
 import unittest
 from pathlib import Path
 
@@ -10,16 +12,40 @@ from TwitterArchive.cli import build_parser
 
 def _default_expected_args():
     return {
+        "accounts": None,
+        "adaptive": False,
+        "byte_budget": None,
         "client_id": None,
         "client_secret": None,
+        "download_index": None,
+        "dry_run": False,
+        "engine": "threads",
         "headless": False,
+        "incremental": False,
+        "layout": "flat",
         "manifest_input": None,
-        "manifest_output": Path("bookmark-manifest.json"),
+        "manifest_output": Path("bookmark-manifest.jsonl"),
         "media_output": Path("media"),
+        "max_bandwidth": None,
+        "max_bitrate": None,
+        "max_resolution": None,
+        "media_store": None,
+        "merge_shards": None,
+        "metrics_format": "json",
+        "metrics_interval": None,
+        "metrics_output": None,
+        "migrate_layout": False,
         "no_clobber": False,
+        "no_referenced_media": False,
+        "photo_size": None,
+        "progress_per_file": False,
         "quiet": False,
+        "reindex": False,
+        "shard": None,
+        "retries": 4,
         "num_download_threads": 8,
         "verbose": 0,
+        "verify": False,
     }
 
 
@@ -32,6 +58,36 @@ class CLITestCase(unittest.TestCase):
         args = vars(args)
         self.assertDictEqual(args, _default_expected_args())
 
+    def test_accounts(self):
+        parser = build_parser(False)
+
+        argv = ["--accounts", "accounts.json"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["accounts"] = Path("accounts.json")
+
+        self.assertDictEqual(args, expected)
+
+    def test_accounts_manifest_input_exclusive(self):
+        parser = build_parser(False)
+
+        argv = ["--accounts", "accounts.json", "-i", "manifest.jsonl"]
+        self.assertRaises(argparse.ArgumentError, parser.parse_args, argv)
+
+    def test_adaptive(self):
+        parser = build_parser(False)
+
+        argv = ["--adaptive"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["adaptive"] = True
+
+        self.assertDictEqual(args, expected)
+
     def test_client_id(self):
         parser = build_parser(False)
 
@@ -56,6 +112,123 @@ class CLITestCase(unittest.TestCase):
 
         self.assertDictEqual(args, expected)
 
+    def test_download_index(self):
+        parser = build_parser(False)
+
+        argv = ["--download-index", "foobar", "--reindex"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["download_index"] = Path("foobar")
+        expected["reindex"] = True
+
+        self.assertDictEqual(args, expected)
+
+    def test_max_bandwidth(self):
+        parser = build_parser(False)
+
+        argv = ["--max-bandwidth", "512K"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["max_bandwidth"] = 512 * 1024
+
+        self.assertDictEqual(args, expected)
+
+    def test_variants(self):
+        parser = build_parser(False)
+
+        argv = ["--max-bitrate", "2176000", "--max-resolution", "720"]
+        argv += ["--byte-budget", "1.5G", "--photo-size", "medium", "--dry-run"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["max_bitrate"] = 2176000
+        expected["max_resolution"] = 720
+        expected["byte_budget"] = 3 * 512 * 1024**2
+        expected["photo_size"] = "medium"
+        expected["dry_run"] = True
+
+        self.assertDictEqual(args, expected)
+
+    def test_byte_budget_invalid(self):
+        parser = build_parser(False)
+
+        for budget in ("0", "-5M", "lots"):
+            argv = ["--byte-budget", budget]
+            self.assertRaises(argparse.ArgumentError, parser.parse_args, argv)
+
+    def test_layout(self):
+        parser = build_parser(False)
+
+        argv = ["--layout", "hash", "--migrate-layout"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["layout"] = "hash"
+        expected["migrate_layout"] = True
+
+        self.assertDictEqual(args, expected)
+
+        argv = ["--layout", "nested"]
+        self.assertRaises(argparse.ArgumentError, parser.parse_args, argv)
+
+    def test_shard(self):
+        parser = build_parser(False)
+
+        argv = ["-i", "manifest.jsonl", "--shard", "2/4", "--verify"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["manifest_input"] = Path("manifest.jsonl")
+        expected["shard"] = (1, 4)
+        expected["verify"] = True
+
+        self.assertDictEqual(args, expected)
+
+    def test_shard_invalid(self):
+        parser = build_parser(False)
+
+        for shard in ("0/4", "5/4", "2", "a/b"):
+            argv = ["--shard", shard]
+            self.assertRaises(argparse.ArgumentError, parser.parse_args, argv)
+
+    def test_merge_shards(self):
+        parser = build_parser(False)
+
+        argv = ["-i", "manifest.jsonl", "--merge-shards", "node1", "node2"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["manifest_input"] = Path("manifest.jsonl")
+        expected["merge_shards"] = [Path("node1"), Path("node2")]
+
+        self.assertDictEqual(args, expected)
+
+    def test_engine(self):
+        parser = build_parser(False)
+
+        argv = ["--engine", "async"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["engine"] = "async"
+
+        self.assertDictEqual(args, expected)
+
+    def test_invalid_engine_raises(self):
+        parser = build_parser(False)
+
+        argv = ["--engine", "foobar"]
+        self.assertRaises(argparse.ArgumentError, parser.parse_args, argv)
+
     def test_headless(self):
         parser = build_parser(False)
 
@@ -68,6 +241,18 @@ class CLITestCase(unittest.TestCase):
 
         self.assertDictEqual(args, expected)
 
+    def test_incremental(self):
+        parser = build_parser(False)
+
+        argv = ["--incremental"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["incremental"] = True
+
+        self.assertDictEqual(args, expected)
+
     def test_no_clobber(self):
         parser = build_parser(False)
 
@@ -98,6 +283,57 @@ class CLITestCase(unittest.TestCase):
         argv = ["--num-download-threads", "-1"]
         self.assertRaises(argparse.ArgumentError, parser.parse_args, argv)
 
+    def test_retries(self):
+        parser = build_parser(False)
+
+        argv = ["--retries", "0"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["retries"] = 0
+
+        self.assertDictEqual(args, expected)
+
+    def test_invalid_retries_raises(self):
+        parser = build_parser(False)
+
+        argv = ["--retries", "-1"]
+        self.assertRaises(argparse.ArgumentError, parser.parse_args, argv)
+
+    def test_metrics(self):
+        parser = build_parser(False)
+
+        argv = ["--metrics-output", "metrics.prom", "--metrics-format", "prometheus"]
+        argv += ["--metrics-interval", "15"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["metrics_output"] = Path("metrics.prom")
+        expected["metrics_format"] = "prometheus"
+        expected["metrics_interval"] = 15.0
+
+        self.assertDictEqual(args, expected)
+
+    def test_invalid_metrics_interval_raises(self):
+        parser = build_parser(False)
+
+        argv = ["--metrics-interval", "0"]
+        self.assertRaises(argparse.ArgumentError, parser.parse_args, argv)
+
+    def test_progress_per_file(self):
+        parser = build_parser(False)
+
+        argv = ["--progress-per-file"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["progress_per_file"] = True
+
+        self.assertDictEqual(args, expected)
+
     def test_quiet(self):
         parser = build_parser(False)
 
@@ -134,6 +370,18 @@ class CLITestCase(unittest.TestCase):
 
         self.assertDictEqual(args, expected)
 
+    def test_media_store(self):
+        parser = build_parser(False)
+
+        argv = ["--media-store", "foobar"]
+        args = parser.parse_args(argv)
+        args = vars(args)
+
+        expected = _default_expected_args()
+        expected["media_store"] = Path("foobar")
+
+        self.assertDictEqual(args, expected)
+
     def test_manifest_output_short(self):
         parser = build_parser(False)
 
@@ -279,3 +527,9 @@ class CLITestCase(unittest.TestCase):
                 parser.parse_args(argv)
 
         self.assertIn("help", stdout.getvalue())
+
+    def test_lazy_imports(self):
+        # The API client is only imported when talking to the API.
+        code = "import sys, TwitterArchive.cli; print('tweepy' in sys.modules)"
+        out = subprocess.check_output([sys.executable, "-c", code], text=True)
+        self.assertEqual(out.strip(), "False")
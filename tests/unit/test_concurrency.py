@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+import unittest
+
+import requests
+
+from TwitterArchive.concurrency import AdaptiveLimit
+
+
+class AdaptiveLimitTestCase(unittest.TestCase):
+    def _transfer(self, limit, nbytes=1024, error=False):
+        with limit.slot() as transfer:
+            transfer.nbytes = nbytes
+            transfer.error = error
+
+    def test_additive_increase(self):
+        limit = AdaptiveLimit(8, initial=2, window=0)
+        # Each step needs a full window of `limit` transfers.
+        for _ in range(50):
+            self._transfer(limit)
+
+        self.assertEqual(limit.limit, 8)
+
+    def test_multiplicative_decrease(self):
+        limit = AdaptiveLimit(8, initial=8, window=0)
+        self._transfer(limit, error=True)
+        self.assertEqual(limit.limit, 4)
+
+        with self.assertRaises(ConnectionError):
+            with limit.slot():
+                raise ConnectionError()
+        self.assertEqual(limit.limit, 2)
+
+    def test_other_errors_not_congestion(self):
+        response = requests.Response()
+        response.status_code = 404
+        limit = AdaptiveLimit(8, initial=8, window=0)
+        with self.assertRaises(requests.HTTPError):
+            with limit.slot():
+                raise requests.HTTPError(response=response)
+        self.assertEqual(limit.limit, 8)
+
+        response.status_code = 429
+        with self.assertRaises(requests.HTTPError):
+            with limit.slot():
+                raise requests.HTTPError(response=response)
+        self.assertEqual(limit.limit, 4)
+
+    def test_decrease_once_per_window(self):
+        limit = AdaptiveLimit(8, initial=8, window=60)
+        for _ in range(3):
+            self._transfer(limit, error=True)
+
+        self.assertEqual(limit.limit, 4)
+
+    def test_minimum(self):
+        limit = AdaptiveLimit(8, minimum=2, initial=2, window=0)
+        self._transfer(limit, error=True)
+
+        self.assertEqual(limit.limit, 2)
+
+    def test_bounds_in_flight(self):
+        limit = AdaptiveLimit(8, initial=3, window=60)
+        in_flight = []
+        lock = threading.Lock()
+        peak = [0]
+
+        def work():
+            with limit.slot():
+                with lock:
+                    in_flight.append(1)
+                    peak[0] = max(peak[0], len(in_flight))
+                time.sleep(0.01)
+                with lock:
+                    in_flight.pop()
+
+        threads = [threading.Thread(target=work) for _ in range(12)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(peak[0], 3)
+
+    def test_async_slot(self):
+        limit = AdaptiveLimit(8, initial=2, window=60)
+        peak = 0
+        in_flight = 0
+
+        async def work():
+            nonlocal peak, in_flight
+            async with limit.async_slot():
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        async def main():
+            await asyncio.gather(*(work() for _ in range(10)))
+
+        asyncio.run(main())
+        self.assertEqual(peak, 2)
+
+    def test_async_slot_across_loops(self):
+        limit = AdaptiveLimit(8, initial=2, window=60)
+
+        async def work():
+            async with limit.async_slot():
+                await asyncio.sleep(0.01)
+
+        async def main():
+            await asyncio.gather(*(work() for _ in range(4)))
+
+        # Like the retry pass at the end of a run, on a new event loop.
+        asyncio.run(main())
+        asyncio.run(main())
+        self.assertEqual(limit._in_flight, 0)
@@ -0,0 +1,454 @@
+import http.server
+import importlib.util
+import json
+import re
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import tweepy
+
+from TwitterArchive.cli import main
+from TwitterArchive.core import download_tweet
+from TwitterArchive.index import DownloadIndex
+from TwitterArchive.manifest import ManifestWriter
+from TwitterArchive.metrics import Metrics
+from TwitterArchive.net import CircuitBreaker, RetryPolicy, new_session
+from TwitterArchive.progress import Progress
+from TwitterArchive.store import MediaStore
+from TwitterArchive.throttle import TokenBucket
+from TwitterArchive.variants import VariantPolicy
+
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    """Serve deterministic bytes for any path, with keep-alive and ranges.
+
+    Paths containing 'norange' ignore Range requests, paths containing 'short'
+    close the connection half way through the body, paths containing 'stall'
+    stop sending half way through the body the first time, paths containing
+    'flaky' fail with 503 the first time and paths containing 'missing' are 404.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        first = self.path not in self.server.paths
+        self.server.paths.append(self.path)
+        if "missing" in self.path or ("flaky" in self.path and first):
+            self.send_response(404 if "missing" in self.path else 503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.path.encode() * 100
+        start = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match is not None and "norange" not in self.path:
+            start = int(match.group(1))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        else:
+            self.send_response(200)
+        if "norange" not in self.path:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+
+        if "short" in self.path:
+            self.wfile.write(body[start : len(body) // 2])
+            self.close_connection = True
+        elif "stall" in self.path and first:
+            self.wfile.write(body[start : len(body) // 2])
+            self.wfile.flush()
+            time.sleep(1)
+            self.close_connection = True
+        else:
+            self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class MediaServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+        self.server.paths = []
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        )
+        self.thread.start()
+        host, port = self.server.server_address
+        self.url = f"http://{host}:{port}"
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._tmp.cleanup()
+
+    def _tweet(self, id_, names):
+        media = [
+            {"type": "photo", "url": f"{self.url}/{name}", "media_key": f"3_{name}"}
+            for name in names
+        ]
+        return {"id": id_, "media": media}
+
+
+class DownloadTestCase(MediaServerTestCase):
+    def test_download(self):
+        download_tweet(self._tweet(1, ["a.jpg", "b.jpg"]), self.tmp)
+
+        self.assertEqual((self.tmp / "1" / "a.jpg").read_bytes(), b"/a.jpg" * 100)
+        self.assertEqual((self.tmp / "1" / "b.jpg").read_bytes(), b"/b.jpg" * 100)
+
+    def test_small_chunks(self):
+        download_tweet(self._tweet(1, ["a.jpg"]), self.tmp, chunk_size=7)
+
+        self.assertEqual((self.tmp / "1" / "a.jpg").read_bytes(), b"/a.jpg" * 100)
+
+    def test_metrics(self):
+        metrics = Metrics()
+        tweet = self._tweet(1, ["a.jpg", "missing.jpg"])
+        download_tweet(tweet, self.tmp, metrics=metrics)
+        download_tweet(tweet, self.tmp, clobber=False, metrics=metrics)
+
+        counters = {
+            (i["name"], tuple(i["labels"].items())): i["value"]
+            for i in metrics.snapshot()["counters"]
+        }
+        expected = {
+            ("media_transfers_total", (("result", "complete"),)): 1,
+            ("media_transfers_total", (("result", "error"),)): 2,
+            ("media_bytes_total", ()): 600,
+            ("media_skipped_total", ()): 1,
+        }
+        self.assertEqual(counters, expected)
+
+    def test_photo_size(self):
+        policy = VariantPolicy(photo_size="small")
+        download_tweet(self._tweet(1, ["a.jpg"]), self.tmp, policy=policy)
+
+        self.assertEqual(self.server.paths, ["/a.jpg?name=small"])
+        expected = b"/a.jpg?name=small" * 100
+        self.assertEqual((self.tmp / "1" / "a.jpg").read_bytes(), expected)
+
+    def test_layout(self):
+        download_tweet(self._tweet(1, ["a.jpg"]), self.tmp, layout="hash")
+
+        dest = self.tmp / "c4" / "ca" / "1" / "a.jpg"
+        self.assertEqual(dest.read_bytes(), b"/a.jpg" * 100)
+
+    def test_progress(self):
+        progress = Progress(disable=True)
+        tweet = self._tweet(1, ["a.jpg", "missing.jpg"])
+        download_tweet(tweet, self.tmp, progress=progress)
+        download_tweet(tweet, self.tmp, clobber=False, progress=progress)
+
+        self.assertEqual(progress.files_found, 4)
+        self.assertEqual(progress.files_done, 4)
+        self.assertEqual(progress.nbytes, 600)
+
+    def test_throttle(self):
+        throttle = TokenBucket(1024**2)
+        with mock.patch.object(throttle, "consume") as consume:
+            download_tweet(self._tweet(1, ["a.jpg"]), self.tmp, throttle=throttle)
+
+        self.assertEqual(sum(c.args[0] for c in consume.call_args_list), 600)
+        self.assertEqual((self.tmp / "1" / "a.jpg").read_bytes(), b"/a.jpg" * 100)
+
+    def test_no_clobber(self):
+        (self.tmp / "1").mkdir()
+        (self.tmp / "1" / "a.jpg").write_bytes(b"foo")
+        download_tweet(self._tweet(1, ["a.jpg"]), self.tmp, clobber=False)
+
+        self.assertEqual((self.tmp / "1" / "a.jpg").read_bytes(), b"foo")
+
+    def test_resume_part(self):
+        (self.tmp / "1").mkdir()
+        (self.tmp / "1" / "a.jpg.part").write_bytes(b"/a.jpg" * 40)
+        download_tweet(self._tweet(1, ["a.jpg"]), self.tmp)
+
+        self.assertEqual((self.tmp / "1" / "a.jpg").read_bytes(), b"/a.jpg" * 100)
+        self.assertFalse((self.tmp / "1" / "a.jpg.part").exists())
+
+    def test_resume_unsupported(self):
+        (self.tmp / "1").mkdir()
+        (self.tmp / "1" / "norange.jpg.part").write_bytes(b"garbage")
+        download_tweet(self._tweet(1, ["norange.jpg"]), self.tmp)
+
+        expected = b"/norange.jpg" * 100
+        self.assertEqual((self.tmp / "1" / "norange.jpg").read_bytes(), expected)
+
+    @mock.patch("TwitterArchive.fileio.preallocate")
+    def test_preallocated_unless_resumable(self, preallocate):
+        download_tweet(self._tweet(1, ["a.jpg", "norange.jpg"]), self.tmp)
+
+        preallocate.assert_called_once()
+        self.assertEqual(preallocate.call_args[0][1], len(b"/norange.jpg" * 100))
+
+    def test_incomplete_kept_as_part(self):
+        download_tweet(self._tweet(1, ["short.jpg"]), self.tmp, clobber=False)
+
+        self.assertFalse((self.tmp / "1" / "short.jpg").exists())
+        self.assertTrue((self.tmp / "1" / "short.jpg.part").exists())
+
+    @mock.patch("TwitterArchive.core.DEFAULT_TIMEOUT", (10.0, 0.2))
+    def test_retry_stalled_body(self):
+        retry = RetryPolicy(backoff=0)
+        download_tweet(self._tweet(1, ["stall.jpg"]), self.tmp, retry=retry)
+
+        expected = b"/stall.jpg" * 100
+        self.assertEqual((self.tmp / "1" / "stall.jpg").read_bytes(), expected)
+        self.assertEqual(self.server.paths, ["/stall.jpg", "/stall.jpg"])
+        self.assertEqual(retry.drain(), [])
+
+    def test_retry_transient_error(self):
+        retry = RetryPolicy(backoff=0)
+        download_tweet(self._tweet(1, ["flaky.jpg"]), self.tmp, retry=retry)
+
+        self.assertEqual(
+            (self.tmp / "1" / "flaky.jpg").read_bytes(), b"/flaky.jpg" * 100
+        )
+        self.assertEqual(self.server.paths, ["/flaky.jpg", "/flaky.jpg"])
+        self.assertEqual(retry.drain(), [])
+
+    def test_error_page_not_saved(self):
+        retry = RetryPolicy(backoff=0)
+        download_tweet(self._tweet(1, ["missing.jpg", "a.jpg"]), self.tmp, retry=retry)
+
+        self.assertFalse((self.tmp / "1" / "missing.jpg").exists())
+        self.assertFalse((self.tmp / "1" / "missing.jpg.part").exists())
+        self.assertTrue((self.tmp / "1" / "a.jpg").exists())
+        # Not worth retrying.
+        self.assertEqual(self.server.paths.count("/missing.jpg"), 1)
+        self.assertEqual(retry.drain(), [])
+
+    def test_incomplete_deferred(self):
+        retry = RetryPolicy(attempts=2, backoff=0)
+        tweet = self._tweet(1, ["short.jpg"])
+        download_tweet(tweet, self.tmp, retry=retry)
+
+        self.assertEqual(self.server.paths, ["/short.jpg", "/short.jpg"])
+        self.assertEqual(retry.drain(), [tweet])
+
+    def test_open_circuit_deferred(self):
+        breaker = CircuitBreaker(threshold=1)
+        retry = RetryPolicy(attempts=1, breaker=breaker)
+        tweet = self._tweet(1, ["short.jpg", "a.jpg"])
+        download_tweet(tweet, self.tmp, retry=retry)
+
+        # The host failed once, so the second file is not even requested.
+        self.assertEqual(self.server.paths, ["/short.jpg"])
+        self.assertEqual(retry.drain(), [tweet])
+
+    def test_index_skips_without_stat(self):
+        index = DownloadIndex(self.tmp / "index.sqlite3", self.tmp)
+        download_tweet(self._tweet(1, ["a.jpg"]), self.tmp, index=index)
+        self.assertTrue(index.is_complete(self.tmp / "1" / "a.jpg"))
+
+        # The index, not the filesystem, decides what is already downloaded.
+        (self.tmp / "1" / "a.jpg").unlink()
+        download_tweet(self._tweet(1, ["a.jpg"]), self.tmp, False, index=index)
+        self.assertEqual(self.server.paths, ["/a.jpg"])
+        index.close()
+
+    def test_no_media_no_directory(self):
+        download_tweet({"id": 1, "text": "foo"}, self.tmp)
+        self.assertFalse((self.tmp / "1").exists())
+
+    def test_failed_no_directory(self):
+        store = MediaStore(self.tmp / "store")
+        download_tweet(self._tweet(1, ["missing.jpg"]), self.tmp)
+        download_tweet(self._tweet(2, ["missing.jpg"]), self.tmp, store=store)
+
+        self.assertFalse((self.tmp / "1").exists())
+        self.assertFalse((self.tmp / "2").exists())
+
+    def test_store_deduplicates(self):
+        store = MediaStore(self.tmp / "store")
+        for i in range(3):
+            download_tweet(self._tweet(i, ["a.jpg"]), self.tmp, store=store)
+
+        self.assertEqual(self.server.paths, ["/a.jpg"])
+        for i in range(3):
+            dest = self.tmp / str(i) / "a.jpg"
+            self.assertEqual(dest.read_bytes(), b"/a.jpg" * 100)
+            self.assertTrue(dest.samefile(self.tmp / "0" / "a.jpg"))
+
+    def test_store_keyed_by_variant(self):
+        store = MediaStore(self.tmp / "store")
+        download_tweet(self._tweet(1, ["a.jpg"]), self.tmp, store=store)
+        policy = VariantPolicy(photo_size="small")
+        download_tweet(self._tweet(2, ["a.jpg"]), self.tmp, store=store, policy=policy)
+
+        self.assertEqual(self.server.paths, ["/a.jpg", "/a.jpg?name=small"])
+        self.assertEqual(
+            store.lookup("3_a.jpg-small", "a.jpg").name, "3_a.jpg-small.jpg"
+        )
+
+    def test_session_reuses_connection(self):
+        with new_session(1) as session:
+            for i in range(3):
+                download_tweet(
+                    self._tweet(i, ["a.jpg", "b.jpg"]), self.tmp, session=session
+                )
+            pool = session.get_adapter(self.url).poolmanager.connection_from_url(
+                self.url
+            )
+            self.assertEqual(pool.num_requests, 6)
+            self.assertEqual(pool.num_connections, 1)
+
+
+@unittest.skipUnless(importlib.util.find_spec("aiohttp"), "aiohttp not installed")
+class AsyncDownloadTestCase(MediaServerTestCase):
+    def test_pipeline(self):
+        from TwitterArchive.aio import run_async_pipeline
+
+        tweets = (self._tweet(i, ["a.jpg", "b.jpg"]) for i in range(20))
+        run_async_pipeline(tweets, 4, maxsize=2, base_dir=self.tmp)
+
+        for i in range(20):
+            self.assertEqual(
+                (self.tmp / str(i) / "b.jpg").read_bytes(), b"/b.jpg" * 100
+            )
+
+    def test_no_clobber(self):
+        from TwitterArchive.aio import run_async_pipeline
+
+        (self.tmp / "1").mkdir()
+        (self.tmp / "1" / "a.jpg").write_bytes(b"foo")
+        run_async_pipeline(
+            [self._tweet(1, ["a.jpg"])], 1, base_dir=self.tmp, clobber=False
+        )
+
+        self.assertEqual((self.tmp / "1" / "a.jpg").read_bytes(), b"foo")
+
+    def test_failed_no_directory(self):
+        from TwitterArchive.aio import run_async_pipeline
+
+        run_async_pipeline([self._tweet(1, ["missing.jpg"])], 1, base_dir=self.tmp)
+
+        self.assertFalse((self.tmp / "1").exists())
+
+    def test_resume_part(self):
+        from TwitterArchive.aio import run_async_pipeline
+
+        (self.tmp / "1").mkdir()
+        (self.tmp / "1" / "a.jpg.part").write_bytes(b"/a.jpg" * 40)
+        run_async_pipeline([self._tweet(1, ["a.jpg"])], 1, base_dir=self.tmp)
+
+        self.assertEqual((self.tmp / "1" / "a.jpg").read_bytes(), b"/a.jpg" * 100)
+        self.assertFalse((self.tmp / "1" / "a.jpg.part").exists())
+
+    def test_store_deduplicates(self):
+        from TwitterArchive.aio import run_async_pipeline
+
+        store = MediaStore(self.tmp / "store")
+        tweets = [self._tweet(i, ["a.jpg"]) for i in range(10)]
+        run_async_pipeline(tweets, 4, base_dir=self.tmp, store=store)
+
+        self.assertEqual(self.server.paths, ["/a.jpg"])
+        self.assertEqual((self.tmp / "9" / "a.jpg").read_bytes(), b"/a.jpg" * 100)
+
+    def test_error(self):
+        from TwitterArchive.aio import run_async_pipeline
+
+        with self.assertRaises(AttributeError):
+            run_async_pipeline([{"media": []}], 2, base_dir=self.tmp)
+
+
+class CLIDownloadTestCase(MediaServerTestCase):
+    def test_manifest_input_skips_auth(self):
+        manifest = self.tmp / "manifest.jsonl"
+        with ManifestWriter(manifest) as writer:
+            writer.write(self._tweet(1, ["a.jpg"]))
+
+        argv = ["twitter-archive", "--quiet", "-i", str(manifest)]
+        argv += ["-o", str(self.tmp / "media")]
+        with mock.patch("sys.argv", argv), mock.patch(
+            "TwitterArchive.core.auth", side_effect=AssertionError("Authenticated")
+        ):
+            main()
+
+        expected = b"/a.jpg" * 100
+        self.assertEqual((self.tmp / "media" / "1" / "a.jpg").read_bytes(), expected)
+
+    def test_dry_run(self):
+        manifest = self.tmp / "manifest.jsonl"
+        with ManifestWriter(manifest) as writer:
+            writer.write(self._tweet(1, ["a.jpg"]))
+
+        argv = ["twitter-archive", "--dry-run", "--photo-size", "medium"]
+        argv += ["-i", str(manifest), "-o", str(self.tmp / "media")]
+        with mock.patch("sys.argv", argv), mock.patch("builtins.print") as print_:
+            main()
+
+        self.assertEqual(self.server.paths, [])
+        self.assertFalse((self.tmp / "media" / "1").exists())
+        self.assertIn("Photos: 1", print_.call_args[0][0])
+
+    def test_shards_merged_and_verified(self):
+        manifest = self.tmp / "manifest.jsonl"
+        with ManifestWriter(manifest) as writer:
+            for i in range(10):
+                writer.write(self._tweet(i, [f"{i}.jpg"]))
+
+        for shard in ("1/2", "2/2"):
+            argv = ["twitter-archive", "--quiet", "-i", str(manifest)]
+            argv += ["-o", str(self.tmp / shard[0]), "--shard", shard]
+            with mock.patch("sys.argv", argv):
+                main()
+        self.assertEqual(len(self.server.paths), 10)
+
+        argv = ["twitter-archive", "-i", str(manifest), "--layout", "date"]
+        argv += ["-o", str(self.tmp / "media"), "--verify"]
+        with mock.patch("sys.argv", argv), mock.patch("builtins.print"):
+            self.assertRaises(SystemExit, main)
+            argv += ["--merge-shards", str(self.tmp / "1"), str(self.tmp / "2")]
+            main()
+
+        self.assertEqual(len(list(self.tmp.glob("media/*/*/*/*.jpg"))), 10)
+
+    def test_accounts_share_downloads(self):
+        media = tweepy.Media(
+            {"media_key": "3_a", "type": "photo", "url": f"{self.url}/a.jpg"}
+        )
+        tweet = tweepy.Tweet(
+            {"id": "1", "text": "foo", "attachments": {"media_keys": ["3_a"]}}
+        )
+        client = mock.Mock()
+        client.get_bookmarks.return_value = tweepy.Response(
+            [tweet], {"media": [media]}, [], {"result_count": 1}
+        )
+
+        accounts = [
+            {"token_cache": f"{name}/token.json", "media_output": f"{name}/media"}
+            for name in ("alice", "bob")
+        ]
+        (self.tmp / "accounts.json").write_text(json.dumps(accounts))
+
+        argv = [
+            "twitter-archive",
+            "--quiet",
+            "--accounts",
+            str(self.tmp / "accounts.json"),
+        ]
+        with mock.patch("sys.argv", argv), mock.patch(
+            "TwitterArchive.core.auth", return_value=client
+        ) as auth:
+            main()
+
+        self.assertEqual(auth.call_count, 2)
+        self.assertEqual(self.server.paths, ["/a.jpg"])
+        for name in ("alice", "bob"):
+            dest = self.tmp / name / "media" / "1" / "a.jpg"
+            self.assertEqual(dest.read_bytes(), b"/a.jpg" * 100)
+            manifest = self.tmp / name / "bookmark-manifest.jsonl"
+            self.assertEqual(len(manifest.read_text().splitlines()), 1)
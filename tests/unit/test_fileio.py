@@ -0,0 +1,70 @@
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from TwitterArchive.fileio import buffer, copy_stream, open_part
+
+
+class BufferTestCase(unittest.TestCase):
+    def test_reused(self):
+        a = buffer(16)
+        b = buffer(8)
+
+        self.assertEqual(len(a), 16)
+        self.assertEqual(len(b), 8)
+        self.assertIs(a.obj, b.obj)
+
+    def test_grows(self):
+        buffer(8)
+        self.assertEqual(len(buffer(32)), 32)
+
+
+class CopyStreamTestCase(unittest.TestCase):
+    def test_copy(self):
+        data = bytes(range(256)) * 10
+        dest = io.BytesIO()
+        progress = []
+
+        n = copy_stream(io.BytesIO(data), dest, 1000, progress.append)
+
+        self.assertEqual(n, len(data))
+        self.assertEqual(dest.getvalue(), data)
+        self.assertEqual(progress, [1000, 1000, 560])
+
+
+class OpenPartTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.part = Path(self._tmp.name) / "a.jpg.part"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_preallocated_then_truncated(self):
+        with open_part(self.part, 0, 1000, resumable=False) as f:
+            f.write(b"x" * 100)
+
+        self.assertEqual(self.part.read_bytes(), b"x" * 100)
+
+    def test_resumable_not_preallocated(self):
+        # Killed part way through, the size must still be the resume offset.
+        with open_part(self.part, 0, 1000) as f:
+            f.write(b"x" * 100)
+            f.flush()
+            self.assertEqual(self.part.stat().st_size, 100)
+
+    def test_truncated_on_error(self):
+        with self.assertRaises(ConnectionError):
+            with open_part(self.part, 0, 1000) as f:
+                f.write(b"x" * 100)
+                raise ConnectionError
+
+        self.assertEqual(self.part.stat().st_size, 100)
+
+    def test_resume(self):
+        self.part.write_bytes(b"x" * 10)
+        with open_part(self.part, 10, 5) as f:
+            f.write(b"y" * 5)
+
+        self.assertEqual(self.part.read_bytes(), b"x" * 10 + b"y" * 5)
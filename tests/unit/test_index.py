@@ -0,0 +1,37 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from TwitterArchive.index import DownloadIndex
+
+
+class DownloadIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.index = DownloadIndex(self.root / "index.sqlite3", self.root)
+
+    def tearDown(self):
+        self.index.close()
+        self._tmp.cleanup()
+
+    def test_record(self):
+        dest = self.root / "1" / "a.jpg"
+        self.assertFalse(self.index.is_complete(dest))
+
+        self.index.record(dest, "https://foo/a.jpg", 10, complete=False)
+        self.assertFalse(self.index.is_complete(dest))
+
+        self.index.record(dest, "https://foo/a.jpg", 20)
+        self.assertTrue(self.index.is_complete(dest))
+
+    def test_rebuild(self):
+        (self.root / "1").mkdir()
+        (self.root / "1" / "a.jpg").write_bytes(b"foo")
+        (self.root / "1" / "b.mp4.part").write_bytes(b"foo")
+        self.index.record(self.root / "2" / "gone.jpg", None, 3)
+
+        self.assertEqual(self.index.rebuild(), 1)
+        self.assertTrue(self.index.is_complete(self.root / "1" / "a.jpg"))
+        self.assertFalse(self.index.is_complete(self.root / "1" / "b.mp4"))
+        self.assertFalse(self.index.is_complete(self.root / "2" / "gone.jpg"))
@@ -0,0 +1,88 @@
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+
+from TwitterArchive.layout import find_tweet_dirs, migrate, tweet_dir, tweet_time
+
+TWEET_ID = 1585841080431321088
+
+
+class LayoutTestCase(unittest.TestCase):
+    def test_tweet_time(self):
+        expected = datetime(2022, 10, 28, 3, 49, 11, 734000, tzinfo=timezone.utc)
+        self.assertEqual(tweet_time(str(TWEET_ID)), expected)
+
+    def test_tweet_dir(self):
+        base = Path("media")
+        expected = {
+            "flat": base / str(TWEET_ID),
+            "hash": base / "b3" / "3a" / str(TWEET_ID),
+            "date": base / "2022" / "10" / str(TWEET_ID),
+        }
+        for layout, path in expected.items():
+            with self.subTest(layout=layout):
+                self.assertEqual(tweet_dir(base, TWEET_ID, layout), path)
+
+    def test_unknown_layout(self):
+        self.assertRaises(ValueError, tweet_dir, Path("media"), TWEET_ID, "nested")
+
+
+class MigrateTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _save(self, tweet_id, layout, name="a.jpg", data=b"foo"):
+        path = tweet_dir(self.base, tweet_id, layout) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return path
+
+    def test_round_trip(self):
+        ids = [TWEET_ID, TWEET_ID + 1, 1234]
+        for i in ids:
+            self._save(i, "flat")
+        (self.base / "index.sqlite3").write_bytes(b"")
+
+        for layout in ("hash", "date", "flat"):
+            self.assertEqual(migrate(self.base, layout), len(ids))
+            for i in ids:
+                path = tweet_dir(self.base, i, layout) / "a.jpg"
+                self.assertEqual(path.read_bytes(), b"foo")
+            self.assertEqual(len(list(find_tweet_dirs(self.base))), len(ids))
+
+        # Only the tweets, and files that are not media, are left.
+        expected = sorted([str(i) for i in ids] + ["index.sqlite3"])
+        self.assertEqual(sorted(p.name for p in self.base.iterdir()), expected)
+
+    def test_already_migrated(self):
+        self._save(TWEET_ID, "date")
+
+        self.assertEqual(migrate(self.base, "date"), 0)
+
+    def test_empty_removed(self):
+        self._save(TWEET_ID, "flat")
+        (self.base / "1234").mkdir()
+        (self.base / "notes").mkdir()
+
+        self.assertEqual(migrate(self.base, "hash"), 1)
+
+        self.assertFalse((self.base / "1234").exists())
+        self.assertTrue((self.base / "notes").exists())
+
+    def test_merge_existing(self):
+        self._save(TWEET_ID, "hash", "a.jpg", b"new")
+        self._save(TWEET_ID, "flat", "a.jpg", b"old")
+        self._save(TWEET_ID, "flat", "b.jpg", b"old")
+
+        migrate(self.base, "hash")
+
+        dest = tweet_dir(self.base, TWEET_ID, "hash")
+        self.assertEqual((dest / "a.jpg").read_bytes(), b"new")
+        self.assertEqual((dest / "b.jpg").read_bytes(), b"old")
+        # The duplicate is left for the user to check.
+        self.assertTrue((self.base / str(TWEET_ID) / "a.jpg").exists())
@@ -0,0 +1,88 @@
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from TwitterArchive.manifest import (
+    ManifestWriter,
+    _iter_json_array,
+    is_legacy_manifest,
+    read_manifest,
+    read_manifest_ids,
+)
+
+
+class ManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_round_trip(self):
+        path = self.tmp / "manifest.jsonl"
+        tweets = [{"id": 1, "text": "foo"}, {"id": 2, "text": "bar"}]
+        with ManifestWriter(path) as writer:
+            for tweet in tweets:
+                writer.write(tweet)
+
+        self.assertFalse(is_legacy_manifest(path))
+        self.assertEqual(list(read_manifest(path)), tweets)
+
+    def test_read_legacy(self):
+        path = self.tmp / "manifest.json"
+        tweets = [{"id": 1, "text": "foo"}, {"id": 2, "text": "bar"}]
+        path.write_text(json.dumps(tweets, indent=2))
+
+        self.assertTrue(is_legacy_manifest(path))
+        self.assertEqual(list(read_manifest(path)), tweets)
+        self.assertEqual(read_manifest_ids(path), {1, 2})
+
+    def test_append_upgrades_legacy(self):
+        path = self.tmp / "manifest.json"
+        path.write_text(json.dumps([{"id": 1}]))
+
+        with ManifestWriter(path, append=True) as writer:
+            writer.write({"id": 2})
+
+        self.assertFalse(is_legacy_manifest(path))
+        self.assertEqual(list(read_manifest(path)), [{"id": 1}, {"id": 2}])
+
+
+class JSONArrayStreamTestCase(unittest.TestCase):
+    def _decode(self, text, chunk_size=4):
+        return list(_iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+    def test_matches_json_load(self):
+        tweets = [{"id": i, "text": "x" * i, "media": [{"k": i}]} for i in range(20)]
+        text = json.dumps(tweets, indent=2)
+
+        for chunk_size in (1, 3, 7, 64, 4096):
+            self.assertEqual(self._decode(text, chunk_size), tweets)
+
+    def test_scalars_across_chunks(self):
+        self.assertEqual(self._decode("[12345, 67890, true]", 2), [12345, 67890, True])
+
+    def test_numbers_split_in_chunks(self):
+        text = "[1.5, 2e3, -0.25E-2, 10]"
+        expected = [1.5, 2e3, -0.25e-2, 10]
+        for chunk_size in range(1, len(text) + 1):
+            self.assertEqual(self._decode(text, chunk_size), expected)
+        self.assertEqual(self._decode("[1.5]", 3), [1.5])
+
+    def test_empty(self):
+        self.assertEqual(self._decode("  [ ] "), [])
+
+    def test_lazy(self):
+        fp = io.StringIO(json.dumps([{"id": 1}, {"id": 2}, {"id": 3}]))
+        items = _iter_json_array(fp, chunk_size=8)
+
+        self.assertEqual(next(items), {"id": 1})
+        self.assertLess(fp.tell(), len(fp.getvalue()))
+
+    def test_invalid(self):
+        for text in ("{}", "[1, 2", "[1 2]", "[1,]"):
+            with self.assertRaises(json.JSONDecodeError):
+                self._decode(text)
@@ -0,0 +1,87 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from TwitterArchive.metrics import Metrics, MetricsExporter
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_counters(self):
+        metrics = Metrics()
+        metrics.inc("transfers_total", result="complete")
+        metrics.inc("transfers_total", result="complete")
+        metrics.inc("transfers_total", result="error")
+        metrics.inc("bytes_total", 100)
+
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(
+            counters,
+            [
+                {"name": "bytes_total", "labels": {}, "value": 100},
+                {
+                    "name": "transfers_total",
+                    "labels": {"result": "complete"},
+                    "value": 2,
+                },
+                {"name": "transfers_total", "labels": {"result": "error"}, "value": 1},
+            ],
+        )
+
+    def test_histogram(self):
+        metrics = Metrics(buckets=(1, 10))
+        for value in (0.5, 5, 50):
+            metrics.observe("seconds", value)
+
+        (histogram,) = metrics.snapshot()["histograms"]
+        self.assertEqual(histogram["buckets"], {1: 1, 10: 1})
+        self.assertEqual(histogram["count"], 3)
+        self.assertEqual(histogram["sum"], 55.5)
+
+    def test_time_records_on_error(self):
+        metrics = Metrics()
+        with self.assertRaises(ValueError):
+            with metrics.time("seconds"):
+                raise ValueError
+
+        self.assertEqual(metrics.snapshot()["histograms"][0]["count"], 1)
+
+    def test_prometheus(self):
+        metrics = Metrics(buckets=(1, 10))
+        metrics.inc("bytes_total", 100)
+        metrics.set("run_seconds", 2.5)
+        metrics.observe("seconds", 5, stage="api")
+
+        expected = """\
+# TYPE twitter_archive_bytes_total counter
+twitter_archive_bytes_total 100
+# TYPE twitter_archive_run_seconds gauge
+twitter_archive_run_seconds 2.5
+# TYPE twitter_archive_seconds histogram
+twitter_archive_seconds_bucket{stage="api",le="1.0"} 0
+twitter_archive_seconds_bucket{stage="api",le="10.0"} 1
+twitter_archive_seconds_bucket{stage="api",le="+Inf"} 1
+twitter_archive_seconds_sum{stage="api"} 5.0
+twitter_archive_seconds_count{stage="api"} 1
+"""
+        self.assertEqual(metrics.to_prometheus(), expected)
+
+    def test_write_unknown_format_raises(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "metrics"
+            self.assertRaises(ValueError, Metrics().write, path, "xml")
+
+
+class MetricsExporterTestCase(unittest.TestCase):
+    def test_writes_on_stop(self):
+        metrics = Metrics()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "metrics.json"
+            exporter = MetricsExporter(metrics, path)
+            metrics.inc("bytes_total", 100)
+            exporter.stop()
+
+            snapshot = json.loads(path.read_text())
+
+        self.assertEqual(snapshot["counters"][0]["value"], 100)
+        self.assertEqual(snapshot["gauges"][0]["name"], "run_seconds")
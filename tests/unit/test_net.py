@@ -0,0 +1,127 @@
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+from TwitterArchive.net import (
+    CircuitBreaker,
+    CircuitOpenError,
+    IncompleteDownloadError,
+    RetryPolicy,
+    is_congestion,
+)
+
+
+def _http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+class IsCongestionTestCase(unittest.TestCase):
+    def test_is_congestion(self):
+        self.assertTrue(is_congestion(_http_error(429)))
+        self.assertTrue(is_congestion(_http_error(503)))
+        self.assertTrue(is_congestion(requests.ConnectionError()))
+        self.assertTrue(is_congestion(requests.Timeout()))
+        self.assertTrue(is_congestion(IncompleteDownloadError()))
+        self.assertFalse(is_congestion(_http_error(404)))
+        self.assertFalse(is_congestion(_http_error(500)))
+        self.assertFalse(is_congestion(ValueError()))
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=60)
+        breaker.failure("a")
+        breaker.check("a")
+        breaker.failure("a")
+
+        self.assertRaises(CircuitOpenError, breaker.check, "a")
+        # Other hosts are unaffected.
+        breaker.check("b")
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=60)
+        breaker.failure("a")
+        breaker.success("a")
+        breaker.failure("a")
+
+        breaker.check("a")
+
+    def test_half_open_single_trial(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=60)
+        breaker.failure("a")
+
+        later = time.monotonic() + 120
+        with mock.patch("time.monotonic", return_value=later):
+            breaker.check("a")
+            # Only one trial request while half open.
+            self.assertRaises(CircuitOpenError, breaker.check, "a")
+        breaker.success("a")
+        breaker.check("a")
+
+    def test_reset(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=60)
+        breaker.failure("a")
+        breaker.reset()
+
+        breaker.check("a")
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+    def test_is_retryable(self):
+        retry = RetryPolicy()
+
+        self.assertTrue(retry.is_retryable(_http_error(503)))
+        self.assertTrue(retry.is_retryable(_http_error(429)))
+        self.assertTrue(retry.is_retryable(requests.ConnectionError()))
+        self.assertTrue(retry.is_retryable(requests.Timeout()))
+        self.assertFalse(retry.is_retryable(_http_error(404)))
+        self.assertFalse(retry.is_retryable(ValueError()))
+
+    def test_delay_retry_after(self):
+        retry = RetryPolicy(max_backoff=10)
+
+        self.assertEqual(retry.delay(1, _http_error(429, {"Retry-After": "3"})), 3)
+        self.assertEqual(retry.delay(1, _http_error(429, {"Retry-After": "99"})), 10)
+
+    def test_delay_jitter_bounds(self):
+        retry = RetryPolicy(backoff=1, max_backoff=5)
+
+        for attempt in range(1, 10):
+            delay = retry.delay(attempt, requests.Timeout())
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(5, 2**attempt))
+
+    def test_call_retries(self):
+        retry = RetryPolicy(attempts=3, backoff=0)
+        func = mock.Mock(side_effect=[requests.Timeout(), _http_error(503), "ok"])
+
+        self.assertEqual(retry.call(func, "http://a/b"), "ok")
+        self.assertEqual(func.call_count, 3)
+
+    def test_call_gives_up(self):
+        retry = RetryPolicy(attempts=2, backoff=0)
+        func = mock.Mock(side_effect=requests.Timeout())
+
+        self.assertRaises(requests.Timeout, retry.call, func, "http://a/b")
+        self.assertEqual(func.call_count, 2)
+
+    def test_call_not_retryable(self):
+        retry = RetryPolicy(backoff=0)
+        func = mock.Mock(side_effect=_http_error(404))
+
+        self.assertRaises(requests.HTTPError, retry.call, func, "http://a/b")
+        self.assertEqual(func.call_count, 1)
+
+    def test_defer_drain(self):
+        retry = RetryPolicy()
+        retry.defer({"id": 1})
+        retry.defer({"id": 2})
+        retry.defer({"id": 1})
+
+        self.assertEqual(retry.drain(), [{"id": 1}, {"id": 2}])
+        self.assertEqual(retry.drain(), [])
@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+
+from TwitterArchive.pipeline import merge_sources, run_pipeline
+
+
+class PipelineTestCase(unittest.TestCase):
+    def test_processes_all(self):
+        seen = []
+        lock = threading.Lock()
+
+        def func(item):
+            with lock:
+                seen.append(item)
+
+        run_pipeline(range(100), func, 4, maxsize=5)
+        self.assertEqual(sorted(seen), list(range(100)))
+
+    def test_overlaps_producer(self):
+        started = threading.Event()
+
+        def items():
+            yield 1
+            # The first item must be consumed before the producer finishes.
+            self.assertTrue(started.wait(timeout=5))
+            yield 2
+
+        run_pipeline(items(), lambda _: started.set(), 1)
+
+    def test_backpressure(self):
+        produced = []
+        release = threading.Event()
+
+        def items():
+            for i in range(50):
+                produced.append(i)
+                yield i
+
+        def func(item):
+            release.wait(timeout=5)
+
+        t = threading.Thread(target=run_pipeline, args=(items(), func, 1, 3))
+        t.start()
+        time.sleep(0.2)
+        # One item in flight, three queued, one blocked on put.
+        self.assertLessEqual(len(produced), 5)
+        release.set()
+        t.join()
+        self.assertEqual(len(produced), 50)
+
+    def test_consumer_error(self):
+        def func(item):
+            if item == 3:
+                raise ValueError("foo")
+
+        with self.assertRaises(ValueError):
+            run_pipeline(range(1000), func, 2, maxsize=2)
+
+    def test_producer_error(self):
+        def items():
+            yield 1
+            raise RuntimeError("foo")
+
+        with self.assertRaises(RuntimeError):
+            run_pipeline(items(), lambda _: None, 2)
+
+
+class MergeSourcesTestCase(unittest.TestCase):
+    def test_merges_all(self):
+        sources = [("a", range(50)), ("b", range(30)), ("c", [])]
+        merged = list(merge_sources(sources, maxsize=4))
+
+        self.assertEqual(sorted(i for k, i in merged if k == "a"), list(range(50)))
+        self.assertEqual(sorted(i for k, i in merged if k == "b"), list(range(30)))
+        self.assertEqual(len(merged), 80)
+
+    def test_slow_source_does_not_block(self):
+        release = threading.Event()
+
+        def slow():
+            self.assertTrue(release.wait(timeout=5))
+            yield 1
+
+        merged = merge_sources([("slow", slow()), ("fast", [1, 2])])
+        self.assertEqual(next(merged), ("fast", 1))
+        self.assertEqual(next(merged), ("fast", 2))
+        release.set()
+        self.assertEqual(list(merged), [("slow", 1)])
+
+    def test_source_error(self):
+        def failing():
+            yield 1
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            list(merge_sources([("a", failing())]))
@@ -0,0 +1,39 @@
+import io
+import unittest
+from unittest import mock
+
+from TwitterArchive.progress import Progress
+
+
+class ProgressTestCase(unittest.TestCase):
+    def test_counts(self):
+        with Progress(disable=True) as progress:
+            for _ in range(3):
+                progress.found()
+            progress.done()
+            progress.update(1024)
+            progress.update(1024)
+
+        self.assertEqual(progress.files_found, 3)
+        self.assertEqual(progress.files_done, 1)
+        self.assertEqual(progress.nbytes, 2048)
+
+    def test_disabled_never_draws(self):
+        with Progress(disable=True) as progress:
+            self.assertIsNone(progress._thread)
+            self.assertIsNone(progress._bar)
+
+    def test_single_bar(self):
+        stderr = io.StringIO()
+        with mock.patch("sys.stderr", stderr):
+            with Progress(interval=0.01) as progress:
+                progress.found()
+                progress.found()
+                progress.done()
+                progress.update(3 * 1024**2)
+            # Stopped, so the final counts are drawn.
+            self.assertIsNone(progress._thread)
+
+        last = stderr.getvalue().split("\r")[-1]
+        self.assertIn("1/2", last)
+        self.assertIn("3.15MB", last)
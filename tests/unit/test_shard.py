@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+from collections import Counter
+from pathlib import Path
+
+from TwitterArchive.layout import tweet_dir
+from TwitterArchive.shard import select_shard, shard_of, verify
+
+# Snowflake IDs of tweets posted in the same millisecond range, so only their
+# low bits differ.
+TWEETS = [{"id": str((1585841080431321088 >> 12 << 12) + i * 4096)} for i in range(400)]
+
+
+class ShardTestCase(unittest.TestCase):
+    def test_partition(self):
+        shards = [list(select_shard(TWEETS, i, 4)) for i in range(4)]
+
+        ids = sorted(t["id"] for shard in shards for t in shard)
+        self.assertEqual(ids, sorted(t["id"] for t in TWEETS))
+        # Even if every ID has the same low bits.
+        for shard in shards:
+            self.assertGreater(len(shard), 50)
+
+    def test_deterministic(self):
+        counts = Counter(shard_of(t["id"], 3) for t in TWEETS)
+
+        self.assertEqual(counts, Counter(shard_of(int(t["id"]), 3) for t in TWEETS))
+        self.assertEqual(set(counts), {0, 1, 2})
+
+
+class VerifyTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_verify(self):
+        tweets = [
+            {"id": i, "media": [{"type": "photo", "url": f"http://x/{i}.jpg"}]}
+            for i in range(3)
+        ]
+        for i in (0, 2):
+            dest = tweet_dir(self.base, i, "hash") / f"{i}.jpg"
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            dest.write_bytes(b"foo")
+        # Partial downloads are still missing.
+        (self.base / "1").mkdir()
+        (self.base / "1" / "1.jpg.part").write_bytes(b"foo")
+
+        missing = verify(tweets, self.base)
+
+        self.assertEqual(missing, [self.base / str(i) / f"{i}.jpg" for i in range(3)])
+        missing = verify(tweets, self.base, "hash")
+        self.assertEqual([p.name for p in missing], ["1.jpg"])
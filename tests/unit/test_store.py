@@ -0,0 +1,47 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from TwitterArchive.store import MediaStore, link
+
+
+class MediaStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.store = MediaStore(self.tmp / "store")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _stage(self, media_key, data):
+        path = self.store.staging_path(media_key, "foo.jpg")
+        path.write_bytes(data)
+        return path
+
+    def test_lookup_missing(self):
+        self.assertIsNone(self.store.lookup("3_1", "foo.jpg"))
+
+    def test_add(self):
+        stored = self.store.add(self._stage("3_1", b"foo"), "3_1")
+
+        self.assertEqual(stored.read_bytes(), b"foo")
+        self.assertEqual(self.store.lookup("3_1", "foo.jpg"), stored)
+        self.assertEqual(stored.suffix, ".jpg")
+
+    def test_add_same_content(self):
+        first = self.store.add(self._stage("3_1", b"foo"), "3_1")
+        second = self.store.add(self._stage("3_2", b"foo"), "3_2")
+
+        self.assertTrue(first.samefile(second))
+        objects = list((self.store.root / "objects").glob("*/*"))
+        self.assertEqual(len(objects), 1)
+
+    def test_link_replaces(self):
+        stored = self.store.add(self._stage("3_1", b"foo"), "3_1")
+        dest = self.tmp / "dest.jpg"
+        dest.write_bytes(b"bar")
+        link(stored, dest)
+
+        self.assertEqual(dest.read_bytes(), b"foo")
+        self.assertTrue(dest.samefile(stored))
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from TwitterArchive.throttle import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.multiple(
+            "TwitterArchive.throttle.time",
+            monotonic=self.clock.monotonic,
+            sleep=self.clock.sleep,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_free(self):
+        bucket = TokenBucket(1000)
+        bucket.consume(1000)
+
+        self.assertEqual(self.clock.slept, [])
+
+    def test_debt_slept_off(self):
+        bucket = TokenBucket(1000, burst=0)
+        bucket.consume(250)
+        bucket.consume(250)
+
+        self.assertEqual(self.clock.slept, [0.25, 0.25])
+
+    def test_rate(self):
+        # The average rate holds at low and high rates alike.
+        for rate in (10 * 1024, 100 * 1024**2):
+            with self.subTest(rate=rate):
+                bucket = TokenBucket(rate)
+                start = self.clock.now
+                for _ in range(100):
+                    bucket.consume(bucket.chunk_size)
+                elapsed = self.clock.now - start
+                expected = (100 * bucket.chunk_size - rate) / rate
+                self.assertAlmostEqual(elapsed, expected)
+
+    def test_refill_capped_at_burst(self):
+        bucket = TokenBucket(1000)
+        self.clock.now += 60
+        bucket.consume(3000)
+
+        self.assertEqual(self.clock.slept, [2.0])
+
+    def test_chunk_size(self):
+        self.assertEqual(TokenBucket(10 * 1024**2).chunk_size, 1024**2)
+        self.assertEqual(TokenBucket(1024).chunk_size, 16 * 1024)
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+
+class SharedTokenBucketTestCase(unittest.TestCase):
+    def test_threads_share_rate(self):
+        bucket = TokenBucket(400 * 1024, burst=0)
+
+        def worker():
+            for _ in range(4):
+                bucket.consume(10 * 1024)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 160 KiB at 400 KiB/s, whatever the number of threads.
+        self.assertGreaterEqual(time.monotonic() - start, 0.35)
+
+    def test_async(self):
+        bucket = TokenBucket(100 * 1024, burst=0)
+
+        async def main():
+            await asyncio.gather(*(bucket.consume_async(5 * 1024) for _ in range(4)))
+
+        start = time.monotonic()
+        asyncio.run(main())
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
@@ -0,0 +1,149 @@
+import http.server
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs
+
+import requests
+
+from TwitterArchive.core import auth
+from TwitterArchive.tokens import TokenRefresher, refresh_token
+
+
+class TokenHandler(http.server.BaseHTTPRequestHandler):
+    """Token endpoint, rotating the refresh token on every refresh."""
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        form = parse_qs(self.rfile.read(length).decode())
+        self.server.requests.append((form, self.headers.get("Authorization")))
+
+        if self.server.fail or form["refresh_token"] != [self.server.refresh_token]:
+            self.send_response(400)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        n = len(self.server.requests)
+        self.server.refresh_token = f"refresh-{n}"
+        body = json.dumps(
+            {
+                "token_type": "bearer",
+                "expires_in": 7200,
+                "access_token": f"access-{n}",
+                "scope": "tweet.read offline.access",
+                "refresh_token": self.server.refresh_token,
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TokenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.HTTPServer(("127.0.0.1", 0), TokenHandler)
+        self.server.requests = []
+        self.server.refresh_token = "refresh-0"
+        self.server.fail = False
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        host, port = self.server.server_address
+        self.url = f"http://{host}:{port}/2/oauth2/token"
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self.cache = Path(self._tmp.name) / "access_token.json"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._tmp.cleanup()
+
+    def _token(self, expires_in):
+        return {
+            "access_token": "access-0",
+            "refresh_token": "refresh-0",
+            "expires_at": time.time() + expires_in,
+        }
+
+    def test_refresh_token(self):
+        token = refresh_token(self._token(-1), "id", "secret", self.url)
+
+        self.assertEqual(token["access_token"], "access-1")
+        self.assertEqual(token["refresh_token"], "refresh-1")
+        self.assertEqual(token["scope"], ["tweet.read", "offline.access"])
+        self.assertGreater(token["expires_at"], time.time() + 7000)
+
+        form, authorization = self.server.requests[0]
+        self.assertEqual(form["grant_type"], ["refresh_token"])
+        self.assertEqual(form["client_id"], ["id"])
+        self.assertTrue(authorization.startswith("Basic "))
+
+    def test_refresh_ahead_of_expiry(self):
+        refresher = TokenRefresher(
+            self._token(60), self.cache, "id", margin=300, token_url=self.url
+        )
+
+        self.assertEqual(refresher.access_token(), "access-1")
+        self.assertEqual(refresher.access_token(), "access-1")
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(json.loads(self.cache.read_text())["access_token"], "access-1")
+        self.assertEqual(os.stat(self.cache).st_mode & 0o777, 0o600)
+
+    def test_fresh_token_not_refreshed(self):
+        refresher = TokenRefresher(
+            self._token(3600), self.cache, "id", token_url=self.url
+        )
+
+        self.assertEqual(refresher.access_token(), "access-0")
+        self.assertEqual(self.server.requests, [])
+
+    def test_failed_refresh_before_expiry(self):
+        self.server.fail = True
+        refresher = TokenRefresher(
+            self._token(60), self.cache, "id", margin=300, token_url=self.url
+        )
+
+        self.assertEqual(refresher.access_token(), "access-0")
+
+    def test_failed_refresh_after_expiry_raises(self):
+        self.server.fail = True
+        refresher = TokenRefresher(
+            self._token(-1), self.cache, "id", token_url=self.url
+        )
+
+        self.assertRaises(requests.HTTPError, refresher.access_token)
+
+    def test_auth_refreshes_expired_cache(self):
+        self.cache.write_text(json.dumps(self._token(-1)))
+
+        with mock.patch("TwitterArchive.tokens.TOKEN_URL", self.url), mock.patch(
+            "TwitterArchive.core._oauth", side_effect=AssertionError("Reauthenticated")
+        ):
+            client = auth(self.cache, client_id="id", client_secret="secret")
+
+        self.assertEqual(client.bearer_token, "access-1")
+        self.assertEqual(json.loads(self.cache.read_text())["access_token"], "access-1")
+
+    def test_auth_reauthenticates_without_refresh_token(self):
+        token = self._token(-1)
+        del token["refresh_token"]
+        self.cache.write_text(json.dumps(token))
+
+        new_token = self._token(7200)
+        with mock.patch("TwitterArchive.core._oauth", return_value=new_token) as oauth:
+            client = auth(self.cache, client_id="id", client_secret="secret")
+
+        oauth.assert_called_once()
+        self.assertEqual(client.bearer_token, "access-0")
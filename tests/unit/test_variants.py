@@ -0,0 +1,122 @@
+import unittest
+from pathlib import Path
+
+from TwitterArchive.core import iter_media
+from TwitterArchive.variants import VariantPolicy, photo_size_url, variant_key
+
+BASE = "https://video.twimg.com/ext_tw_video/1/pu/vid"
+
+
+def _video(key="7_1", duration_ms=10000):
+    # Ten seconds at 2176000 bits/s is 2720000 bytes.
+    return {
+        "media_key": key,
+        "type": "video",
+        "duration_ms": duration_ms,
+        "variants": [
+            {"content_type": "application/x-mpegURL", "url": f"{BASE}/pl.m3u8"},
+            {"bit_rate": 256000, "url": f"{BASE}/480x270/low.mp4"},
+            {"bit_rate": 2176000, "url": f"{BASE}/1280x720/high.mp4"},
+            {"bit_rate": 832000, "url": f"{BASE}/640x360/mid.mp4"},
+        ],
+    }
+
+
+def _photo(width=4096, height=2048):
+    url = "https://pbs.twimg.com/media/abc.jpg"
+    return {"type": "photo", "url": url, "width": width, "height": height}
+
+
+class VariantPolicyTestCase(unittest.TestCase):
+    def _urls(self, policy, media):
+        tweet = {"id": 1, "media": media}
+        return [url for _, url, _ in iter_media(tweet, Path("media"), policy)]
+
+    def test_default(self):
+        urls = self._urls(VariantPolicy(), [_video(), _photo()])
+
+        expected = [f"{BASE}/1280x720/high.mp4", "https://pbs.twimg.com/media/abc.jpg"]
+        self.assertEqual(urls, expected)
+
+    def test_max_bitrate(self):
+        policy = VariantPolicy(max_bitrate=1000000)
+
+        self.assertEqual(policy.select_video(_video())["bit_rate"], 832000)
+
+    def test_max_resolution(self):
+        policy = VariantPolicy(max_resolution=300)
+
+        self.assertEqual(policy.select_video(_video())["bit_rate"], 256000)
+
+    def test_nothing_allowed_picks_lowest(self):
+        policy = VariantPolicy(max_bitrate=1)
+
+        self.assertEqual(policy.select_video(_video())["bit_rate"], 256000)
+
+    def test_byte_budget(self):
+        # Room for the highest bitrate once, then the lowest, then nothing.
+        policy = VariantPolicy(byte_budget=2720000 + 400000)
+
+        chosen = [policy.select_video(_video(key=str(i))) for i in range(3)]
+
+        self.assertEqual(chosen[0]["bit_rate"], 2176000)
+        self.assertEqual(chosen[1]["bit_rate"], 256000)
+        self.assertIsNone(chosen[2])
+        self.assertEqual(policy.videos_skipped, 1)
+        self.assertEqual(policy.videos_downgraded, 1)
+
+    def test_retry_keeps_choice(self):
+        policy = VariantPolicy(byte_budget=2720000)
+
+        first = policy.select_video(_video())
+        again = policy.select_video(_video())
+
+        self.assertIs(first, again)
+        self.assertEqual(policy.videos, 1)
+        self.assertEqual(policy.chosen_bytes, 2720000)
+
+    def test_no_memo_without_budget(self):
+        policy = VariantPolicy(max_bitrate=1000000)
+        for i in range(3):
+            policy.select_video(_video(key=str(i)))
+
+        self.assertIsNone(policy._chosen)
+        self.assertEqual(policy.videos, 3)
+
+    def test_variant_key(self):
+        video, photo = _video(), dict(_photo(), media_key="3_1")
+
+        self.assertEqual(variant_key(video, f"{BASE}/1280x720/high.mp4"), "7_1")
+        self.assertEqual(variant_key(video, f"{BASE}/480x270/low.mp4"), "7_1-256000")
+        self.assertEqual(variant_key(photo, photo["url"]), "3_1")
+        url = photo_size_url(photo["url"], "small")
+        self.assertEqual(variant_key(photo, url), "3_1-small")
+
+    def test_photo_size(self):
+        policy = VariantPolicy(photo_size="medium")
+        tweet = {"id": 1, "media": [_photo()]}
+
+        ((_, url, dest),) = iter_media(tweet, Path("media"), policy)
+
+        self.assertEqual(url, "https://pbs.twimg.com/media/abc.jpg?name=medium")
+        self.assertEqual(dest.name, "abc.jpg")
+        self.assertEqual(policy.photos_resized, 1)
+
+    def test_photo_size_url_keeps_query(self):
+        url = photo_size_url("https://pbs.twimg.com/media/abc?format=jpg", "large")
+
+        self.assertEqual(url, "https://pbs.twimg.com/media/abc?format=jpg&name=large")
+
+    def test_unknown_photo_size(self):
+        self.assertRaises(ValueError, VariantPolicy, photo_size="huge")
+
+    def test_report(self):
+        policy = VariantPolicy(max_resolution=360, photo_size="large")
+        self._urls(policy, [_video(), _video(key="7_2", duration_ms=None), _photo()])
+
+        report = policy.report()
+
+        self.assertIn("Videos: 2 (2 downgraded, 0 skipped, 1 without", report)
+        self.assertIn("2.6 MB at the highest bitrate, 1.0 MB selected", report)
+        self.assertIn("Photos: 1 (1 resized to large)", report)
+        self.assertIn("About 25% of the original pixels", report)